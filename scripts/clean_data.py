@@ -4,22 +4,49 @@ and returns cleaned datasets into the directory ../data/cleaned
 """
 
 import os
+import re
+import argparse
 import pandas as pd
 
 import sys
 sys.path.append("../")
-from src.data_cleaning import clean_data, keep_only_english, reduce_df
+from src.data_cleaning import clean_data, keep_only_english, reduce_df, REDUCED_COLUMNS
+from src.processed_store import read_processed
+from src.adjacent_planner import ALL_COMBINATIONS
 
 import warnings
 from bs4 import MarkupResemblesLocatorWarning
 warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning, module='src.data_cleaning')
 
+def time_stamp_of(file_name):
+    # the time stamp (YYYYmmdd_HHMMSS) at the end of a file name, before the extension
+    return os.path.splitext(file_name)[0][-15:]
+
+def trend_type_of(file_name):
+    # the label of an adjacent file, from the mode and account focus in its name, numbered 
+    # in the order of ALL_COMBINATIONS, which is also the order of the files of a complete run;
+    # runs without new data for a combination do not write its file
+    match = re.search(r"adjacent_statuses_(\w+?)_acc_focus_(yes|no)", os.path.basename(file_name))
+    return "adjacent_" + str(ALL_COMBINATIONS.index((match.group(1), match.group(2))) + 1)
+
+def read_df(path):
+    # processed files are Feather files, memory-mapped; older runs saved csv files
+    if path.endswith(".csv"):
+        return pd.read_csv(path, index_col = 0)
+    return read_processed(path)
+
 def main():
 
+    parser = argparse.ArgumentParser(description = "Clean the processed datasets.")
+    parser.add_argument("--jobs", type = int, default = 1, 
+                        help = "number of processes for the row-wise cleaning steps (default: 1)")
+    args = parser.parse_args()
+
     print("Checking for datasets to transform...")
 
     # get the list of files in the processed directory
-    list_files = [f for f in os.listdir("../data/processed") if os.path.isfile(os.path.join("../data/processed", f))]
+    list_files = [f for f in os.listdir("../data/processed") if os.path.isfile(os.path.join("../data/processed", f)) 
+                  and f.endswith((".feather", ".csv"))]
 
     # check the processed directory, stop if empty
     if len(list_files) == 0:
@@ -34,8 +61,8 @@ def main():
         # if it is not empty, remove the existing file names from the list of files to be cleaned, based on timestamps
         if len(list_files_cleaned) > 0:
             print(f"Found {len(list_files_cleaned)} files in the directory ../data/cleaned.")
-            already_cleaned_timestamps = [name[-19:-4] for name in list_files_cleaned]
-            list_files = [f for f in list_files if f[-19:-4] not in already_cleaned_timestamps]
+            already_cleaned_timestamps = [time_stamp_of(name) for name in list_files_cleaned]
+            list_files = [f for f in list_files if time_stamp_of(f) not in already_cleaned_timestamps]
             # if there is no more files to clean, stop
             if len(list_files) == 0:
                 print("All files in the directory ../data/processed had been transformed already.")
@@ -56,33 +83,33 @@ def main():
     paths_adjacent.sort()
 
     # output df names will have the timestamp of the corresponding trending statuses
-    df_names = ["df_" + f[-19:-4] for f in list_files if f[:8] == "trending"]
+    df_names = ["df_" + time_stamp_of(f) for f in sorted(list_files) if f[:8] == "trending"]
 
     # match trending datasets with correponding adjacent datasets, based on timestamps
     match_dfs = {}
     for path in paths_trending:
-        match_dfs[path] = [p for p in paths_adjacent if path[-19:-4] in p]
+        match_dfs[path] = [p for p in paths_adjacent if time_stamp_of(path) in p]
     
     # collect processed dfs in a dictionary
     dict_dfs = {}
     for path, name in zip(match_dfs.keys(), df_names):
         # first the trending :
         print(f"Reading df: {path}...")
-        main_df = pd.read_csv(path, index_col = 0)
+        main_df = read_df(path)
         # process:
         print("...processing...")
-        main_df = clean_data(main_df)
+        main_df = clean_data(main_df, n_jobs = args.jobs, columns = REDUCED_COLUMNS)
         main_df = keep_only_english(main_df)
         main_df = reduce_df(main_df)
         main_df["trend"] = "trending"
         # next, go through the adjacent:
         for adj_path in match_dfs[path]:
-            trend_type = "adjacent_" + str(match_dfs[path].index(adj_path) + 1)
+            trend_type = trend_type_of(adj_path)
             print(f"Reading df: {adj_path}...")
-            adj_df = pd.read_csv(adj_path, index_col = 0)
+            adj_df = read_df(adj_path)
             # process:
             print("...processing...")
-            adj_df = clean_data(adj_df)
+            adj_df = clean_data(adj_df, n_jobs = args.jobs, columns = REDUCED_COLUMNS)
             adj_df = keep_only_english(adj_df)
             adj_df = reduce_df(adj_df)
             adj_df["trend"] = trend_type
@@ -1,17 +1,28 @@
 """
 This script fetches data on trending statuses and their adjacent statuses, 
-and saves them to pickle files containing corresponding class objects.
+and saves them as raw data (compressed Parquet files of the statuses and
+the metadata of their requests) and as processed dataframes (Feather
+files, with typed list and time columns).
 """
 
 import os
 import sys
-import pickle
+import shutil
+import argparse
 from datetime import datetime
 import pandas as pd
 
 sys.path.append("../")
 from src.trending_statuses import TrendingStatuses
 from src.adjacent_statuses import AdjacentStatuses
+from src.adjacent_planner import AdjacentPlanner, ALL_COMBINATIONS
+from src.collection_state import CollectionState
+from src.response_cache import ResponseCache
+from src.multi_instance import MultiInstanceCollector
+from src.instrumentation import write_metrics
+from src.status_records import DEFAULT_FIELDS
+from src.raw_store import write_raw
+from src.processed_store import write_processed
 
 def prep_dirs():
     # Create necessary directories, if don't not exist
@@ -40,14 +51,16 @@ def check_app_token():
               "\nProceeding without token.")
         return None
 
-def get_trending(app_token = None, max_batches = 25, n_per_batch = 40):
+def get_trending(app_token = None, max_batches = 25, n_per_batch = 40, prefetch = 5, cache = None, 
+                 fields = DEFAULT_FIELDS):
     
-    # Get trending status data as class instance
-    trending_statuses = TrendingStatuses(token = app_token)
+    # Get trending status data as class instance, reusing cached responses if a cache is given,
+    # and keeping only the given fields of the statuses (all of them if None)
+    trending_statuses = TrendingStatuses(token = app_token, cache = cache, fields = fields)
 
     # Get data
     print("WORKING ON TRENDING STATUS DATA...")
-    trending_statuses.get_data(max_batches = max_batches, n_per_batch = n_per_batch)
+    trending_statuses.get_data(max_batches = max_batches, n_per_batch = n_per_batch, prefetch = prefetch)
     print("...DATA FETCHED.")
 
     return trending_statuses
@@ -64,40 +77,171 @@ def get_adjacent(reference, mode, focus_accounts):
 
     return adjacent_statuses
 
-def save_raw_and_processed(data, type, time_stamp):
-    # Save class instances as raw data, and pandas dataframes as processed data
+def get_all_adjacent(reference, combinations = ALL_COMBINATIONS, state = None, recollect = False, 
+                     checkpoint_dir = None):
+
+    # Get adjacent status data for all combinations of mode and focus in one job,
+    # skipping the reference statuses collected in previous runs if a state is given
+    planner = AdjacentPlanner(reference = reference, combinations = combinations, 
+                              state = state, recollect = recollect)
+
+    # Get data, saving checkpoints if a directory is given
+    print("WORKING ON ADJACENT STATUS DATA (all modes and account focus)...")
+    planner.run(coalesce = True, checkpoint_dir = checkpoint_dir)
+    print("...DATA FETCHED.")
+
+    return planner.results
+
+def resume_all_adjacent(checkpoint_dir, app_token = None):
+
+    # Resume a job interrupted in a previous run from its checkpoint
+    print(f"RESUMING ADJACENT STATUS DATA FROM CHECKPOINT: {checkpoint_dir}...")
+    planner = AdjacentPlanner.from_checkpoint(checkpoint_dir, token = app_token)
+    planner.run(coalesce = True, checkpoint_dir = checkpoint_dir)
+    print("...DATA FETCHED.")
+
+    return planner.results
+
+def find_checkpoints():
+    # Return the time stamps of the interrupted runs, oldest first
+    if not os.path.exists("../data/checkpoints"):
+        return []
+    return sorted([
+        name for name in os.listdir("../data/checkpoints") 
+        if os.path.exists(f"../data/checkpoints/{name}/plan.json.gz")
+    ])
+
+def save_all_adjacent(all_adjacent, time_stamp, state):
+    # Save the adjacent statuses of each mode and focus, named accordingly,
+    # and record the reference statuses as collected once saved
+    for (mode, focus), adjacent_statuses in all_adjacent.items():
+        type_name = f"adjacent_statuses_{mode}_acc_focus_{focus}"
+        if len(adjacent_statuses.data) == 0:
+            print(f"No new data for {type_name}. Nothing to save.")
+            continue
+        save_raw_and_processed(adjacent_statuses, type_name, time_stamp, 
+                               metadata = {"mode": mode, "focus_accounts": focus})
+        state.mark_collected(adjacent_statuses.complete_ids(), mode, focus)
+
+def save_raw_and_processed(data, type, time_stamp, metadata = None):
+    # Save the statuses of the class instance with the metadata of the requests 
+    # (e.g. mode and account focus) as raw data, and pandas dataframes as processed data
 
     # Define file paths and names
-    file_path_r = f"../data/raw/{type}_{time_stamp}.pkl"
-    file_path_p = f"../data/processed/{type}_{time_stamp}.csv"
+    file_path_r = f"../data/raw/{type}_{time_stamp}.parquet"
+    file_path_p = f"../data/processed/{type}_{time_stamp}.feather"
 
     # Save raw data
     print("SAVING RAW DATA...")
-    with open(file_path_r, "wb") as output:
-        pickle.dump(data, output)
+    write_raw(file_path_r, [(data, metadata)])
     print(f"...RAW DATA SAVED TO FILE: {file_path_r}...")
 
     # Save processed data
     print("...EXPORTING DATAFRAME AND SAVING...")
     df = data.generate_df()
-    df.to_csv(file_path_p)
+    write_processed(df, file_path_p)
     print(f"...DATAFRAME SAVED TO FILE: {file_path_p}.")
 
+def get_multi_instance(servers, app_token = None, fields = DEFAULT_FIELDS):
+
+    # Get trending and adjacent status data from several servers at once.
+    # The stored token is for mastodon.social, so it is only used there.
+    collector = MultiInstanceCollector(servers = servers, tokens = {"mastodon.social": app_token}, 
+                                       fields = fields)
+
+    # Get data
+    print(f"WORKING ON STATUS DATA FROM {len(servers)} SERVERS...")
+    collector.run()
+    print("...DATA FETCHED.")
+
+    return collector
+
+def save_multi_instance(collector, time_stamp):
+    # Save the statuses of all servers as raw data, and one merged dataframe per type as processed data
+    file_path_r = f"../data/raw/multi_instance_{time_stamp}.parquet"
+    print("SAVING RAW DATA...")
+    sources = [(trending_statuses, None) for trending_statuses in collector.trending.values()]
+    for results in collector.adjacent.values():
+        for (mode, focus), adjacent_statuses in results.items():
+            sources.append((adjacent_statuses, {"mode": mode, "focus_accounts": focus}))
+    write_raw(file_path_r, sources)
+    print(f"...RAW DATA SAVED TO FILE: {file_path_r}...")
+
+    print("...EXPORTING DATAFRAMES AND SAVING...")
+    types = {"trending_statuses": None}
+    for mode, focus in collector.combinations:
+        types[f"adjacent_statuses_{mode}_acc_focus_{focus}"] = (mode, focus)
+    for type_name, combination in types.items():
+        file_path_p = f"../data/processed/{type_name}_multi_instance_{time_stamp}.feather"
+        write_processed(collector.generate_df(combination), file_path_p)
+        print(f"...DATAFRAME SAVED TO FILE: {file_path_p}.")
+
+def save_metrics(servers, time_stamp):
+    # Save the request metrics of the run as json, and for a Prometheus
+    # textfile collector under a fixed name, replaced at every run
+    file_path_j = f"../data/metrics/run_{time_stamp}.json"
+    file_path_m = "../data/metrics/collection.prom"
+    write_metrics(servers, json_path = file_path_j, prometheus_path = file_path_m)
+    print(f"REQUEST METRICS SAVED TO FILES: {file_path_j}, {file_path_m}.")
+
 if __name__ == "__main__":
+
+    # by default, adjacent statuses are only collected for new trending statuses
+    parser = argparse.ArgumentParser(description = "Collect trending statuses and their adjacent statuses.")
+    parser.add_argument("--recollect", action = "store_true", 
+                        help = "collect adjacent statuses for all trending statuses, including those collected in previous runs")
+    parser.add_argument("--no-cache", action = "store_true", 
+                        help = "do not reuse cached responses of recent runs")
+    parser.add_argument("--servers", nargs = "+", 
+                        help = "collect from these servers in parallel, instead of mastodon.social only")
+    parser.add_argument("--all-fields", action = "store_true", 
+                        help = "keep all fields of the statuses, instead of those used by the data cleaning only")
+    args = parser.parse_args()
     
     # prep
     prep_dirs()
     app_token = check_app_token()
+    fields = None if args.all_fields else DEFAULT_FIELDS
+
+    # several servers: collected and saved together, without the state of previous runs
+    if args.servers:
+        time_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        collector = get_multi_instance(args.servers, app_token = app_token, fields = fields)
+        save_multi_instance(collector, time_stamp)
+        save_metrics(collector.servers, time_stamp)
+        sys.exit()
+
+    state = CollectionState("../data/collection_state.db")
+    state.prune()
+    cache = None if args.no_cache else ResponseCache("../data/cache/responses.db")
+
+    # first finish the interrupted runs, whose trending statuses are already saved,
+    # under their own time stamps; the run then collects new trending statuses as usual
+    servers = set()
+    for resumed_time_stamp in find_checkpoints():
+        resumed_dir = f"../data/checkpoints/{resumed_time_stamp}"
+        resumed_adjacent = resume_all_adjacent(resumed_dir, app_token = app_token)
+        save_all_adjacent(resumed_adjacent, resumed_time_stamp, state)
+        servers.update([adjacent_statuses.server for adjacent_statuses in resumed_adjacent.values()])
+        # the interrupted run is complete, its checkpoint is no longer needed
+        shutil.rmtree(resumed_dir, ignore_errors = True)
 
     # trending
     time_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    trending_statuses = get_trending(app_token = app_token)
+    checkpoint_dir = f"../data/checkpoints/{time_stamp}"
+    trending_statuses = get_trending(app_token = app_token, cache = cache, fields = fields)
     save_raw_and_processed(trending_statuses, "trending_statuses", time_stamp)
 
-    # adjacent, run for each mode and focus, name accordingly
-    for mode in ["previous", "subsequent"]:
-        for focus in ["no", "yes"]:
-            type_name = f"adjacent_statuses_{mode}_acc_focus_{focus}"
-            adjacent_statuses = get_adjacent(reference = trending_statuses, mode = mode, focus_accounts = focus)
-            save_raw_and_processed(adjacent_statuses, type_name, time_stamp)
-
+    # adjacent, run for all modes and focus in one job, skipping the reference
+    # statuses collected by the resumed runs
+    all_adjacent = get_all_adjacent(reference = trending_statuses, state = state, 
+                                    recollect = args.recollect, checkpoint_dir = checkpoint_dir)
+    save_all_adjacent(all_adjacent, time_stamp, state)
+    servers.update([adjacent_statuses.server for adjacent_statuses in all_adjacent.values()])
+    state.close()
+    if cache is not None:
+        cache.close()
+    save_metrics(sorted(servers), time_stamp)
+
+    # the run is complete, its checkpoint is no longer needed
+    shutil.rmtree(checkpoint_dir, ignore_errors = True)
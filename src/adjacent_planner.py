@@ -0,0 +1,263 @@
+"""
+This module defines a class to collect adjacent statuses for several
+combinations of mode ('previous' or 'subsequent') and account focus
+('no' or 'yes') in a single job, instead of one AdjacentStatuses run
+per combination. The requests of all combinations are scheduled in one
+queue and sent by a pool of threads that share the connection pool and
+the rate limiter of the reference TrendingStatuses object.
+"""
+
+# Dependencies
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from src.trending_statuses import TrendingStatuses
+from src.adjacent_statuses import AdjacentStatuses
+from src.collection_state import CollectionState
+from src.checkpoint import write_checkpoint, read_checkpoint
+
+# all combinations of mode and account focus, in the order used by collect_data.py
+ALL_COMBINATIONS = [
+    ("previous", "no"),
+    ("previous", "yes"),
+    ("subsequent", "no"),
+    ("subsequent", "yes")
+]
+
+# Class definition
+class AdjacentPlanner:
+    """
+    This class plans and runs the collection of adjacent statuses for a
+    set of reference statuses, for several combinations of mode and
+    account focus at once.
+    - The argument 'reference' is a TrendingStatuses object, as for
+    AdjacentStatuses. Its session and rate limiter are shared by all
+    requests of the job.
+    - The argument 'combinations' is a list of (mode, focus_accounts)
+    tuples. The default is all four combinations.
+    - The argument 'token' is an optional authorisation token, as for
+    AdjacentStatuses.
+    - The argument 'state' is an optional CollectionState: if given, the
+    reference statuses collected in previous runs are skipped for each 
+    combination, unless 'recollect' is True.
+    The attribute 'results' is a dictionary with one AdjacentStatuses
+    object per combination, keyed by (mode, focus_accounts). The method
+    run() fills their data attributes, so that each one can be exported
+    and saved as if it had been collected on its own.
+    """
+    def __init__(self, reference: TrendingStatuses,
+                 combinations: list = ALL_COMBINATIONS, token: str = None, 
+                 state: CollectionState = None, recollect: bool = False) -> None:
+        self.reference = reference
+        self.combinations = [tuple(combination) for combination in combinations]
+        self.results = {}
+        for mode, focus_accounts in self.combinations:
+            adjacent = AdjacentStatuses(reference = reference, token = token)
+            if (state is not None) and not recollect:
+                n_skipped = adjacent.skip_collected(state, mode, focus_accounts)
+                print(f"Skipping {n_skipped} reference statuses collected in previous runs",
+                      f"(mode: {mode}, account focus: {focus_accounts}).")
+            self.results[(mode, focus_accounts)] = adjacent
+
+    def plan(self, coalesce: bool = False, chunk_size: int = 20) -> list:
+        """
+        This method returns the list of requests of the job, as tuples of
+        (mode, focus_accounts, list of status ids, account id), for the 
+        reference statuses that remain to be fetched. Without coalescing,
+        each task has a single status id, and tasks for the same reference
+        status are next to each other. 
+        With 'coalesce' set to True, requests are coalesced into shared 
+        windows (see AdjacentStatuses.get_data()): for combinations without
+        account focus, the reference statuses are sorted by id and split into
+        chunks of 'chunk_size', and each chunk is one task; with account focus,
+        the reference statuses of each account are one task.
+        """
+        tasks = []
+        n_max = 0
+        for combination in self.combinations:
+            mode, focus_accounts = combination
+            adjacent = self.results[combination]
+            if coalesce and (focus_accounts != "yes"):
+                s_ids = sorted(set(adjacent.ref_ids_rem), key = int)
+                for i in range(0, len(s_ids), chunk_size):
+                    tasks.append((mode, focus_accounts, s_ids[i:i + chunk_size], None))
+            elif coalesce:
+                groups = {}
+                for s_id, a_id in zip(adjacent.ref_ids_rem, adjacent.ref_accounts_rem):
+                    groups.setdefault(a_id, {})[s_id] = None
+                for a_id, group in groups.items():
+                    tasks.append((mode, focus_accounts, list(group), a_id))
+            else:
+                n_max = max(n_max, len(adjacent.ref_ids_rem))
+        if not coalesce:
+            remaining = {
+                combination: list(zip(adjacent.ref_ids_rem, adjacent.ref_accounts_rem)) 
+                for combination, adjacent in self.results.items()
+            }
+            for i in range(n_max):
+                for combination in self.combinations:
+                    mode, focus_accounts = combination
+                    if i < len(remaining[combination]):
+                        s_id, a_id = remaining[combination][i]
+                        tasks.append((mode, focus_accounts, [s_id], a_id))
+        return tasks
+
+    def run(self, status_limit: int = 2, max_workers: int = 10,
+            rate_limit_action: str = "wait", rate_limit_threshold: int = 10,
+            max_wait_seconds: float = 300, buffer_seconds: float = 10,
+            coalesce: bool = False, window_limit: int = 40, chunk_size: int = 20, 
+            verbose: bool = True, checkpoint_dir: str = None, 
+            checkpoint_every: int = 100) -> dict:
+        """
+        This method sends the requests of the job and saves the responses in
+        the data attributes of the AdjacentStatuses objects in 'results',
+        which it also returns.
+        - The argument 'max_workers' specifies the number of requests that
+        are sent at the same time. It should not be above the 'pool_size'
+        of the reference object, which is 10 by default.
+        - The arguments 'coalesce' and 'chunk_size' are described in plan(),
+        and 'window_limit' in AdjacentStatuses.get_data().
+        - The argument 'checkpoint_dir' specifies an optional directory to 
+        which the job is saved with save_checkpoint(), every time about 
+        'checkpoint_every' more reference statuses are completed (100 by 
+        default) and at the end. An interrupted job can be resumed with 
+        from_checkpoint() and run() again.
+        - The other arguments are as in AdjacentStatuses.get_data().
+        Reference statuses whose requests fail with a transient error, after
+        the retries of the retry policy, are put in a retry queue, which is 
+        run once all the planned tasks are done. Those that fail again stay
+        remaining.
+        """
+        tasks = deque(self.plan(coalesce = coalesce, chunk_size = chunk_size))
+        if len(tasks) == 0:
+            print("No remaining statuses to collect.")
+            return self.results
+        n_statuses = sum([len(task[2]) for task in tasks])
+
+        # the rate limiter is shared, so configuring it once applies to all
+        first = self.results[self.combinations[0]]
+        first._configure_rate_limiter(rate_limit_threshold, max_wait_seconds, buffer_seconds)
+
+        # state shared by the threads
+        attempted = {combination: set() for combination in self.combinations}
+        counter = {"done": 0, "failed": 0, "requests": 0, "checkpoint": 0}
+        stop = threading.Event()
+        lock = threading.Lock()
+        retry_stats = first.retry_policy.stats()
+        retry_queue = deque()
+
+        if verbose:
+            print(f"Planned {len(tasks)} tasks for {n_statuses} reference statuses",
+                  f"in {len(self.combinations)} combinations of mode and account focus.")
+
+        def worker():
+            while not stop.is_set():
+                try:
+                    mode, focus_accounts, s_ids, a_id = tasks.popleft()
+                except IndexError:
+                    return
+                adjacent = self.results[(mode, focus_accounts)]
+                results, failed, remaining, n_requests = adjacent._collect_windows(
+                    s_ids, mode = mode, focus_accounts = focus_accounts, account_id = a_id, 
+                    status_limit = status_limit, window_limit = window_limit, 
+                    rate_limit_action = rate_limit_action, 
+                    rate_limit_threshold = rate_limit_threshold, stop = stop
+                )
+                adjacent.data.update(results)
+                with lock:
+                    # the failed reference statuses are not attempted until retried
+                    attempted[(mode, focus_accounts)].update(set(s_ids) - set(remaining) - set(failed))
+                    retry_queue.extend([(mode, focus_accounts, [s_id], a_id) for s_id in failed])
+                    previous_done = counter["done"]
+                    counter["done"] += len(results)
+                    counter["failed"] += len(failed)
+                    counter["requests"] += n_requests
+                    if verbose and (counter["done"] // 100 > previous_done // 100):
+                        print(f"Completed {counter['done']} of {n_statuses} reference statuses.")
+                    if (checkpoint_dir is not None) and (counter["done"] - counter["checkpoint"] >= checkpoint_every):
+                        counter["checkpoint"] = counter["done"]
+                        self._update_remaining(attempted)
+                        self.save_checkpoint(checkpoint_dir)
+
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            futures = [executor.submit(worker) for _ in range(max_workers)]
+            # raise any exception of the threads here
+            for future in futures:
+                future.result()
+
+            # retry the failed requests once more, those that fail again stay remaining
+            if (len(retry_queue) > 0) and not stop.is_set():
+                if verbose:
+                    print(f"Retrying {len(retry_queue)} failed requests...")
+                tasks.extend(retry_queue)
+                retry_queue.clear()
+                counter["failed"] = 0
+                futures = [executor.submit(worker) for _ in range(max_workers)]
+                for future in futures:
+                    future.result()
+
+        # keep the reference statuses that were not attempted as remaining,
+        # and sort the responses as the reference statuses
+        order = {s_id: i for i, s_id in enumerate(first.ref_ids)}
+        self._update_remaining(attempted)
+        for adjacent in self.results.values():
+            adjacent.data = dict(sorted(adjacent.data.items(), key = lambda item: order.get(item[0], len(order))))
+        if checkpoint_dir is not None:
+            self.save_checkpoint(checkpoint_dir)
+
+        if verbose:
+            print(f"Completed {counter['done']} reference statuses with {counter['requests']} requests,",
+                  f"{counter['failed']} failed.")
+            first._report_retries(retry_stats)
+
+        return self.results
+
+    def _update_remaining(self, attempted: dict) -> None:
+        # Removes the attempted reference statuses from the remaining ones
+        # of each combination.
+        for combination, adjacent in self.results.items():
+            if len(attempted[combination]) > 0:
+                adjacent._keep_remaining(set(adjacent.ref_ids_rem) - attempted[combination])
+
+    def save_checkpoint(self, directory: str) -> None:
+        """
+        This method saves the job to 'directory': the reference data and
+        the combinations to 'plan.json.gz', and the data and remaining
+        reference statuses of each combination to its own file, as 
+        AdjacentStatuses.save_checkpoint(). The job can be restored with
+        from_checkpoint().
+        """
+        write_checkpoint({
+            "server": self.reference.server,
+            "fields": self.reference.fields,
+            "combinations": self.combinations,
+            "reference_data": self.reference.data
+        }, os.path.join(directory, "plan.json.gz"))
+        for (mode, focus_accounts), adjacent in self.results.items():
+            adjacent.save_checkpoint(
+                os.path.join(directory, f"{mode}_acc_focus_{focus_accounts}.json.gz"), 
+                include_reference = False
+            )
+
+    @classmethod
+    def from_checkpoint(cls, directory: str, token: str = None, session = None):
+        """
+        This method creates an AdjacentPlanner object from a job saved by
+        save_checkpoint() in 'directory'. Calling run() then only requests
+        the reference statuses that were not completed. The arguments 
+        'token' and 'session' are as for AdjacentStatuses.
+        """
+        plan = read_checkpoint(os.path.join(directory, "plan.json.gz"))
+        reference = TrendingStatuses(server = plan["server"], token = token, session = session, 
+                                     fields = plan.get("fields"))
+        # json turns the batch numbers into strings
+        reference.data = {int(batch_no): reference._restore(batch) 
+                          for batch_no, batch in plan["reference_data"].items()}
+        planner = cls(reference = reference, combinations = plan["combinations"], token = token)
+        for (mode, focus_accounts) in planner.combinations:
+            planner.results[(mode, focus_accounts)] = AdjacentStatuses.from_checkpoint(
+                os.path.join(directory, f"{mode}_acc_focus_{focus_accounts}.json.gz"), 
+                reference = reference, token = token, session = session
+            )
+        return planner
@@ -6,11 +6,37 @@ in a TrendingStatuses object.
 
 # Dependencies
 import requests
-from datetime import datetime, timezone
-from time import sleep
-import pandas as pd
+import asyncio
+import threading
+from collections import deque
 from src.mastodon_statuses import MastodonStatuses
 from src.trending_statuses import TrendingStatuses
+from src.collection_state import CollectionState
+from src.checkpoint import write_checkpoint, read_checkpoint
+from src.status_table import statuses_to_table
+
+# aiohttp is only needed for the asynchronous engine
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Selecting the adjacent statuses of a reference status from a window of statuses
+def _window_neighbours(window: list, s_id: str, mode: str, status_limit: int) -> list:
+    """
+    Returns the 'status_limit' statuses of 'window' that come immediately
+    after ('subsequent') or before ('previous') the status with id 's_id',
+    newest first, as the Mastodon API would return them.
+    """
+    ref = int(s_id)
+    if mode == "subsequent":
+        newer = sorted([status for status in window if int(status["id"]) > ref], 
+                       key = lambda status: int(status["id"]))
+        return newer[:status_limit][::-1]
+    else:
+        older = sorted([status for status in window if int(status["id"]) < ref], 
+                       key = lambda status: int(status["id"]), reverse = True)
+        return older[:status_limit]
 
 # Class definition
 class AdjacentStatuses(MastodonStatuses):
@@ -24,21 +50,37 @@ class AdjacentStatuses(MastodonStatuses):
     An authorisation token can be optionally given. If no token is given, 
     the token of the reference object will be used, if it exists. Otherwise,
     requests will be sent without token.
+    Likewise, the pool of keep-alive connections of the reference object is
+    shared, unless a different requests session is given with 'session',
+    and so are its rate limiter, retry policy, response cache and metrics,
+    and the fields of the statuses to keep.
     The method get_data() sends GET requests to Mastodon API to fetch the 
     related statuses. The method generate_df() exports a pandas dataframe
     of the existing data. 
     """
-    def __init__(self, reference: TrendingStatuses, token = None) -> None:
-        super().__init__(server = reference.server, token = token)
+    def __init__(self, reference: TrendingStatuses, token = None, 
+                 session: requests.Session = None) -> None:
+        # use the token of the reference object if no token is given
+        if token is None:
+            token = reference.token
+        # share the connection pool of the reference object if no session is given
+        if session is None:
+            session = reference.session
+        super().__init__(server = reference.server, token = token, session = session, 
+                         pool_size = reference.pool_size, timeout = reference.timeout, 
+                         rate_limiter = reference.rate_limiter, 
+                         retry_policy = reference.retry_policy, 
+                         cache = reference.cache, metrics = reference.metrics, 
+                         fields = reference.fields)
         self.data = {}
         self.reference = reference
         # initialise lists for status and account ids
-        # lists with _rem suffix will keep track of statuses for which 
+        # queues with _rem suffix will keep track of statuses for which 
         # data have not yet been fetched
         self.ref_ids = []
-        self.ref_ids_rem = []
+        self.ref_ids_rem = deque()
         self.ref_accounts = []
-        self.ref_accounts_rem = []
+        self.ref_accounts_rem = deque()
 
         # populate the id lists from reference data
         for batch_no in self.reference.data:
@@ -47,19 +89,15 @@ class AdjacentStatuses(MastodonStatuses):
                 self.ref_ids_rem.append(status["id"])
                 self.ref_accounts.append(status["account"]["id"])
                 self.ref_accounts_rem.append(status["account"]["id"])
-        
-        # store token if exists
-        if token is not None:
-            self.token = token
-        elif self.reference.token is not None:
-            self.token = self.reference.token
-        else:
-            self.token = None
     
     def get_data(self, mode: str = "subsequent", focus_accounts: str = "no", 
                  status_limit: int = 2, rate_limit_action: str = "wait", 
                  rate_limit_threshold: int = 10, max_wait_seconds: float = 300, 
-                 buffer_seconds: float = 10):
+                 buffer_seconds: float = 10, engine: str = "sync", 
+                 max_concurrency: int = 10, coalesce: bool = False, 
+                 window_limit: int = 40, state: CollectionState = None, 
+                 recollect: bool = False, checkpoint_path: str = None, 
+                 checkpoint_every: int = 50):
         """
         This method sends GET requrests to Mastodon API to fetch the
         related statuses and saves the responses in the data attribute. 
@@ -75,19 +113,81 @@ class AdjacentStatuses(MastodonStatuses):
         number of 40.
         - The argument 'rate_limit_action' specifies what to do if the
         rate limit is critically low with respect to the defined threshold. 
-        The default value is 'wait', which means the method will slow down 
-        until the rate limit is reset. Otherwise, the process will abort.
+        The default value is 'wait', which means the requests are paced by
+        the rate limiter, spreading the remaining requests evenly until the 
+        rate limit is reset. Otherwise, the process will abort.
         - The argument 'rate_limit_threshold' specifies the threshold which
         determines when the rate limit is considered critically low. The value
-        should be an integer, the default is 10.
+        should be an integer, the default is 10. It is used as the reserve of
+        the rate limiter.
         - The argument 'max_wait_seconds' specifies how much to wait, if the
         reset time is not workable. The value should be a float, the default
         is 300.
         - The argument 'buffer_seconds' specifies additional waiting time in
         seconds, to allow a buffer priod for the rate limit to be updated.
         The value should be a float, the default is 10.
+        The rate limiter is shared by all instances for the same server, so
+        the last three arguments apply to all of them.
+        - The argument 'engine' specifies how the requests are sent. The 
+        default value is 'sync', which sends one request at a time. With 
+        'async', the requests are sent concurrently by aget_data(). This needs
+        the package aiohttp, and cannot be used where an event loop is already
+        running, e.g. in a jupyter notebook; there, await aget_data() instead.
+        - The argument 'max_concurrency' specifies the maximum number of 
+        requests that are sent at the same time with the 'async' engine.
+        - The argument 'coalesce' specifies if nearby reference statuses share
+        requests. The reference statuses are sorted by id, and one request for
+        a window of 'window_limit' statuses (40 by default) next to the closest
+        reference covers all the reference statuses whose adjacent statuses 
+        fall in it. Their adjacent statuses are selected from the window, so 
+        the data are the same as with one request per reference status, but 
+        far fewer requests are sent. If 'focus_accounts' is 'yes', reference
+        statuses are grouped by account, and the windows are taken from the 
+        account's statuses, so that an account that posted several reference
+        statuses is requested once where possible. The default is False. This
+        is only available with the 'sync' engine; AdjacentPlanner can run 
+        coalesced windows in parallel.
+        - The argument 'state' is an optional CollectionState, which records
+        the reference statuses collected in previous runs. If given, these 
+        are skipped, unless 'recollect' is True. The state is not updated 
+        here: mark the collected ids once the data are saved.
+        - The argument 'checkpoint_path' specifies an optional file to which
+        the fetched data and the remaining reference statuses are saved, 
+        every 'checkpoint_every' reference statuses (50 by default) and at 
+        the end, with save_checkpoint(). An interrupted run can be resumed 
+        with from_checkpoint(). This is only available with the 'sync' engine.
+        Requests that fail with a transient error are retried as set by the
+        retry policy. If they still fail, the reference statuses are put in
+        a retry queue, which is drained once the other reference statuses are
+        done; those that fail again stay remaining. The number of failed and
+        retried requests is printed at the end.
         """
 
+        if (state is not None) and not recollect:
+            n_skipped = self.skip_collected(state, mode, focus_accounts)
+            print(f"Skipping {n_skipped} reference statuses collected in previous runs.")
+            if len(self.ref_ids_rem) == 0:
+                print("All reference statuses have already been collected.")
+                return
+
+        if coalesce and (mode not in ["subsequent", "previous"]):
+            raise ValueError("mode must be either 'subsequent' or 'previous' to coalesce requests")
+
+        if engine == "async":
+            if coalesce:
+                raise ValueError("coalesce is only available with the 'sync' engine")
+            if checkpoint_path is not None:
+                raise ValueError("checkpoints are only available with the 'sync' engine")
+            asyncio.run(self.aget_data(
+                mode = mode, focus_accounts = focus_accounts, status_limit = status_limit, 
+                rate_limit_action = rate_limit_action, rate_limit_threshold = rate_limit_threshold, 
+                max_wait_seconds = max_wait_seconds, buffer_seconds = buffer_seconds, 
+                max_concurrency = max_concurrency
+            ))
+            return
+        elif engine != "sync":
+            raise ValueError("engine must be either 'sync' or 'async'")
+
         # Firts, check if there are ids for which to fetch data.
         # If no, raise an exception.
 
@@ -95,71 +195,425 @@ class AdjacentStatuses(MastodonStatuses):
             raise Exception("No remaining statuses in the reference data")
         elif len(self.ref_accounts_rem) == 0:
             raise Exception("No remaining accounts associated with the reference data")
+
+        self._configure_rate_limiter(rate_limit_threshold, max_wait_seconds, buffer_seconds)
+
+        if coalesce:
+            self._get_data_coalesced(mode = mode, focus_accounts = focus_accounts, 
+                                     status_limit = status_limit, window_limit = window_limit, 
+                                     rate_limit_action = rate_limit_action, 
+                                     rate_limit_threshold = rate_limit_threshold, 
+                                     checkpoint_path = checkpoint_path, 
+                                     checkpoint_every = checkpoint_every)
+            return
         
-        # Iterate through the list of remaining reference ids while not empty.
+        # Iterate through the queue of remaining reference ids while not empty.
         counter = 0
+        n_processed = 0
+        retry_stats = self.retry_policy.stats()
+        retry_queue = deque()
+        aborted = False
         while len(self.ref_ids_rem) > 0:
 
+            # save progress so far; the reference statuses waiting for a retry
+            # are no longer in ref_ids_rem, but are saved as remaining too
+            if (checkpoint_path is not None) and (n_processed > 0) and (n_processed % checkpoint_every == 0):
+                self.save_checkpoint(checkpoint_path, pending = retry_queue)
+            n_processed += 1
+
             # get remaining status and account ids by removing from the original lists
-            s_id = self.ref_ids_rem.pop(0)
-            a_id = self.ref_accounts_rem.pop(0)
+            s_id = self.ref_ids_rem.popleft()
+            a_id = self.ref_accounts_rem.popleft()
 
             # send request based on if we focus on accounts, get response
-            if focus_accounts == "yes":
-                self.req_account_statuses(account_id = a_id, n_statuses = status_limit, mode = mode, min_max_id = s_id)
-            else:
-                self.req_timeline(n_statuses = status_limit, mode = mode, min_max_id = s_id)
+            self.response = self._fetch_adjacent(s_id, a_id, mode, focus_accounts, status_limit)
             
             # if the response is OK, save data and proceed, otherwise skip this item
-            if self.response.status_code == 200:
-                self.data[s_id] = self.response.json()
+            # or retry it at the end
+            if self._check_response(self.response, s_id, a_id, retry_queue):
+                self.data[s_id] = self.parse_json(self.response)
                 counter += 1
             else:
-                print(f"Response code not 200: request failed for status with id {s_id}.\n", 
-                      "No data will be saved for this status.")
                 continue
             
-            # check remaining rate limit: if too low, apply selected procedure
-            rem_rate_limit = int(self.response.headers["x-ratelimit-remaining"])
-            if rem_rate_limit <= rate_limit_threshold:
-                print(f"Remaining rate limit is critically low: {rem_rate_limit}.", 
-                      f"\n So far completed {counter} requests.")
-                
-                if rate_limit_action == "wait":
-                    
-                    # next reset time as provided in the response headers
-                    next_reset = datetime.strptime(
-                        self.response.headers['x-ratelimit-reset'], 
-                        "%Y-%m-%dT%H:%M:%S.%fZ"
-                    ).replace(tzinfo = timezone.utc)
-                    print("The provided reset time (UTC):", next_reset.strftime("%H:%M:%S"))
-
-                    time_until = (next_reset - datetime.now(timezone.utc)).total_seconds()
-
-                    # sometimes the info is not updated and the reset time is in the past
-                    if time_until <= 0: 
-                        print("This has already passed. Current time (UTC):", 
-                              datetime.now(timezone.utc).strftime("%H:%M:%S"), 
-                              f"\n Instead, waiting {max_wait_seconds + buffer_seconds} seconds...")
-                        sleep(max_wait_seconds + buffer_seconds)
-
-                    # otherwise wait until the promised time
-                    else:
-                        print("Current time (UTC):", 
-                              datetime.now(timezone.utc).strftime("%H:%M:%S") +  
-                              f". Waiting {round(time_until) + buffer_seconds} seconds... ")
-                        sleep(round(time_until) + buffer_seconds)
-
-                    print("Current time (UTC):", 
-                          datetime.now(timezone.utc).strftime("%H:%M:%S"),
-                          "Resuming the process...")
-
-                #if the choice is not to wait, end the while loop
-                else:
-                    print("Ending the process.")
+            # the rate limiter paces the requests; if the choice is not
+            # to wait, end the while loop when the rate limit is too low
+            if rate_limit_action != "wait":
+                rem_rate_limit = int(self.response.headers["x-ratelimit-remaining"])
+                if rem_rate_limit <= rate_limit_threshold:
+                    print(f"Remaining rate limit is critically low: {rem_rate_limit}.", 
+                          f"\n So far completed {counter} requests.", 
+                          "\n Ending the process.")
+                    aborted = True
                     break
+
+        # retry the failed requests once more, those that fail again stay remaining
+        if (len(retry_queue) > 0) and not aborted:
+            print(f"Retrying {len(retry_queue)} failed requests...")
+            failed_again = deque()
+            while len(retry_queue) > 0:
+                s_id, a_id = retry_queue.popleft()
+                self.response = self._fetch_adjacent(s_id, a_id, mode, focus_accounts, status_limit)
+                if self._check_response(self.response, s_id, a_id, failed_again):
+                    self.data[s_id] = self.parse_json(self.response)
+                    counter += 1
+            retry_queue = failed_again
+        for s_id, a_id in retry_queue:
+            self.ref_ids_rem.append(s_id)
+            self.ref_accounts_rem.append(a_id)
         
         self.response = None
+        self._report_retries(retry_stats)
+        if checkpoint_path is not None:
+            self.save_checkpoint(checkpoint_path)
+
+    async def aget_data(self, mode: str = "subsequent", focus_accounts: str = "no", 
+                        status_limit: int = 2, rate_limit_action: str = "wait", 
+                        rate_limit_threshold: int = 10, max_wait_seconds: float = 300, 
+                        buffer_seconds: float = 10, max_concurrency: int = 10):
+        """
+        This method is the asynchronous counterpart of get_data(), with the
+        same arguments. Up to 'max_concurrency' requests are sent at the same
+        time, paced by the rate limiter, which counts the requests underway
+        against the remaining rate limit.
+        The responses are saved in the data attribute, keyed by reference id,
+        in the order of the reference statuses.
+        """
+
+        if len(self.ref_ids_rem) == 0:
+            raise Exception("No remaining statuses in the reference data")
+        elif len(self.ref_accounts_rem) == 0:
+            raise Exception("No remaining accounts associated with the reference data")
+
+        self._configure_rate_limiter(rate_limit_threshold, max_wait_seconds, buffer_seconds)
+
+        # the event loop runs one worker at a time, so the workers 
+        # can share the counter, flag and queues without locking
+        counter = 0
+        stop = False
+        retry_stats = self.retry_policy.stats()
+        retry_queue = deque()
+
+        async def worker(client, queue, failed):
+            nonlocal counter, stop
+            while (len(queue[0]) > 0) and not stop:
+                s_id = queue[0].popleft()
+                a_id = queue[1].popleft()
+                req_url = self._adjacent_url(s_id, a_id, mode, focus_accounts, status_limit)
+                try:
+                    status_code, headers, body = await self._asend_request(client, req_url)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    print(f"Request failed for status with id {s_id}: {error}")
+                    status_code, headers, body = None, None, None
+
+                if status_code == 200:
+                    self.data[s_id] = body
+                    counter += 1
+                elif self.retry_policy.is_retryable(status_code):
+                    print(f"Request failed for status with id {s_id}.", 
+                          "It will be retried at the end.")
+                    failed.append((s_id, a_id))
+                    continue
+                else:
+                    print(f"Response code not 200: request failed for status with id {s_id}.\n", 
+                          "No data will be saved for this status.")
+                    continue
+
+                if (rate_limit_action != "wait") and not stop:
+                    rem_rate_limit = int(headers["x-ratelimit-remaining"])
+                    if rem_rate_limit <= rate_limit_threshold:
+                        print(f"Remaining rate limit is critically low: {rem_rate_limit}.", 
+                              f"\n So far completed {counter} requests.", 
+                              "\n Ending the process.")
+                        stop = True
+
+        async with self._async_client(max_concurrency = max_concurrency) as client:
+            queue = (self.ref_ids_rem, self.ref_accounts_rem)
+            await asyncio.gather(*[worker(client, queue, retry_queue) for _ in range(max_concurrency)])
+
+            # retry the failed requests once more, those that fail again stay remaining
+            if (len(retry_queue) > 0) and not stop:
+                print(f"Retrying {len(retry_queue)} failed requests...")
+                queue = (deque([s_id for s_id, _ in retry_queue]), deque([a_id for _, a_id in retry_queue]))
+                retry_queue = deque()
+                await asyncio.gather(*[worker(client, queue, retry_queue) for _ in range(max_concurrency)])
+                # not retried if the process was ended
+                retry_queue.extend(zip(queue[0], queue[1]))
+        for s_id, a_id in retry_queue:
+            self.ref_ids_rem.append(s_id)
+            self.ref_accounts_rem.append(a_id)
+        self._report_retries(retry_stats)
+
+        # responses arrive in any order: sort them as the reference statuses
+        order = {s_id: i for i, s_id in enumerate(self.ref_ids)}
+        self.data = dict(sorted(self.data.items(), key = lambda item: order.get(item[0], len(order))))
+
+    def skip_collected(self, state: CollectionState, mode: str, focus_accounts: str) -> int:
+        """
+        This method removes the reference statuses that the CollectionState
+        'state' records as collected for the given mode and account focus
+        from the remaining ones, and returns how many were removed. They are
+        kept in ref_ids, so that generate_df() still drops them.
+        """
+        n_before = len(self.ref_ids_rem)
+        self._keep_remaining(set(state.filter_new(list(self.ref_ids_rem), mode, focus_accounts)))
+        return n_before - len(self.ref_ids_rem)
+
+    def complete_ids(self, status_limit: int = 2) -> list:
+        """
+        This method returns the ids of the reference statuses for which
+        'status_limit' adjacent statuses have been fetched. Those with 
+        fewer, e.g. the most recent statuses in 'subsequent' mode, may get
+        more in a later run, so they should not be marked as collected.
+        """
+        return [s_id for s_id, statuses in self.data.items() if len(statuses) >= status_limit]
+
+    def _fetch_adjacent(self, s_id: str, a_id: str, mode: str, 
+                        focus_accounts: str, status_limit: int) -> requests.Response:
+        # Sends the request for the adjacent statuses of one reference status,
+        # and returns the response, or None if there was none after all retries
+        try:
+            if focus_accounts == "yes":
+                self.req_account_statuses(account_id = a_id, n_statuses = status_limit, mode = mode, min_max_id = s_id)
+            else:
+                self.req_timeline(n_statuses = status_limit, mode = mode, min_max_id = s_id)
+        except requests.RequestException as error:
+            print(f"Request failed for status with id {s_id}: {error}")
+            self.response = None
+        return self.response
+
+    def _check_response(self, response: requests.Response, s_id: str, 
+                        a_id: str, retry_queue: deque) -> bool:
+        # Returns True if the response is OK. Otherwise, the reference status
+        # is added to the retry queue if the error is transient, or skipped.
+        if (response is not None) and (response.status_code == 200):
+            return True
+        if (response is None) or self.retry_policy.is_retryable(response.status_code):
+            print(f"Request failed for status with id {s_id}.", 
+                  "It will be retried at the end.")
+            retry_queue.append((s_id, a_id))
+        else:
+            print(f"Response code not 200: request failed for status with id {s_id}.\n", 
+                  "No data will be saved for this status.")
+        return False
+
+    def _keep_remaining(self, keep_ids: set) -> None:
+        # keep only the given ids, with their accounts, as remaining
+        kept = [(s_id, a_id) for s_id, a_id in zip(self.ref_ids_rem, self.ref_accounts_rem) if s_id in keep_ids]
+        self.ref_ids_rem = deque([s_id for s_id, _ in kept])
+        self.ref_accounts_rem = deque([a_id for _, a_id in kept])
+
+    def _get_data_coalesced(self, mode: str, focus_accounts: str, status_limit: int, 
+                            window_limit: int, rate_limit_action: str, 
+                            rate_limit_threshold: int, checkpoint_path: str = None, 
+                            checkpoint_every: int = 50) -> None:
+        # get_data() with coalesced requests: all remaining reference statuses
+        # are covered by windows, and those not reached stay remaining.
+        # With account focus, the reference statuses are grouped by account,
+        # so that each account's statuses are fetched only once.
+        groups = {}
+        for s_id, a_id in zip(self.ref_ids_rem, self.ref_accounts_rem):
+            group_key = a_id if focus_accounts == "yes" else None
+            groups.setdefault(group_key, {})[s_id] = None
+
+        # order of the reference statuses, to store the data in
+        order = {s_id: i for i, s_id in enumerate(self.ref_ids)}
+        stop = threading.Event()
+        n_fetched = 0
+        n_requests = 0
+        n_since_checkpoint = 0
+        retry_stats = self.retry_policy.stats()
+        retry_queue = deque()
+        for a_id, group in groups.items():
+            group_results, group_failed, group_remaining, group_requests = self._collect_windows(
+                list(group), mode = mode, focus_accounts = focus_accounts, account_id = a_id, 
+                status_limit = status_limit, window_limit = window_limit, 
+                rate_limit_action = rate_limit_action, 
+                rate_limit_threshold = rate_limit_threshold, stop = stop
+            )
+            for s_id in sorted(group_results, key = lambda s_id: order.get(s_id, len(order))):
+                self.data[s_id] = group_results[s_id]
+            n_fetched += len(group_results)
+            n_requests += group_requests
+
+            # the group is done, apart from the statuses not reached, 
+            # and those that failed, which are retried at the end
+            retry_queue.extend([(s_id, a_id) for s_id in group_failed])
+            done = set(group) - set(group_remaining) - set(group_failed)
+            self._keep_remaining(set(self.ref_ids_rem) - done)
+
+            n_since_checkpoint += len(done)
+            if (checkpoint_path is not None) and (n_since_checkpoint >= checkpoint_every):
+                self.save_checkpoint(checkpoint_path)
+                n_since_checkpoint = 0
+
+        # retry the failed requests once more, those that fail again stay remaining
+        if (len(retry_queue) > 0) and not stop.is_set():
+            print(f"Retrying {len(retry_queue)} failed requests...")
+            while (len(retry_queue) > 0) and not stop.is_set():
+                s_id, a_id = retry_queue.popleft()
+                retry_results, _, _, retry_requests = self._collect_windows(
+                    [s_id], mode = mode, focus_accounts = focus_accounts, account_id = a_id, 
+                    status_limit = status_limit, window_limit = window_limit, 
+                    rate_limit_action = rate_limit_action, 
+                    rate_limit_threshold = rate_limit_threshold, stop = stop
+                )
+                self.data.update(retry_results)
+                n_fetched += len(retry_results)
+                n_requests += retry_requests
+                self._keep_remaining(set(self.ref_ids_rem) - set(retry_results))
+
+        # store in the order of the reference statuses
+        self.data = dict(sorted(self.data.items(), key = lambda item: order.get(item[0], len(order))))
+        if checkpoint_path is not None:
+            self.save_checkpoint(checkpoint_path)
+
+        print(f"Data fetched for {n_fetched} reference statuses with {n_requests} requests.")
+        self._report_retries(retry_stats)
+
+    def _collect_windows(self, s_ids: list, mode: str, focus_accounts: str = "no", 
+                         account_id: str = None, status_limit: int = 2, 
+                         window_limit: int = 40, rate_limit_action: str = "wait", 
+                         rate_limit_threshold: int = 10, stop: threading.Event = None) -> tuple:
+        """
+        This method fetches the adjacent statuses of a group of reference 
+        statuses with as few requests as possible. Starting from the reference
+        status closest to the edge of the timeline, it requests the window of 
+        'window_limit' statuses next to it, and selects the adjacent statuses
+        of every reference status that is fully covered by the window. This is
+        repeated with the next reference status that is not yet covered. When
+        a single reference status is left, only 'status_limit' statuses are
+        requested, as without coalescing.
+        With 'focus_accounts' set to 'yes', the window is taken from the 
+        statuses of the account 'account_id', so all the reference statuses
+        should come from this account.
+        The process stops if the event 'stop' is set, or sets it if the rate
+        limit is critically low and 'rate_limit_action' is not 'wait'.
+        Returns a tuple of: a dictionary of adjacent statuses keyed by 
+        reference id, a list of ids for which the request failed with a 
+        transient error, so that it can be retried, a list of ids that were
+        not reached, and the number of requests sent.
+        """
+        if stop is None:
+            stop = threading.Event()
+
+        # for subsequent statuses, windows are newer than the reference,
+        # so the oldest reference comes first, and vice versa
+        pending = sorted(set(s_ids), key = int, reverse = (mode == "previous"))
+        results = {}
+        failed = []
+        n_requests = 0
+
+        while (len(pending) > 0) and not stop.is_set():
+            anchor = pending[0]
+            limit = status_limit if len(pending) == 1 else window_limit
+            req_url = self._adjacent_url(anchor, account_id, mode, focus_accounts, limit)
+            try:
+                response = self._send_request(req_url)
+            except requests.RequestException as error:
+                print(f"Request failed for status with id {anchor}: {error}")
+                response = None
+            n_requests += 1
+
+            if (response is None) or (response.status_code != 200):
+                if (response is None) or self.retry_policy.is_retryable(response.status_code):
+                    print(f"Request failed for status with id {anchor}.", 
+                          "It can be retried later.")
+                    failed.append(anchor)
+                else:
+                    print(f"Response code not 200: request failed for status with id {anchor}.\n", 
+                          "No data will be saved for this status.")
+                pending.pop(0)
+                continue
+
+            # the anchor is always covered, other reference statuses only if
+            # all their adjacent statuses are in the window
+            window = self.parse_json(response)
+            still_pending = []
+            for s_id in pending:
+                neighbours = _window_neighbours(window, s_id, mode, status_limit)
+                if (s_id == anchor) or (len(neighbours) == status_limit):
+                    results[s_id] = neighbours
+                else:
+                    still_pending.append(s_id)
+            pending = still_pending
+
+            if rate_limit_action != "wait":
+                rem_rate_limit = int(response.headers["x-ratelimit-remaining"])
+                if rem_rate_limit <= rate_limit_threshold and not stop.is_set():
+                    print(f"Remaining rate limit is critically low: {rem_rate_limit}.", 
+                          f"\n So far completed {n_requests} requests.", 
+                          "\n Ending the process.")
+                    stop.set()
+
+        return results, failed, pending, n_requests
+
+    def save_checkpoint(self, path: str, include_reference: bool = True, 
+                        pending: list = None) -> None:
+        """
+        This method saves the fetched data and the remaining reference 
+        statuses to the file 'path', as compressed json, so that the 
+        collection can be resumed with from_checkpoint(). If 
+        'include_reference' is True, the data of the reference object are 
+        saved as well, so that it can be restored without the original.
+        The argument 'pending' is an optional list of (status id, account id)
+        pairs taken out of the remaining reference statuses but not fetched
+        yet, e.g. in a retry queue, which are saved as remaining.
+        """
+        pending = list(pending) if pending is not None else []
+        checkpoint = {
+            "server": self.server,
+            "fields": self.fields,
+            "ref_ids_rem": list(self.ref_ids_rem) + [s_id for s_id, _ in pending],
+            "ref_accounts_rem": list(self.ref_accounts_rem) + [a_id for _, a_id in pending],
+            # a copy, in case other threads add data in the meantime
+            "data": dict(self.data)
+        }
+        if include_reference:
+            checkpoint["reference_data"] = self.reference.data
+        write_checkpoint(checkpoint, path)
+
+    @classmethod
+    def from_checkpoint(cls, path: str, reference: TrendingStatuses = None, 
+                        token: str = None, session: requests.Session = None):
+        """
+        This method creates an AdjacentStatuses object from a checkpoint 
+        saved by save_checkpoint(), with the data fetched so far and the 
+        remaining reference statuses, so that calling get_data() only 
+        requests what is still outstanding. The reference object can be 
+        given with 'reference'; otherwise it is restored from the checkpoint.
+        The arguments 'token' and 'session' are as in the constructor.
+        """
+        checkpoint = read_checkpoint(path)
+        if reference is None:
+            if "reference_data" not in checkpoint:
+                raise ValueError("The checkpoint has no reference data: a reference object must be given")
+            reference = TrendingStatuses(server = checkpoint["server"], token = token, session = session, 
+                                         fields = checkpoint.get("fields"))
+            # json turns the batch numbers into strings
+            reference.data = {int(batch_no): reference._restore(batch) 
+                              for batch_no, batch in checkpoint["reference_data"].items()}
+        adjacent = cls(reference = reference, token = token, session = session)
+        adjacent.data = {s_id: adjacent._restore(statuses) for s_id, statuses in checkpoint["data"].items()}
+        adjacent.ref_ids_rem = deque(checkpoint["ref_ids_rem"])
+        adjacent.ref_accounts_rem = deque(checkpoint["ref_accounts_rem"])
+        return adjacent
+
+    def _configure_rate_limiter(self, rate_limit_threshold: int, 
+                                max_wait_seconds: float, buffer_seconds: float) -> None:
+        # apply the rate limit arguments of get_data() to the shared rate limiter
+        self.rate_limiter.reserve = rate_limit_threshold
+        self.rate_limiter.stale_wait_seconds = max_wait_seconds
+        self.rate_limiter.buffer_seconds = buffer_seconds
+
+    def _adjacent_url(self, s_id: str, a_id: str, mode: str, 
+                      focus_accounts: str, status_limit: int) -> str:
+        # URL of the request for the statuses adjacent to a reference status
+        if focus_accounts == "yes":
+            return self._account_statuses_url(account_id = a_id, n_statuses = status_limit, 
+                                              mode = mode, min_max_id = s_id)
+        else:
+            return self._timeline_url(n_statuses = status_limit, mode = mode, min_max_id = s_id)
 
     def generate_df(self, drop_trending: bool = True):
         """
@@ -169,14 +623,9 @@ class AdjacentStatuses(MastodonStatuses):
         by default to drop these.
         """
 
-        # All fetched statuses as a single list of dictionaries
-        list_of_dicts = []
-        for ref_id in self.data:
-            list_of_dicts += self.data[ref_id]
-        
-        # Use pandas method for converting json to df
-        df = pd.json_normalize(list_of_dicts, sep = "_")
-        df.drop_duplicates(subset = "id", keep = "last", inplace = True)
+        # Flatten all fetched statuses into the fixed columns of the
+        # status table, which drops duplicates as they are appended
+        df = statuses_to_table(self.data.values()).to_pandas()
 
         # Check if any of the fetched statuses are also in the reference list
         if drop_trending:
@@ -0,0 +1,40 @@
+"""
+This module defines functions to write and read checkpoints of a data
+collection run, so that an interrupted run can be resumed without
+sending the requests that were already completed. Checkpoints are
+gzip-compressed json files. StatusRecords are saved as dictionaries.
+"""
+
+# Dependencies
+import os
+import gzip
+import json
+
+def write_checkpoint(checkpoint: dict, path: str) -> None:
+    """
+    Writes the dictionary 'checkpoint' to the file 'path' as compressed
+    json. The file is written under a temporary name and then renamed,
+    so an interrupted write leaves the previous checkpoint intact.
+    The directory is created if it does not exist.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding = "utf-8", compresslevel = 1) as output:
+        json.dump(checkpoint, output, default = _to_json)
+    os.replace(tmp_path, path)
+
+def _to_json(value):
+    # Objects that json cannot encode, such as StatusRecords, as dictionaries
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def read_checkpoint(path: str) -> dict:
+    """
+    Reads a checkpoint written by write_checkpoint() and returns it
+    as a dictionary.
+    """
+    with gzip.open(path, "rt", encoding = "utf-8") as checkpoint_file:
+        return json.load(checkpoint_file)
@@ -0,0 +1,110 @@
+"""
+This module defines a class to keep track of the reference statuses
+for which adjacent statuses have already been collected, across runs
+of the collection scripts. The state is stored in a local SQLite
+database, so that a run only requests reference statuses that are new
+since the previous runs.
+"""
+
+# Dependencies
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+# Class definition
+class CollectionState:
+    """
+    This class stores which combinations of (status id, mode, focus_accounts)
+    have been collected, in a SQLite database.
+    - The argument 'path' specifies the database file. It is created if it
+    does not exist, as is its directory. The default is
+    '../data/collection_state.db'.
+    The method filter_new() returns the status ids that have not been
+    collected yet, and mark_collected() records status ids as collected;
+    this should be done once their data are saved. The method prune()
+    removes old records. The class can be used from several threads.
+    """
+    def __init__(self, path: str = "../data/collection_state.db") -> None:
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS collected (
+                    status_id TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    focus_accounts TEXT NOT NULL,
+                    collected_at TEXT NOT NULL,
+                    PRIMARY KEY (status_id, mode, focus_accounts)
+                )
+                """
+            )
+
+    def filter_new(self, status_ids: list, mode: str, focus_accounts: str) -> list:
+        """
+        This method returns the status ids from 'status_ids' that have not
+        been collected for the given mode and account focus, in the same order.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT status_id FROM collected WHERE mode = ? AND focus_accounts = ?",
+                (mode, focus_accounts)
+            ).fetchall()
+        collected = set([row[0] for row in rows])
+        return [s_id for s_id in status_ids if s_id not in collected]
+
+    def is_collected(self, status_id: str, mode: str, focus_accounts: str) -> bool:
+        """
+        This method returns True if the status id has been collected for
+        the given mode and account focus.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM collected WHERE status_id = ? AND mode = ? AND focus_accounts = ?",
+                (status_id, mode, focus_accounts)
+            ).fetchone()
+        return row is not None
+
+    def mark_collected(self, status_ids: list, mode: str, focus_accounts: str) -> None:
+        """
+        This method records the status ids as collected for the given mode
+        and account focus, with the current time.
+        """
+        collected_at = datetime.now(timezone.utc).isoformat()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO collected VALUES (?, ?, ?, ?)",
+                [(s_id, mode, focus_accounts, collected_at) for s_id in status_ids]
+            )
+
+    def prune(self, keep_hours: float = 168) -> int:
+        """
+        This method removes the records older than 'keep_hours' hours,
+        which should be longer than the period covered by the trending
+        statuses, and returns the number of records removed. The default
+        is a week.
+        """
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours = keep_hours)).isoformat()
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM collected WHERE collected_at < ?", (cutoff,)
+            )
+        return cursor.rowcount
+
+    def clear(self) -> None:
+        """
+        This method removes all records.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM collected")
+
+    def close(self) -> None:
+        """
+        This method closes the database connection.
+        """
+        self.connection.close()
@@ -5,10 +5,15 @@ on a dataframe of mastodon statuses.
 """
 
 # Dependencies
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from bs4 import BeautifulSoup
+from bs4.element import Tag, NavigableString, CData
 import re
+import ast
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 
 # Extracting text, removing html tags
 def get_stripped_text(df):
@@ -80,7 +85,81 @@ def get_text_no_links(df):
         return soup.get_text()
     
     df["content_plain_text"] = df["content"].map(soup_process)
-    
+
+    return df
+
+# strings counted by BeautifulSoup's get_text(): no comments, scripts, etc.
+TEXT_STRING_TYPES = (NavigableString, CData)
+
+class _NestedLinks(Exception):
+    # Raised when a link is found inside another link
+    pass
+
+def _anchor_text(a_tag):
+    # The text of a link, as a_tag.get_text(), if it has no link inside
+    parts = []
+    for descendant in a_tag.descendants:
+        if isinstance(descendant, Tag):
+            if descendant.name == "a":
+                raise _NestedLinks()
+        elif type(descendant) in TEXT_STRING_TYPES:
+            parts.append(descendant)
+    return "".join(parts)
+
+def _collect_texts(node, stripped, annotated, plain):
+    # Appends the text of the children of 'node' to the three lists of
+    # strings, with the links as in the three get_..._text() functions
+    for child in node.children:
+        if isinstance(child, Tag):
+            if child.name != "a":
+                _collect_texts(child, stripped, annotated, plain)
+                continue
+            link_text = _anchor_text(child)
+            stripped.append(link_text)
+            if any([c in ("hashtag", "mention") for c in child.get_attribute_list("class")]):
+                if link_text[0] == "#":
+                    link_text = "_hashtag_ " + link_text[1:]
+                elif link_text[0] == "@":
+                    link_text = "_mention_ " + link_text[1:]
+                annotated.append(link_text)
+            else:
+                annotated.append("_link_ " + link_text)
+        elif type(child) in TEXT_STRING_TYPES:
+            stripped.append(child)
+            annotated.append(child)
+            plain.append(child)
+
+def extract_texts(content) -> tuple:
+    """
+    Returns the stripped, annotated and plain texts of a status content,
+    as get_stripped_text(), get_annotated_text() and get_text_no_links()
+    do, with a single parse of the html. Links nested in links are
+    rare enough to be handled by the three separate functions.
+    """
+    text = str(content)
+    soup = BeautifulSoup(text, "html.parser")
+    stripped, annotated, plain = [], [], []
+    try:
+        _collect_texts(soup, stripped, annotated, plain)
+    except _NestedLinks:
+        df = pd.DataFrame({"content": [content]})
+        df = get_text_no_links(get_annotated_text(get_stripped_text(df)))
+        return tuple(df.loc[0, ["content_stripped", "content_annotated", "content_plain_text"]])
+    return "".join(stripped), "".join(annotated), "".join(plain)
+
+# Extracting the stripped, annotated and plain texts in one go
+def get_texts(df, strip_text = True, annotate_text = True, no_link_text = True):
+    """
+    Creates the columns 'content_stripped', 'content_annotated' and
+    'content_plain_text', or those selected by the arguments, as
+    get_stripped_text(), get_annotated_text() and get_text_no_links(),
+    but parses the html of each status only once. Returns the dataframe.
+    """
+    texts = [extract_texts(content) for content in df["content"]]
+    names = ["content_stripped", "content_annotated", "content_plain_text"]
+    for i, (name, selected) in enumerate(zip(names, [strip_text, annotate_text, no_link_text])):
+        if selected:
+            df[name] = pd.Series([t[i] for t in texts], index = df.index)
     return df
 
 # Measuring content length
@@ -94,7 +173,7 @@ def get_content_length(df):
     count and returns the dataframe.
     """
 
-    if df["content_plain_text"] is None:
+    if "content_plain_text" not in df.columns:
         df = get_text_no_links(df)
     
     df["content_length"] = df["content_plain_text"].map(
@@ -132,6 +211,8 @@ def convert_to_datetime(df, cols_to_convert: list = [
     names. Especially useful if additional columns have been specified.
     Can also update the format for default columns if the function's 
     defaults don't work.
+    Columns that already have a datetime data type, e.g. when read
+    from the processed Feather files, are left as they are.
     Returns: processed dataframe
     """
 
@@ -163,14 +244,61 @@ def convert_to_datetime(df, cols_to_convert: list = [
         formats.update(dt_format)
     
     for col in columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            continue
+        df[col] = parse_datetimes(df[col], formats[col])
+    
+    return df
+
+# the data types pandas gives to a column of datetimes from strptime(), and
+# to a column of NaT only, which depend on the version of pandas (e.g.
+# nanoseconds for both in pandas 2, microseconds and seconds in pandas 3)
+STRPTIME_DTYPE = pd.Series([datetime(2000, 1, 1)]).dtype
+NAT_DTYPE = pd.Series([pd.NaT]).dtype
+
+def parse_datetimes(values, dt_format: str):
+    """
+    Parses a column of datetime strings with the format 'dt_format' in one
+    go, as datetime.strptime() would for each value: values that are not
+    strings, or do not match the format, become NaT. Returns the column
+    with the data type of STRPTIME_DTYPE, or of NAT_DTYPE if no value
+    could be parsed, as when strptime() is mapped over the values.
+    """
+    if len(values) == 0:
+        return values.copy()
+    if ("%z" in dt_format) or ("%Z" in dt_format):
+        # the data type then depends on the time zones found: value by value
         def dt_converter(dt_str):
             try:
-                return datetime.strptime(dt_str, formats[col])
+                return datetime.strptime(dt_str, dt_format)
             except:
                 return pd.NaT
-        df[col] = df[col].map(dt_converter)
-    
-    return df
+        return values.map(dt_converter)
+    if pd.api.types.infer_dtype(values, skipna = True) not in ("string", "empty"):
+        values = values.where(np.array([isinstance(value, str) for value in values], dtype = bool))
+    values = values.where(~_rejected_by_strptime(values, dt_format))
+    parsed = pd.to_datetime(values, format = dt_format, errors = "coerce")
+    if parsed.notna().any():
+        return parsed.astype(STRPTIME_DTYPE)
+    return parsed.astype(NAT_DTYPE)
+
+def _rejected_by_strptime(values, dt_format: str):
+    # The strings that pandas.to_datetime() parses with the format, but
+    # datetime.strptime() does not, which become NaT:
+    # - 'now' and 'today', which pandas reads as the current time
+    # - fractions of seconds of more than 6 digits, which pandas reads
+    # down to nanoseconds
+    # - seconds 60 and 61, which strptime() matches but datetime does not
+    # allow, while pandas moves on to the next minute
+    # The fractions and the seconds are found after a '.' and a ':', as in
+    # the formats of the API
+    strings = values.astype(object).str
+    rejected = strings.strip().str.lower().isin(["now", "today"])
+    if "%f" in dt_format:
+        rejected = rejected | strings.contains(r"\.\d{7,}", regex = True)
+    if "%S" in dt_format:
+        rejected = rejected | strings.contains(r":6[01](?!\d)", regex = True)
+    return rejected.fillna(False).astype(bool)
 
 # account age
 def calculate_account_age(df):
@@ -181,6 +309,17 @@ def calculate_account_age(df):
     datetime data type.
     Returns the df with the new column.
     """
+    created_at, account_created_at = df["created_at"], df["account_created_at"]
+    if (len(df) > 0) and pd.api.types.is_datetime64_dtype(created_at) \
+            and pd.api.types.is_datetime64_dtype(account_created_at):
+        # the built-in max() keeps NaT if it comes first
+        last_status_day = created_at.iloc[0] if pd.isna(created_at.iloc[0]) else created_at.max()
+        if pd.isna(last_status_day):
+            df["account_age"] = pd.Series(np.nan, index = df.index)
+        else:
+            df["account_age"] = (last_status_day - account_created_at).dt.days
+        return df
+    # other data types, e.g. strings, are handled value by value
     last_status_day = max(df["created_at"])
     def subs_days(dt):
         try:
@@ -190,24 +329,59 @@ def calculate_account_age(df):
     df["account_age"] = df["account_created_at"].map(subs_days)
     return df
 
+# columns with lists of dictionaries, which come as strings from csv files
+LIST_COLUMNS = ["tags", "mentions", "media_attachments", "emojis"]
+
+# the python literal in a string, as written by DataFrame.to_csv() for lists
+# of dictionaries, or None: no code is run, unlike with eval(). Repeated
+# strings, e.g. '[]', are decoded once, and share the decoded value
+@lru_cache(maxsize = 100000)
+def _literal(text):
+    try:
+        return ast.literal_eval(text)
+    except Exception:
+        return None
+
+# a function to decode the value of a list column: lists are kept, arrays
+# turned into lists, and strings decoded as python literals if they are a
+# list or a tuple; anything else is None
+def decode_list(content):
+    if isinstance(content, list):
+        return content
+    elif isinstance(content, np.ndarray):
+        return list(content)
+    elif type(content) == str:
+        value = _literal(content)
+        if isinstance(value, (list, tuple)):
+            return value
+    return None
+
+# decode_list() for a whole column, decoding each distinct string once
+def decode_list_column(values):
+    if len(values) == 0:
+        return values.copy()
+    return pd.Series([decode_list(value) for value in values], index = values.index, dtype = object)
+
 # a function to count list items, even when the data comes
 # as a string representation of json, which will be used
 # for tags, media, mentions, and emojis
 def count_items(content):
-    if type(content) == list:
-        return len(content)
-    elif type(content) == str:
-        try:
-            eval_list = eval(content)
-            if type(eval_list) == list:
-                return len(eval_list)
-            else:
-                return pd.NA
-        except:
-            return pd.NA
+    items = decode_list(content)
+    if isinstance(items, list):
+        return len(items)
     else:
         return pd.NA
 
+# count_items() for a whole column decoded by decode_list_column()
+def list_lengths(lists):
+    if len(lists) == 0:
+        return lists.copy()
+    is_list = lists.map(type) == list
+    lengths = lists.where(is_list, None).str.len().fillna(0).astype("int64")
+    if is_list.all():
+        return lengths
+    return lengths.astype(object).where(is_list, pd.NA)
+
 # a function to return 1 for count > 0, 0 otherwise
 def is_present(item_count):
     if pd.isna(item_count):
@@ -215,6 +389,16 @@ def is_present(item_count):
     else:
         return int(item_count > 0)
 
+# is_present() for a whole column of counts
+def present_column(item_counts):
+    if len(item_counts) == 0:
+        return item_counts.copy()
+    missing = item_counts.isna()
+    present = (item_counts.where(~missing, 0).astype("int64") > 0).astype("int64")
+    if missing.any():
+        return present.astype(object).where(~missing, pd.NA)
+    return present
+
 # tag info    
 def get_tag_info(df):
     """
@@ -229,28 +413,18 @@ def get_tag_info(df):
     """
     # a helper function to do conversions
     # the tags column has the form of list of dicts where name is the key for each tag
-    def dict_names_to_string(content):
-        if type(content) == list:
-            list_of_dicts = content
-        elif type(content) == str:
-            try:
-                list_of_dicts = eval(content)
-            except:
-                list_of_dicts = []
-        else:
-            list_of_dicts = []
-
+    def dict_names_to_string(list_of_dicts):
+        if list_of_dicts is None:
+            return ""
         try:
-            tag_name = " "
-            for dt in list_of_dicts:
-                tag_name += dt["name"] + " "
-            return tag_name.strip()
+            return " ".join([dt["name"] for dt in list_of_dicts]).strip()
         except:
             return ""
     
+    df["tags"] = decode_list_column(df["tags"])
     df["tags_str"] = df["tags"].map(dict_names_to_string)
-    df["tag_count"] = df["tags"].map(count_items)
-    df["any_tag"] = df["tag_count"].map(is_present)
+    df["tag_count"] = list_lengths(df["tags"])
+    df["any_tag"] = present_column(df["tag_count"])
 
     return df
 
@@ -262,8 +436,9 @@ def get_media_info(df):
     showing if there are any media attachments (any_media).  
     """
     
-    df["media_count"] = df["media_attachments"].map(count_items)
-    df["any_media"] = df["media_count"].map(is_present)
+    df["media_attachments"] = decode_list_column(df["media_attachments"])
+    df["media_count"] = list_lengths(df["media_attachments"])
+    df["any_media"] = present_column(df["media_count"])
     return df
     
 # mention info
@@ -274,8 +449,9 @@ def get_mention_info(df):
     if there are any mentions (any_mention).  
     """
 
-    df["mention_count"] = df["mentions"].map(count_items)
-    df["any_mention"] = df["mention_count"].map(is_present)
+    df["mentions"] = decode_list_column(df["mentions"])
+    df["mention_count"] = list_lengths(df["mentions"])
+    df["any_mention"] = present_column(df["mention_count"])
     return df
     
 # emoji info
@@ -285,8 +461,9 @@ def get_emoji_info(df):
     one with the number of emojis (emoji_count), and one showing 
     if there are any emojis (any_emoji).  
     """
-    df["emoji_count"] = df["emojis"].map(count_items)
-    df["any_emoji"] = df["emoji_count"].map(is_present)
+    df["emojis"] = decode_list_column(df["emojis"])
+    df["emoji_count"] = list_lengths(df["emojis"])
+    df["any_emoji"] = present_column(df["emoji_count"])
     return df
 
 # card info
@@ -297,41 +474,35 @@ def get_card_info(df):
     more useful card categories, converting null values to "no card". 
     The second new column shows if there is any card.
     """
-    # helper function to map values to new categories
-    def card_categorise(card_type): 
-        cat = "No card"
-        if card_type == "link":
-            cat = "link"
-        elif card_type == "video":
-            cat = "video/photo"
-        elif card_type == "photo":
-            cat = "video/photo"
-        return cat
-    df["card_categories"] = df["card_type"].map(card_categorise)
-    df["any_card"] = df["card_categories"].map(lambda cat: 0 if cat == "No card" else 1)
+    # card types with a category, any other value is "No card"
+    categories = {"link": "link", "video": "video/photo", "photo": "video/photo"}
+    card_types = df["card_type"]
+    if len(card_types) == 0:
+        df["card_categories"] = card_types.copy()
+        df["any_card"] = card_types.copy()
+        return df
+    is_known = card_types.isin(list(categories))
+    card_categories = pd.Series("No card", index = df.index, dtype = object)
+    card_categories[is_known] = card_types[is_known].map(categories)
+    df["card_categories"] = card_categories.astype("str")
+    df["any_card"] = is_known.astype("int64")
     return df
 
 
-def clean_data(df, strip_text = True, annotate_text = True, no_link_text = True, 
-               content_length = True, datetime = True, account_age = True, 
-               tags = True, media = True, mention = True, emoji = True, card = True):
-    """
-    This is a convenience function to apply all or some of the functions 
-    of this module in one go. By default, all functions are applied.
-    """
 
-    if strip_text:
-        df = get_stripped_text(df)
-    if annotate_text:
-        df = get_annotated_text(df)
-    if no_link_text:
-        df = get_text_no_links(df)
+def _clean_rows(df, strip_text = True, annotate_text = True, no_link_text = True,
+                content_length = True, datetime = True, tags = True, media = True,
+                mention = True, emoji = True, card = True):
+    # Applies the steps of clean_data() that work row by row, and returns
+    # the dataframe with the columns it had before the account age, which
+    # needs the whole dataframe
+    if strip_text or annotate_text or no_link_text:
+        df = get_texts(df, strip_text, annotate_text, no_link_text)
     if content_length:
         df = get_content_length(df)
     if datetime:
         df = convert_to_datetime(df)
-    if account_age:
-        df = calculate_account_age(df)
+    columns_before_age = list(df.columns)
     if tags:
         df = get_tag_info(df)
     if media:
@@ -342,16 +513,122 @@ def clean_data(df, strip_text = True, annotate_text = True, no_link_text = True,
         df = get_emoji_info(df)
     if card:
         df = get_card_info(df)
+    return df, columns_before_age
+
+def _clean_chunk(args):
+    # Cleans a chunk of a dataframe in a worker process
+    chunk, steps = args
+    return _clean_rows(chunk, **steps)
+
+def _concat_chunks(chunks):
+    # Puts the cleaned chunks back together, in their order, with the data
+    # types of the columns as with the serial steps. The steps infer the
+    # data types from the values of each chunk, where the serial steps
+    # infer them from all values, so that a column can get another data
+    # type in some chunks:
+    # - counts and flags are int64 in a chunk without missing values, and
+    # object (with pd.NA) in the others; with all rows, they are object
+    # - datetimes are in seconds in a chunk where none could be parsed, and
+    # in microseconds in the others; with all rows, they are in microseconds
+    dtypes = {}
+    for col in chunks[0].columns:
+        chunk_dtypes = [chunk[col].dtype for chunk in chunks]
+        if all([dtype == chunk_dtypes[0] for dtype in chunk_dtypes]):
+            continue
+        if all([pd.api.types.is_datetime64_dtype(dtype) for dtype in chunk_dtypes]):
+            parsed = [chunk[col].dtype for chunk in chunks if chunk[col].notna().any()]
+            dtypes[col] = parsed[0] if len(parsed) > 0 else chunk_dtypes[0]
+        else:
+            dtypes[col] = object
+    return pd.concat([chunk.astype(dtypes) for chunk in chunks])
+
+# the steps of clean_data(), in the order they are applied: the name of
+# the argument switching the step on, the columns it needs, and the columns
+# it creates or converts. A step only needs columns of earlier steps or of
+# the processed data.
+CLEANING_STEPS = [
+    ("strip_text", ["content"], ["content_stripped"]),
+    ("annotate_text", ["content"], ["content_annotated"]),
+    ("no_link_text", ["content"], ["content_plain_text"]),
+    ("content_length", ["content_plain_text"], ["content_length"]),
+    ("datetime", [], ["created_at", "edited_at", "account_created_at", "account_last_status_at",
+                      "card_published_at", "poll_expires_at"]),
+    ("account_age", ["created_at", "account_created_at"], ["account_age"]),
+    ("tags", ["tags"], ["tags", "tags_str", "tag_count", "any_tag"]),
+    ("media", ["media_attachments"], ["media_attachments", "media_count", "any_media"]),
+    ("mention", ["mentions"], ["mentions", "mention_count", "any_mention"]),
+    ("emoji", ["emojis"], ["emojis", "emoji_count", "any_emoji"]),
+    ("card", ["card_type"], ["card_categories", "any_card"])
+]
+
+def plan_cleaning(columns: list) -> dict:
+    """
+    Returns the arguments of clean_data() that switch on the steps needed
+    for the columns in 'columns', and only those: the steps creating or
+    converting these columns, and the steps creating the columns they
+    need, in turn. Columns that no step creates, e.g. 'id', need no step.
+    """
+    needed = set(columns)
+    steps = {}
+    for name, requires, creates in reversed(CLEANING_STEPS):
+        steps[name] = len(needed.intersection(creates)) > 0
+        if steps[name]:
+            needed.update(requires)
+    return {name: steps[name] for name, _, _ in CLEANING_STEPS}
+
+def clean_data(df, strip_text = True, annotate_text = True, no_link_text = True, 
+               content_length = True, datetime = True, account_age = True, 
+               tags = True, media = True, mention = True, emoji = True, card = True,
+               n_jobs: int = 1, chunk_size: int = 2000, columns: list = None):
+    """
+    This is a convenience function to apply all or some of the functions 
+    of this module in one go. By default, all functions are applied.
+    - The argument 'columns' is an optional list of the columns needed,
+    e.g. those kept by reduce_df(). Only the steps needed for them are
+    applied, as planned by plan_cleaning(), and the arguments switching
+    steps on or off are ignored.
+    - The argument 'n_jobs' specifies the number of processes used for the
+    steps that work row by row (text extraction, content length, datetimes,
+    tags, media, mentions, emojis and cards). The default is 1, in this
+    process. With more, the dataframe is split into chunks of at most
+    'chunk_size' rows, cleaned in a process pool, and put back together
+    in the original order; the account age is then calculated over the
+    whole dataframe. The result is the same as with n_jobs = 1.
+    """
+    steps = {
+        "strip_text": strip_text, "annotate_text": annotate_text, "no_link_text": no_link_text,
+        "content_length": content_length, "datetime": datetime, "account_age": account_age,
+        "tags": tags, "media": media, "mention": mention, "emoji": emoji, "card": card
+    }
+    if columns is not None:
+        steps = plan_cleaning(columns)
+    account_age = steps.pop("account_age")
+    n_chunks = min(max(n_jobs, -(-len(df) // chunk_size)), len(df))
+    if (n_jobs > 1) and (n_chunks > 1):
+        bounds = np.linspace(0, len(df), n_chunks + 1).astype(int)
+        chunks = [df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            results = list(executor.map(_clean_chunk, [(chunk, steps) for chunk in chunks]))
+        df = _concat_chunks([chunk for chunk, _ in results])
+        columns_before_age = results[0][1]
+    else:
+        df, columns_before_age = _clean_rows(df, **steps)
+    if account_age:
+        df = calculate_account_age(df)
+        # the account age comes before the columns of the later steps, as in the serial order
+        if "account_age" not in columns_before_age:
+            columns_before_age.append("account_age")
+        df = df[columns_before_age + [col for col in df.columns if col not in columns_before_age]]
     return df
 
 # keep only posts marked as english and written with mostly alphanum characters
 def keep_only_english(df):
     df = df[df["language"] == "en"].copy()
 
-    if df["content_plain_text"] is None:
+    if "content_plain_text" not in df.columns:
         df = get_text_no_links(df)
     
-    if df["content_length"] is None:
+    if "content_length" not in df.columns:
         df = get_content_length(df)
     
     def keep_alphanum(text):
@@ -370,18 +647,19 @@ def keep_only_english(df):
     return df
 
 # Reducing the dataset to columns needed for further analyses and modelling
-def reduce_df(df, 
-                cols_to_keep: list = ['id', 'created_at', 'language', 'replies_count', 
-                                      'reblogs_count', 'favourites_count', 'content_stripped', 
-                                      'content_annotated', 'content_plain_text', 'content_length', 
-                                      'content_only_alphanum', 'content_length_alphanum',
-                                      'account_id', 'account_bot', 'account_created_at', 
-                                      'account_followers_count', 'account_following_count', 
-                                      'account_statuses_count', 'account_last_status_at', 
-                                      'account_age','tags_str', 'tag_count', 'any_tag',  
-                                      'media_count', 'any_media', 'mention_count', 'any_mention', 
-                                      'emoji_count', 'any_emoji', 'card_categories', 'any_card'], 
-                 add_col: list = None, remove_col: list = None):
+REDUCED_COLUMNS = ['id', 'created_at', 'language', 'replies_count', 
+                   'reblogs_count', 'favourites_count', 'content_stripped', 
+                   'content_annotated', 'content_plain_text', 'content_length', 
+                   'content_only_alphanum', 'content_length_alphanum',
+                   'account_id', 'account_bot', 'account_created_at', 
+                   'account_followers_count', 'account_following_count', 
+                   'account_statuses_count', 'account_last_status_at', 
+                   'account_age','tags_str', 'tag_count', 'any_tag',  
+                   'media_count', 'any_media', 'mention_count', 'any_mention', 
+                   'emoji_count', 'any_emoji', 'card_categories', 'any_card']
+
+def reduce_df(df, cols_to_keep: list = REDUCED_COLUMNS, 
+              add_col: list = None, remove_col: list = None):
     """
     This function takes a dataframe of mastodon statuses, 
     and returns a smaller dataframe with columns likely to be used 
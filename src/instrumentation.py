@@ -0,0 +1,285 @@
+"""
+This module defines the instrumentation of the requests sent to a
+Mastodon server. For every request, the endpoint, latency, size of the
+body, status code, remaining rate limit and time spent sleeping before
+it are recorded, as well as the time spent decoding the responses. These
+are aggregated per endpoint into counters and histograms, which can be
+written out at the end of a run as json and in the Prometheus textfile
+format, to see whether a run is bound by the network, the rate limit or
+the decoding of the responses.
+There is one RequestMetrics object per server in a process, shared by
+all instances of MastodonStatuses and its children classes, which can be
+obtained with get_request_metrics().
+"""
+
+# Dependencies
+import os
+import re
+import json
+import threading
+from bisect import bisect_left
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+# upper bounds of the histogram buckets
+LATENCY_BUCKETS = [0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+BYTES_BUCKETS = [1000, 5000, 10000, 50000, 100000, 500000, 1000000]
+SLEEP_BUCKETS = [0.01, 0.1, 0.5, 1, 5, 10, 60, 300]
+PARSE_BUCKETS = [0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5]
+
+def endpoint_name(url: str) -> str:
+    """
+    Returns the endpoint of a request URL, with ids replaced by ':id',
+    e.g. 'accounts/:id/statuses'.
+    """
+    path = urlparse(url).path
+    path = re.sub(r"^/?api/v\d+/", "", path).strip("/")
+    return re.sub(r"/\d+(?=/|$)", "/:id", path)
+
+class Histogram:
+    """
+    This class counts observations in buckets with the given upper bounds,
+    and keeps their sum, as Prometheus histograms. It is not thread-safe
+    on its own; RequestMetrics locks around it.
+    """
+    def __init__(self, buckets: list) -> None:
+        self.buckets = list(buckets)
+        # one count per bucket, and one for values above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        # cumulative counts, keyed by upper bound, as in Prometheus
+        cumulative = {}
+        total = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            total += count
+            cumulative[str(bound)] = total
+        return {"buckets": cumulative, "sum": self.sum, "count": self.count}
+
+# Class definition
+class RequestMetrics:
+    """
+    This class aggregates the metrics of the requests per endpoint. The
+    methods record(), record_cache_hit() and record_parse() are called by
+    MastodonStatuses for every request, and to_dict() and to_prometheus()
+    export the metrics; write_metrics() saves those of several servers to
+    files. The method reset() starts over, e.g. for a new run. The class is
+    thread-safe.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        This method removes all recorded metrics.
+        """
+        with self.lock:
+            self.started_at = datetime.now(timezone.utc)
+            self.endpoints = {}
+
+    def _endpoint(self, endpoint: str) -> dict:
+        # The metrics of an endpoint, created if needed. Must be called
+        # with the lock held.
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = {
+                "requests": 0,
+                "status_codes": {},
+                "cache_hits": 0,
+                "bytes": 0,
+                "rate_limit_sleep_seconds": 0.0,
+                "backoff_sleep_seconds": 0.0,
+                "rate_limit_remaining_min": None,
+                "rate_limit_remaining_last": None,
+                "latency_seconds": Histogram(LATENCY_BUCKETS),
+                "response_bytes": Histogram(BYTES_BUCKETS),
+                "sleep_seconds": Histogram(SLEEP_BUCKETS),
+                "parse_seconds": Histogram(PARSE_BUCKETS)
+            }
+        return self.endpoints[endpoint]
+
+    def record(self, endpoint: str, latency: float, n_bytes: int, status_code,
+               rate_limit_remaining = None, rate_limit_sleep: float = 0.0,
+               backoff_sleep: float = 0.0) -> None:
+        """
+        This method records a request to 'endpoint' (see endpoint_name()):
+        its latency in seconds, the size of the body in bytes, the status
+        code (None if there was no response), the remaining rate limit from
+        the headers, if any, and the seconds slept before it was sent, for
+        the rate limiter and for the backoff of the retry policy (including
+        an open circuit).
+        """
+        with self.lock:
+            metrics = self._endpoint(endpoint)
+            metrics["requests"] += 1
+            code = str(status_code) if status_code is not None else "error"
+            metrics["status_codes"][code] = metrics["status_codes"].get(code, 0) + 1
+            metrics["bytes"] += n_bytes
+            metrics["latency_seconds"].observe(latency)
+            metrics["response_bytes"].observe(n_bytes)
+            metrics["rate_limit_sleep_seconds"] += rate_limit_sleep
+            metrics["backoff_sleep_seconds"] += backoff_sleep
+            metrics["sleep_seconds"].observe(rate_limit_sleep + backoff_sleep)
+            if rate_limit_remaining is not None:
+                remaining = int(rate_limit_remaining)
+                metrics["rate_limit_remaining_last"] = remaining
+                if (metrics["rate_limit_remaining_min"] is None) or (remaining < metrics["rate_limit_remaining_min"]):
+                    metrics["rate_limit_remaining_min"] = remaining
+
+    def record_cache_hit(self, endpoint: str) -> None:
+        """
+        This method records a response served from the cache.
+        """
+        with self.lock:
+            self._endpoint(endpoint)["cache_hits"] += 1
+
+    def record_parse(self, endpoint: str, seconds: float) -> None:
+        """
+        This method records the seconds taken to decode a response.
+        """
+        with self.lock:
+            self._endpoint(endpoint)["parse_seconds"].observe(seconds)
+
+    def to_dict(self) -> dict:
+        """
+        This method returns the metrics as a dictionary, with the totals
+        of all endpoints and the metrics of each endpoint.
+        """
+        with self.lock:
+            endpoints = {}
+            for endpoint, metrics in self.endpoints.items():
+                endpoints[endpoint] = {
+                    name: (value.to_dict() if isinstance(value, Histogram) else
+                           dict(value) if isinstance(value, dict) else value)
+                    for name, value in metrics.items()
+                }
+            totals = {
+                "requests": sum([m["requests"] for m in self.endpoints.values()]),
+                "cache_hits": sum([m["cache_hits"] for m in self.endpoints.values()]),
+                "bytes": sum([m["bytes"] for m in self.endpoints.values()]),
+                "latency_seconds": sum([m["latency_seconds"].sum for m in self.endpoints.values()]),
+                "rate_limit_sleep_seconds": sum([m["rate_limit_sleep_seconds"] for m in self.endpoints.values()]),
+                "backoff_sleep_seconds": sum([m["backoff_sleep_seconds"] for m in self.endpoints.values()]),
+                "parse_seconds": sum([m["parse_seconds"].sum for m in self.endpoints.values()])
+            }
+            return {
+                "started_at": self.started_at.isoformat(),
+                "written_at": datetime.now(timezone.utc).isoformat(),
+                "totals": totals,
+                "endpoints": endpoints
+            }
+
+    def _prometheus_families(self, prefix: str, labels: dict) -> dict:
+        # The samples of each metric family, keyed by name, with its type
+        # and help text, so that the families of several servers can be
+        # merged into one file
+        metrics = self.to_dict()["endpoints"]
+        extra = "".join([f',{name}="{value}"' for name, value in (labels or {}).items()])
+        families = {}
+
+        def add_family(name, kind, help_text):
+            families[f"{prefix}_{name}"] = (kind, help_text, [])
+            return families[f"{prefix}_{name}"][2]
+
+        samples = add_family("requests_total", "counter", "Requests sent, by endpoint and status code.")
+        for endpoint, m in metrics.items():
+            for code, count in m["status_codes"].items():
+                samples.append(f'{prefix}_requests_total{{endpoint="{endpoint}",code="{code}"{extra}}} {count}')
+        samples = add_family("cache_hits_total", "counter", "Responses served from the cache.")
+        for endpoint, m in metrics.items():
+            samples.append(f'{prefix}_cache_hits_total{{endpoint="{endpoint}"{extra}}} {m["cache_hits"]}')
+        samples = add_family("sleep_seconds_total", "counter", "Time slept before the requests, by reason.")
+        for endpoint, m in metrics.items():
+            for reason in ["rate_limit", "backoff"]:
+                samples.append(f'{prefix}_sleep_seconds_total{{endpoint="{endpoint}",reason="{reason}"{extra}}} '
+                               f'{m[reason + "_sleep_seconds"]}')
+        samples = add_family("rate_limit_remaining", "gauge", "Remaining rate limit in the last response.")
+        for endpoint, m in metrics.items():
+            if m["rate_limit_remaining_last"] is not None:
+                samples.append(f'{prefix}_rate_limit_remaining{{endpoint="{endpoint}"{extra}}} {m["rate_limit_remaining_last"]}')
+        for name, help_text in [
+            ("latency_seconds", "Time from sending a request to receiving its response."),
+            ("response_bytes", "Size of the response bodies."),
+            ("sleep_seconds", "Time slept before a request, for the rate limit and retries."),
+            ("parse_seconds", "Time taken to decode the responses.")
+        ]:
+            samples = add_family(name, "histogram", help_text)
+            for endpoint, m in metrics.items():
+                histogram = m[name]
+                for bound, count in histogram["buckets"].items():
+                    samples.append(f'{prefix}_{name}_bucket{{endpoint="{endpoint}",le="{bound}"{extra}}} {count}')
+                samples.append(f'{prefix}_{name}_sum{{endpoint="{endpoint}"{extra}}} {histogram["sum"]}')
+                samples.append(f'{prefix}_{name}_count{{endpoint="{endpoint}"{extra}}} {histogram["count"]}')
+        return families
+
+    def to_prometheus(self, prefix: str = "mastodon_collection", labels: dict = None) -> str:
+        """
+        This method returns the metrics in the Prometheus text format, with
+        metric names starting with 'prefix', and the extra 'labels', e.g.
+        the server, on every metric.
+        """
+        return prometheus_text([self], [labels], prefix = prefix)
+
+def prometheus_text(metrics: list, labels: list, prefix: str = "mastodon_collection") -> str:
+    """
+    Returns several RequestMetrics in one text in the Prometheus format,
+    each with the labels at the same position of the list 'labels', e.g.
+    [{"server": "mastodon.social"}, ...], which should tell them apart.
+    """
+    merged = {}
+    for request_metrics, extra in zip(metrics, labels):
+        for name, (kind, help_text, samples) in request_metrics._prometheus_families(prefix, extra).items():
+            merged.setdefault(name, (kind, help_text, []))[2].extend(samples)
+    lines = []
+    for name, (kind, help_text, samples) in merged.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+def _write_atomic(path: str, content: str) -> None:
+    # Writes a file under a temporary name and renames it, so that a
+    # collector never reads a partial file
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path + ".tmp", "w") as output:
+        output.write(content)
+    os.replace(path + ".tmp", path)
+
+def write_metrics(servers: list, json_path: str = None, prometheus_path: str = None) -> None:
+    """
+    Writes the request metrics of the given servers, as returned by
+    get_request_metrics(), as json keyed by server to 'json_path', and in
+    the Prometheus textfile format, with a 'server' label, to
+    'prometheus_path', if these are given. The directories are created if
+    they do not exist.
+    """
+    metrics = [get_request_metrics(server) for server in servers]
+    if json_path is not None:
+        content = {server: m.to_dict() for server, m in zip(servers, metrics)}
+        _write_atomic(json_path, json.dumps(content, indent = 2))
+    if prometheus_path is not None:
+        labels = [{"server": server} for server in servers]
+        _write_atomic(prometheus_path, prometheus_text(metrics, labels))
+
+# one RequestMetrics per server, shared within the process
+_request_metrics = {}
+_request_metrics_lock = threading.Lock()
+
+def get_request_metrics(server: str) -> RequestMetrics:
+    """
+    Returns the request metrics of the given server, creating them if they
+    do not exist yet.
+    """
+    with _request_metrics_lock:
+        if server not in _request_metrics:
+            _request_metrics[server] = RequestMetrics()
+        return _request_metrics[server]
@@ -5,8 +5,69 @@ other classes that will send specific types of requests, in order
 to simplify the definitions of these children classes.
 """
 
-# dependency
+# dependencies
+import asyncio
+from time import sleep, perf_counter
 import requests
+from requests.adapters import HTTPAdapter
+
+from src.rate_limiter import RateLimiter, get_rate_limiter
+from src.retry_policy import RetryPolicy, get_retry_policy
+from src.response_cache import ResponseCache
+from src.status_ids import window_cursors
+from src.instrumentation import RequestMetrics, get_request_metrics, endpoint_name
+from src.status_records import StatusSchema, loads
+
+# aiohttp is only needed for the asynchronous request methods
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# default (connect, read) timeouts in seconds for all requests
+DEFAULT_TIMEOUT = (5, 30)
+
+# transport adapter with a default timeout
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    This transport adapter applies a default timeout to every request
+    sent through it, unless a timeout is given explicitly. The pool
+    sizes are passed on to the parent class HTTPAdapter.
+    """
+
+    # keep the timeout when the adapter is pickled
+    __attrs__ = HTTPAdapter.__attrs__ + ["timeout"]
+
+    def __init__(self, timeout : tuple = DEFAULT_TIMEOUT, **kwargs) -> None:
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+# a session with a pool of keep-alive connections
+def create_session(pool_size : int = 10, timeout : tuple = DEFAULT_TIMEOUT) -> requests.Session:
+    """
+    Creates a requests session that keeps connections alive and reuses
+    them across requests, so that TCP and TLS handshakes are not repeated
+    for every request.
+    - The argument 'pool_size' specifies the number of connections kept
+    in the pool per host. It should be at least the number of requests
+    that are sent at the same time.
+    - The argument 'timeout' specifies the default (connect, read)
+    timeouts in seconds.
+    Responses are requested with gzip compression.
+    """
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(timeout = timeout, 
+                                 pool_connections = pool_size, 
+                                 pool_maxsize = pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return session
 
 # class definition
 class MastodonStatuses:
@@ -14,30 +75,348 @@ class MastodonStatuses:
     This class sends a request to the Mastodon API, and stores the response.
     - The argument 'server' specifies the Mastodon instance to send the
     requests. This should be a string that will resolve into a valid URL.
-    If no server is specified, it defaults to 'mastodon.social'.
+    If no server is specified, it defaults to 'mastodon.social'. The scheme 
+    is 'https' unless the string includes one, e.g. 'http://localhost:8000'.
     - The argument 'token' is an authorisation token. This is optional, and
     is normally not required to fetch trending statuses, but can be useful
     for consistency.
+    - The argument 'session' is an optional requests session to send the 
+    requests with. This allows several instances to share the same pool 
+    of keep-alive connections. If no session is given, a new one is 
+    created with create_session(), using the arguments 'pool_size' 
+    (number of pooled connections) and 'timeout' (default (connect, read) 
+    timeouts in seconds).
+    - The argument 'rate_limiter' is an optional RateLimiter that paces the
+    requests. If none is given, the rate limiter of the server is used, 
+    which is shared by all instances in the process.
+    - The argument 'retry_policy' is an optional RetryPolicy that retries 
+    requests failing with transient errors. If none is given, the retry 
+    policy of the server is used, which is also shared in the process.
+    - The argument 'cache' is an optional ResponseCache. If given, fresh
+    cached responses are used instead of sending requests, and stale ones
+    are revalidated with conditional requests. The cache is not pickled.
+    - The argument 'metrics' is an optional RequestMetrics that records the
+    latency, size, status code, remaining rate limit and waiting time of
+    every request, and the time taken to decode the responses. If none is
+    given, the metrics of the server are used, shared in the process.
+    - The argument 'fields' is an optional list of the fields of the statuses
+    to keep, as in status_records.DEFAULT_FIELDS. If given, the statuses of
+    the responses are stored as compact StatusRecords with these fields only,
+    instead of the full dictionaries. By default, all fields are kept.
     The methods of the class can send three types of requests:
     - req_trending() fetches trending statuses.
-    - req_timeline() fetches statuses from the public timeline.
+    - req_timeline() fetches statuses from the public timeline, and
+    req_timeline_window() those posted within a time window.
     - req_account_statuses() fetches statuses from a specific account.
     The response from the API is stored in the attribute 'response', and
     the type of the last request is stored in 'last_req_type'.
     """
 
-    def __init__(self, server : str = None, token : str = None) -> None:
+    def __init__(self, server : str = None, token : str = None, 
+                 session : requests.Session = None, pool_size : int = 10, 
+                 timeout : tuple = DEFAULT_TIMEOUT, 
+                 rate_limiter : RateLimiter = None, 
+                 retry_policy : RetryPolicy = None, 
+                 cache : ResponseCache = None, 
+                 metrics : RequestMetrics = None, 
+                 fields : list = None) -> None:
         if server:
             self.server = server
         else:
             self.server = "mastodon.social"
-        self.server_url = f"https://{self.server}/"
+        # a scheme can be included, e.g. 'http://localhost:8000' for a local test server
+        if "://" in self.server:
+            self.server_url = self.server.rstrip("/") + "/"
+        else:
+            self.server_url = f"https://{self.server}/"
         self.token = token
         if self.token:
             self.headers = {"Authorization": f"Bearer {self.token}"}
+        self.pool_size = pool_size
+        self.timeout = timeout
+        if session is not None:
+            self.session = session
+        else:
+            self.session = create_session(pool_size = pool_size, timeout = timeout)
+        if rate_limiter is not None:
+            self.rate_limiter = rate_limiter
+        else:
+            self.rate_limiter = get_rate_limiter(self.server)
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+        else:
+            self.retry_policy = get_retry_policy(self.server)
+        self.cache = cache
+        if metrics is not None:
+            self.metrics = metrics
+        else:
+            self.metrics = get_request_metrics(self.server)
+        self.fields = fields
+        self.schema = StatusSchema(fields) if fields is not None else None
         self.response = None
         self.last_req_type = None
 
+    def __getstate__(self) -> dict:
+        # the session and the cache hold open connections, and the rate
+        # limiter, retry policy and metrics are shared within the process,
+        # so these are not pickled
+        state = self.__dict__.copy()
+        state["session"] = None
+        state["rate_limiter"] = None
+        state["retry_policy"] = None
+        state["cache"] = None
+        state["metrics"] = None
+        return state
+
+    def __setstate__(self, state : dict) -> None:
+        # a new session is created when an instance is unpickled
+        # instances pickled before sessions were added have no pool settings
+        state.setdefault("pool_size", 10)
+        state.setdefault("timeout", DEFAULT_TIMEOUT)
+        state.setdefault("cache", None)
+        state.setdefault("fields", None)
+        state.setdefault("schema", None)
+        self.__dict__.update(state)
+        self.session = create_session(pool_size = self.pool_size, timeout = self.timeout)
+        self.rate_limiter = get_rate_limiter(self.server)
+        self.retry_policy = get_retry_policy(self.server)
+        self.metrics = get_request_metrics(self.server)
+
+    def _send_request(self, req_url : str) -> requests.Response:
+        """
+        This method sends a GET request with the session of the instance,
+        adding the authorisation header if a token exists, and returns
+        the response. The request waits for the rate limiter, which is
+        then updated with the headers of the response.
+        Requests that time out, cannot connect, or get a response with a
+        status code to retry are sent again as set by the retry policy. 
+        The last response is returned if all attempts fail; if there was
+        no response at the last attempt, the exception is raised.
+        If the instance has a cache, a fresh cached response is returned
+        without a request, and a stale one is revalidated.
+        Every attempt is recorded in the metrics of the instance.
+        """
+        endpoint = endpoint_name(req_url)
+        headers = dict(self.headers) if self.token else {}
+        if self.cache is not None:
+            cached, conditional = self.cache.lookup(req_url)
+            if cached is not None:
+                self.metrics.record_cache_hit(endpoint)
+                return cached
+            headers.update(conditional)
+
+        attempt = 0
+        delay = 0.0
+        while True:
+            backoff_sleep = delay + self.retry_policy.wait_circuit()
+            rate_limit_sleep = self.rate_limiter.acquire()
+            start = perf_counter()
+            try:
+                response = self.session.get(req_url, headers=headers)
+            except (requests.ConnectionError, requests.Timeout):
+                self.metrics.record(endpoint, perf_counter() - start, 0, None, 
+                                    rate_limit_sleep = rate_limit_sleep, backoff_sleep = backoff_sleep)
+                self.retry_policy.record(None)
+                if attempt >= self.retry_policy.max_retries:
+                    self.retry_policy.record_failed()
+                    raise
+                delay = self.retry_policy.backoff(attempt)
+            else:
+                self.metrics.record(endpoint, perf_counter() - start, len(response.content), 
+                                    response.status_code, response.headers.get("X-RateLimit-Remaining"), 
+                                    rate_limit_sleep = rate_limit_sleep, backoff_sleep = backoff_sleep)
+                self.rate_limiter.update(response.headers)
+                self.retry_policy.record(response.status_code)
+                if (response.status_code == 304) and (self.cache is not None):
+                    cached = self.cache.revalidated(req_url, response.headers)
+                    if cached is not None:
+                        return cached
+                    # evicted in the meantime: request the full response
+                    headers.pop("If-None-Match", None)
+                    headers.pop("If-Modified-Since", None)
+                    delay = 0.0
+                    continue
+                if response.status_code == 200:
+                    if self.cache is not None:
+                        self.cache.store(req_url, response.content, response.headers)
+                    return response
+                if (attempt >= self.retry_policy.max_retries) or not self.retry_policy.is_retryable(response.status_code):
+                    self.retry_policy.record_failed()
+                    return response
+                delay = self.retry_policy.backoff(attempt, response.headers)
+            self.retry_policy.record_retry()
+            sleep(delay)
+            attempt += 1
+
+    def _decode(self, content : bytes, endpoint : str):
+        # Decodes a json body, keeping only the fields of the schema if the
+        # body is a list of statuses, and records the time taken in the metrics
+        start = perf_counter()
+        body = loads(content)
+        if (self.schema is not None) and isinstance(body, list):
+            body = self.schema.project_all(body)
+        self.metrics.record_parse(endpoint, perf_counter() - start)
+        return body
+
+    def _restore(self, statuses : list) -> list:
+        # Statuses saved as dictionaries, e.g. in a checkpoint, as they
+        # would have been stored from a response
+        if self.schema is None:
+            return statuses
+        return self.schema.project_all(statuses)
+
+    def parse_json(self, response : requests.Response = None):
+        """
+        This method returns the decoded json body of 'response', or of the
+        last response if none is given, and records the time taken in the
+        metrics, to compare it with the time spent on the requests. Lists
+        of statuses are returned as StatusRecords if 'fields' was given.
+        """
+        if response is None:
+            response = self.response
+        return self._decode(response.content, endpoint_name(response.url or ""))
+
+    def _report_retries(self, stats_before : dict) -> None:
+        # Prints how many requests failed and were retried since the
+        # retry policy returned 'stats_before'
+        stats = self.retry_policy.stats()
+        print(f"{stats['failed'] - stats_before['failed']} requests failed,", 
+              f"{stats['retried'] - stats_before['retried']} were retried.")
+
+    def _async_client(self, max_concurrency : int = 10):
+        """
+        This method creates an aiohttp client session for the asynchronous
+        request methods, with at most 'max_concurrency' open connections,
+        the same timeouts and the authorisation header if a token exists.
+        It should be used as an async context manager.
+        """
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for asynchronous requests")
+        if isinstance(self.timeout, tuple):
+            connect_timeout, read_timeout = self.timeout
+        else:
+            connect_timeout = read_timeout = self.timeout
+        headers = {"Accept-Encoding": "gzip, deflate"}
+        if self.token:
+            headers.update(self.headers)
+        return aiohttp.ClientSession(
+            headers = headers, 
+            connector = aiohttp.TCPConnector(limit = max_concurrency), 
+            timeout = aiohttp.ClientTimeout(sock_connect = connect_timeout, sock_read = read_timeout)
+        )
+
+    async def _asend_request(self, client, req_url : str) -> tuple:
+        """
+        This method is the asynchronous counterpart of _send_request(). It 
+        sends a GET request with the given aiohttp client session, and returns
+        the status code, the response headers, and the decoded json body, 
+        which is None if the status code is not 200. Failed requests are
+        retried, and the cache is used, in the same way, and the requests are
+        recorded in the metrics.
+        """
+        endpoint = endpoint_name(req_url)
+        conditional = {}
+        if self.cache is not None:
+            cached, conditional = self.cache.lookup(req_url)
+            if cached is not None:
+                self.metrics.record_cache_hit(endpoint)
+                return cached.status_code, cached.headers, self._decode(cached.content, endpoint)
+
+        attempt = 0
+        delay = 0.0
+        while True:
+            backoff_sleep = delay + await self.retry_policy.await_circuit()
+            rate_limit_sleep = await self.rate_limiter.aacquire()
+            start = perf_counter()
+            status = None
+            try:
+                async with client.get(req_url, headers = conditional) as resp:
+                    self.rate_limiter.update(resp.headers)
+                    content = await resp.read() if resp.status == 200 else None
+                    status, headers = resp.status, resp.headers
+                self.metrics.record(endpoint, perf_counter() - start, len(content or b""), status, 
+                                    headers.get("X-RateLimit-Remaining"), 
+                                    rate_limit_sleep = rate_limit_sleep, backoff_sleep = backoff_sleep)
+                if (status == 304) and (self.cache is not None):
+                    cached = self.cache.revalidated(req_url, headers)
+                    if cached is not None:
+                        status, headers, content = 200, cached.headers, cached.content
+                    else:
+                        # evicted in the meantime: request the full response
+                        conditional = {}
+                        delay = 0.0
+                        continue
+                elif (status == 200) and (self.cache is not None):
+                    self.cache.store(req_url, content, headers)
+                body = self._decode(content, endpoint) if status == 200 else None
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if status is None:
+                    self.metrics.record(endpoint, perf_counter() - start, 0, None, 
+                                        rate_limit_sleep = rate_limit_sleep, backoff_sleep = backoff_sleep)
+                self.retry_policy.record(None)
+                if attempt >= self.retry_policy.max_retries:
+                    self.retry_policy.record_failed()
+                    raise
+                delay = self.retry_policy.backoff(attempt)
+            else:
+                self.retry_policy.record(status)
+                if status == 200:
+                    return status, headers, body
+                if (attempt >= self.retry_policy.max_retries) or not self.retry_policy.is_retryable(status):
+                    self.retry_policy.record_failed()
+                    return status, headers, body
+                delay = self.retry_policy.backoff(attempt, headers)
+            self.retry_policy.record_retry()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _trending_url(self, n_statuses : int = 40, offset : int = 0) -> str:
+        # URL of a request for trending statuses
+        return f"{self.server_url}api/v1/trends/statuses?limit={n_statuses}&offset={offset}"
+
+    def _timeline_url(self, n_statuses : int = 40, 
+                      mode : str = None, min_max_id : str = None) -> str:
+        # URL of a request for statuses from the public timeline
+        if mode is None:
+            req_url = f"{self.server_url}api/v1/timelines/public?limit={n_statuses}"
+        elif mode == "subsequent":
+            if min_max_id is None:
+                raise ValueError("min_max_id must be specified for subsequent mode")
+            req_url = f"{self.server_url}api/v1/timelines/public?limit={n_statuses}&min_id={min_max_id}"
+        elif mode == "previous":
+            if min_max_id is None:
+                raise ValueError("min_max_id must be specified for previous mode")
+            req_url = f"{self.server_url}api/v1/timelines/public?limit={n_statuses}&max_id={min_max_id}"
+        else:
+            raise ValueError("mode must be either None, 'subsequent', or 'previous'")
+        return req_url
+
+    def _timeline_window_url(self, start, end, n_statuses : int = 40, 
+                             newest : bool = False) -> str:
+        # URL of a request for statuses from the public timeline between two datetimes
+        min_id, max_id = window_cursors(start, end)
+        if newest:
+            # since_id returns the newest statuses before max_id, down to since_id
+            return f"{self.server_url}api/v1/timelines/public?limit={n_statuses}&since_id={min_id}&max_id={max_id}"
+        return f"{self.server_url}api/v1/timelines/public?limit={n_statuses}&min_id={min_id}&max_id={max_id}"
+
+    def _account_statuses_url(self, account_id : str, n_statuses : int = 40, 
+                              mode : str = None, min_max_id : str = None) -> str:
+        # URL of a request for statuses from a specific account
+        if mode is None:
+            req_url = f"{self.server_url}api/v1/accounts/{account_id}/statuses?limit={n_statuses}"
+        elif mode == "subsequent":
+            if min_max_id is None:
+                raise ValueError("min_id must be specified for subsequent mode")
+            req_url = f"{self.server_url}api/v1/accounts/{account_id}/statuses?limit={n_statuses}&min_id={min_max_id}"
+        elif mode == "previous":
+            if min_max_id is None:
+                raise ValueError("max_id must be specified for previous mode")
+            req_url = f"{self.server_url}api/v1/accounts/{account_id}/statuses?limit={n_statuses}&max_id={min_max_id}"
+        else:
+            raise ValueError("mode must be either None, 'subsequent', or 'previous'")
+        return req_url
+
     def req_trending(self, n_statuses : int = 40, offset : int = 0) -> None:
         """
         This method sends a request to the Mastodon API to fetch trending statuses.
@@ -47,12 +426,9 @@ class MastodonStatuses:
         and is used as the 'offset' parameter in the request.
         """
 
-        req_url = f"{self.server_url}api/v1/trends/statuses?limit={n_statuses}&offset={offset}"
+        req_url = self._trending_url(n_statuses = n_statuses, offset = offset)
 
-        if self.token:
-            self.response = requests.get(req_url, headers=self.headers)
-        else:
-            self.response = requests.get(req_url)
+        self.response = self._send_request(req_url)
         
         self.last_req_type = "trending"
     
@@ -73,26 +449,34 @@ class MastodonStatuses:
         the 'min_id' or 'max_id' parameter in the request.
         """
 
-        if mode is None:
-            req_url = f"{self.server_url}api/v1/timelines/public?limit={n_statuses}"
-        elif mode == "subsequent":
-            if min_max_id is None:
-                raise ValueError("min_max_id must be specified for subsequent mode")
-            req_url = f"{self.server_url}api/v1/timelines/public?limit={n_statuses}&min_id={min_max_id}"
-        elif mode == "previous":
-            if min_max_id is None:
-                raise ValueError("min_max_id must be specified for previous mode")
-            req_url = f"{self.server_url}api/v1/timelines/public?limit={n_statuses}&max_id={min_max_id}"
-        else:
-            raise ValueError("mode must be either None, 'subsequent', or 'previous'")
+        req_url = self._timeline_url(n_statuses = n_statuses, mode = mode, min_max_id = min_max_id)
 
-        if self.token:
-            self.response = requests.get(req_url, headers=self.headers)
-        else:
-            self.response = requests.get(req_url)
+        self.response = self._send_request(req_url)
         
         self.last_req_type = "timeline"
     
+    def req_timeline_window(self, start, end, n_statuses : int = 40, 
+                            newest : bool = False) -> None:
+        """
+        This method sends a request to the Mastodon API to fetch statuses from 
+        the public timeline that were posted between two points in time, without
+        paging from existing statuses. The 'min_id' and 'max_id' cursors are built
+        from the times, since status ids encode the creation time.
+        - The arguments 'start' and 'end' are datetimes; naive ones are taken to
+        be in UTC. Statuses posted from 'start' until before 'end' are fetched.
+        - The argument 'n_statuses' specifies the number of statuses to fetch,
+        and is used as the 'limit' parameter in the request.
+        - The argument 'newest' specifies which statuses are fetched if there are
+        more than 'n_statuses' in the window: the earliest ones by default, or
+        the latest ones if True.
+        """
+
+        req_url = self._timeline_window_url(start, end, n_statuses = n_statuses, newest = newest)
+
+        self.response = self._send_request(req_url)
+        
+        self.last_req_type = "timeline"
+
     def req_account_statuses(self, account_id : str, n_statuses : int = 40, 
                              mode : str = None, min_max_id : str = None) -> None:
         """
@@ -112,23 +496,10 @@ class MastodonStatuses:
         the 'min_id' or 'max_id' parameter in the request.
         """
 
-        if mode is None:
-            req_url = f"{self.server_url}api/v1/accounts/{account_id}/statuses?limit={n_statuses}"
-        elif mode == "subsequent":
-            if min_max_id is None:
-                raise ValueError("min_id must be specified for subsequent mode")
-            req_url = f"{self.server_url}api/v1/accounts/{account_id}/statuses?limit={n_statuses}&min_id={min_max_id}"
-        elif mode == "previous":
-            if min_max_id is None:
-                raise ValueError("max_id must be specified for previous mode")
-            req_url = f"{self.server_url}api/v1/accounts/{account_id}/statuses?limit={n_statuses}&max_id={min_max_id}"
-        else:
-            raise ValueError("mode must be either None, 'subsequent', or 'previous'")
+        req_url = self._account_statuses_url(account_id = account_id, n_statuses = n_statuses, 
+                                             mode = mode, min_max_id = min_max_id)
 
-        if self.token:
-            self.response = requests.get(req_url, headers=self.headers)
-        else:
-            self.response = requests.get(req_url)
+        self.response = self._send_request(req_url)
         
         self.last_req_type = "account_statuses"
     
\ No newline at end of file
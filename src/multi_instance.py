@@ -0,0 +1,123 @@
+"""
+This module defines a class to collect trending statuses and their
+adjacent statuses from several Mastodon instances at once. Each server
+gets its own connection pool and rate limiter, so that a slow or rate
+limited server does not hold up the others, and the number of requests
+sent at the same time across all servers is capped. The data of all
+servers are merged into one dataframe per type, with a 'server' column.
+"""
+
+# Dependencies
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from src.trending_statuses import TrendingStatuses
+from src.adjacent_planner import AdjacentPlanner, ALL_COMBINATIONS
+
+# Class definition
+class MultiInstanceCollector:
+    """
+    This class runs TrendingStatuses and AdjacentPlanner for a list of
+    servers in parallel.
+    - The argument 'servers' is a list of Mastodon instances, as for the
+    'server' argument of MastodonStatuses.
+    - The argument 'tokens' is an optional dictionary of authorisation
+    tokens, keyed by server. Servers without a token are requested without.
+    - The argument 'combinations' is a list of (mode, focus_accounts) tuples
+    of adjacent statuses to collect, as for AdjacentPlanner. With an empty
+    list, only trending statuses are collected.
+    - The argument 'fields' is an optional list of the fields of the statuses
+    to keep, as in MastodonStatuses. By default, all fields are kept.
+    - The argument 'max_workers' specifies the maximum number of requests
+    sent at the same time across all servers. Up to 'max_workers' servers
+    are collected at the same time, and the workers are split between them.
+    The default is 20.
+    The method run() collects the data. The attributes 'trending' and
+    'adjacent' are dictionaries keyed by server, with the TrendingStatuses
+    object and the AdjacentStatuses objects keyed by (mode, focus_accounts)
+    of each server, and 'errors' holds the exception of any server that
+    failed, so that the other servers are not affected. The method
+    generate_df() merges the data of all servers.
+    """
+    def __init__(self, servers: list, tokens: dict = None,
+                 combinations: list = ALL_COMBINATIONS, max_workers: int = 20, 
+                 fields: list = None) -> None:
+        if len(servers) == 0:
+            raise ValueError("At least one server must be given")
+        # keep the order, without duplicates
+        self.servers = list(dict.fromkeys(servers))
+        self.tokens = tokens if tokens is not None else {}
+        self.combinations = [tuple(combination) for combination in combinations]
+        self.max_workers = max_workers
+        self.fields = fields
+        self.trending = {}
+        self.adjacent = {}
+        self.errors = {}
+
+    def run(self, max_batches: int = 25, n_per_batch: int = 40,
+            status_limit: int = 2, coalesce: bool = True, verbose: bool = True) -> None:
+        """
+        This method collects the trending statuses of each server, and then
+        their adjacent statuses, with all servers in parallel.
+        - The arguments 'max_batches' and 'n_per_batch' are as in
+        TrendingStatuses.get_data().
+        - The arguments 'status_limit' and 'coalesce' are as in
+        AdjacentPlanner.run().
+        """
+        n_parallel = min(len(self.servers), self.max_workers)
+        # the workers of each server, so that there are at most max_workers in total
+        workers_per_server = max(1, self.max_workers // n_parallel)
+        lock = threading.Lock()
+
+        def collect(server):
+            try:
+                trending_statuses = TrendingStatuses(server = server, token = self.tokens.get(server),
+                                                     pool_size = workers_per_server, fields = self.fields)
+                trending_statuses.get_data(verbose = verbose, max_batches = max_batches,
+                                           n_per_batch = n_per_batch, prefetch = workers_per_server)
+                with lock:
+                    self.trending[server] = trending_statuses
+                if len(trending_statuses.data) == 0:
+                    raise RuntimeError("no trending statuses were fetched")
+                if len(self.combinations) == 0:
+                    return
+                planner = AdjacentPlanner(reference = trending_statuses, combinations = self.combinations)
+                planner.run(status_limit = status_limit, max_workers = workers_per_server,
+                            coalesce = coalesce, verbose = verbose)
+                with lock:
+                    self.adjacent[server] = planner.results
+                if verbose:
+                    print(f"Server {server} done.")
+            except Exception as error:
+                print(f"Collection failed for server {server}: {error}")
+                with lock:
+                    self.errors[server] = error
+
+        with ThreadPoolExecutor(max_workers = n_parallel) as executor:
+            list(executor.map(collect, self.servers))
+
+    def generate_df(self, combination: tuple = None) -> pd.DataFrame:
+        """
+        This method returns the data of all servers as one pandas dataframe,
+        with a 'server' column: the trending statuses if 'combination' is
+        None, or the adjacent statuses of the given (mode, focus_accounts).
+        Servers without data are left out.
+        """
+        dfs = []
+        for server in self.servers:
+            if combination is None:
+                if (server not in self.trending) or (len(self.trending[server].data) == 0):
+                    continue
+                df = self.trending[server].generate_df()
+            else:
+                if server not in self.adjacent:
+                    continue
+                adjacent_statuses = self.adjacent[server][tuple(combination)]
+                if len(adjacent_statuses.data) == 0:
+                    continue
+                df = adjacent_statuses.generate_df()
+            df.insert(0, "server", server)
+            dfs.append(df)
+        if len(dfs) == 0:
+            return pd.DataFrame()
+        return pd.concat(dfs, ignore_index = True)
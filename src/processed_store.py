@@ -0,0 +1,87 @@
+"""
+This module defines the storage of processed data: the dataframes of
+statuses exported by generate_df(), saved as Arrow IPC (Feather) files
+for the data cleaning, instead of csv files. The list columns (tags,
+mentions, media attachments, emojis) are stored as lists of structs, and
+the time columns as timestamps, so that nothing needs to be parsed again
+when the files are read. The files are uncompressed by default, so that
+they can be memory-mapped and read without copying.
+"""
+
+# Dependencies
+import os
+import pyarrow as pa
+import pyarrow.feather as feather
+import pandas as pd
+from src.status_table import table_schema, arrow_to_pandas
+
+# time columns and the format of their strings in the responses of the API
+TIMESTAMP_FORMATS = {
+    "created_at": "%Y-%m-%dT%H:%M:%S.%fZ",
+    "edited_at": "%Y-%m-%dT%H:%M:%S.%fZ",
+    "account_created_at": "%Y-%m-%dT%H:%M:%S.%fZ",
+    "account_last_status_at": "%Y-%m-%d",
+    "card_published_at": "%Y-%m-%dT%H:%M:%S.%fZ",
+    "poll_expires_at": "%Y-%m-%dT%H:%M:%S.%fZ"
+}
+
+# id columns read as integers, as pandas.read_csv() read them from the csv
+# files of older runs, so that cleaned data of both can be deduplicated by id
+ID_COLUMNS = ["id", "account_id"]
+
+# timestamps are in UTC without a time zone, as the datetimes of
+# data_cleaning.convert_to_datetime()
+TIMESTAMP_TYPE = pa.timestamp("us")
+
+def processed_table(df: pd.DataFrame) -> pa.Table:
+    """
+    Returns a dataframe of statuses as an Arrow table, with the columns of
+    the status table typed as in table_schema(), except for the time
+    columns, which are parsed into timestamps (null if they cannot be
+    parsed). Other columns, e.g. 'server', keep the inferred types. The
+    index is not kept.
+    """
+    status_types = {field.name: field.type for field in table_schema()}
+    df = df.copy()
+    fields = []
+    for column in df.columns:
+        if column in TIMESTAMP_FORMATS:
+            if not pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = pd.to_datetime(df[column], format = TIMESTAMP_FORMATS[column], errors = "coerce")
+            fields.append(pa.field(column, TIMESTAMP_TYPE))
+        elif column in status_types:
+            fields.append(pa.field(column, status_types[column]))
+        else:
+            fields.append(pa.Schema.from_pandas(df[[column]], preserve_index = False).field(column))
+    return pa.Table.from_pandas(df, schema = pa.schema(fields), preserve_index = False)
+
+def write_processed(df: pd.DataFrame, path: str, compression: str = "uncompressed") -> None:
+    """
+    Writes a dataframe of statuses to the Feather file 'path', typed as by
+    processed_table(). The argument 'compression' can be 'lz4' or 'zstd'
+    for smaller files, which then cannot be read without copying. The file
+    is written under a temporary name and renamed.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    feather.write_feather(processed_table(df), path + ".tmp", compression = compression)
+    os.replace(path + ".tmp", path)
+
+def read_processed(path: str, columns: list = None, memory_map: bool = True) -> pd.DataFrame:
+    """
+    Reads a Feather file written by write_processed() as a pandas dataframe,
+    with the list columns as python lists of dictionaries.
+    - The argument 'columns' is an optional list of the columns to read.
+    - The argument 'memory_map' specifies if the file is memory-mapped, so
+    that uncompressed columns are not copied into memory by Arrow.
+    The default is True.
+    The columns of ID_COLUMNS are read as int64 if all their ids are
+    numeric, as they are on Mastodon servers, and as strings otherwise.
+    """
+    table = feather.read_table(path, columns = columns, memory_map = memory_map)
+    df = arrow_to_pandas(table)
+    for column in ID_COLUMNS:
+        if column in df.columns and df[column].notna().all() and df[column].str.fullmatch("[0-9]+").all():
+            df[column] = df[column].astype("int64")
+    return df
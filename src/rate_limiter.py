@@ -0,0 +1,240 @@
+"""
+This module defines a rate limiter that paces the requests sent to a
+Mastodon server, based on the x-ratelimit-* headers of the responses.
+Instead of sending requests as fast as possible until the rate limit is
+nearly used up, and then waiting for the reset, the remaining requests
+are spread evenly over the time left until the reset.
+There is one rate limiter per server in a process, shared by all
+instances of MastodonStatuses and its children classes, which can be
+obtained with get_rate_limiter().
+"""
+
+# Dependencies
+import asyncio
+import threading
+from time import monotonic, sleep
+from datetime import datetime, timezone
+
+# Class definition
+class RateLimiter:
+    """
+    This class is a token bucket whose refill rate is set by the rate limit
+    headers of the responses: the requests remaining in the current window,
+    minus a reserve, are spread over the time until the reset.
+    - The argument 'reserve' specifies how many of the remaining requests are
+    kept unused; when only these are left, requests wait for the reset.
+    The default is 10.
+    - The argument 'burst' specifies how many requests can be sent at once
+    before the pacing applies. The default is 5.
+    - The argument 'stale_wait_seconds' specifies how long to wait if the
+    limit is used up but the reset time is already in the past, which
+    happens when the headers are not updated. The default is 300.
+    - The argument 'buffer_seconds' specifies additional waiting time after
+    the reset, to allow the rate limit to be updated. The default is 10.
+    Before each request, acquire() (or aacquire() in asynchronous code) waits
+    as long as needed. After each response, update() reads the headers.
+    The method state() returns the current state, to plan further requests.
+    The class is thread-safe.
+    """
+    def __init__(self, reserve: int = 10, burst: int = 5,
+                 stale_wait_seconds: float = 300, buffer_seconds: float = 10) -> None:
+        self.reserve = reserve
+        self.burst = burst
+        self.stale_wait_seconds = stale_wait_seconds
+        self.buffer_seconds = buffer_seconds
+        self.verbose = True
+        # state as provided by the response headers; remaining is also
+        # decremented for each request that is sent, until the next response
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        # token bucket
+        self.tokens = float(burst)
+        self.last_refill = monotonic()
+        self.blocked_until = 0.0
+        # a single request is sent to check a reset time that has passed
+        self.probe_reset = None
+        self.probe_answered = False
+        # statistics
+        self.n_requests = 0
+        self.waited_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def update(self, headers) -> None:
+        """
+        This method updates the state from the rate limit headers of a
+        response. Responses without these headers are ignored.
+        """
+        if headers is None or "x-ratelimit-remaining" not in headers:
+            return
+        remaining = int(headers["x-ratelimit-remaining"])
+        limit = int(headers["x-ratelimit-limit"]) if "x-ratelimit-limit" in headers else None
+        reset = None
+        if "x-ratelimit-reset" in headers:
+            reset = datetime.strptime(
+                headers["x-ratelimit-reset"], "%Y-%m-%dT%H:%M:%S.%fZ"
+            ).replace(tzinfo = timezone.utc)
+
+        with self.lock:
+            # concurrent responses can arrive out of order: ignore older windows,
+            # and keep the lowest count within the same window
+            if (self.reset is not None) and (reset is not None) and (reset < self.reset):
+                return
+            if (reset == self.reset) and (self.remaining is not None):
+                self.remaining = min(self.remaining, remaining)
+            else:
+                self.remaining = remaining
+            self.reset = reset
+            if limit is not None:
+                self.limit = limit
+            if self.probe_reset is not None:
+                self.probe_answered = True
+
+    def _reserve(self) -> tuple:
+        # Takes a token for one request and returns the seconds to wait
+        # before sending it, and if the token should be taken again after
+        # the wait. Must be called with the lock held.
+        now = monotonic()
+
+        # waiting for the reset of the rate limit
+        if now < self.blocked_until:
+            return self.blocked_until - now, False
+
+        # nothing known yet: no pacing
+        if self.remaining is None or self.reset is None:
+            return 0.0, False
+
+        time_until = (self.reset - datetime.now(timezone.utc)).total_seconds()
+        budget = self.remaining - self.reserve
+
+        # limit used up: wait for the reset
+        if budget <= 0:
+            if time_until <= 0:
+                # the reset time has passed: one request is sent to get the
+                # current headers, and the others wait for its response
+                if self.probe_reset != self.reset:
+                    self.probe_reset = self.reset
+                    self.probe_answered = False
+                    return 0.0, False
+                if not self.probe_answered:
+                    return 0.5, True
+                # sometimes the info is not updated and the reset time is in the past
+                wait = self.stale_wait_seconds + self.buffer_seconds
+                if self.verbose:
+                    print(f"Remaining rate limit is critically low: {self.remaining}.",
+                          "The provided reset time has already passed.",
+                          f"\n Waiting {wait} seconds...")
+            else:
+                wait = round(time_until) + self.buffer_seconds
+                if self.verbose:
+                    print(f"Remaining rate limit is critically low: {self.remaining}.",
+                          "The provided reset time (UTC):", self.reset.strftime("%H:%M:%S"),
+                          f"\n Waiting {wait} seconds...")
+            self.blocked_until = now + wait
+            # after the wait, the state is unknown until the next response
+            self.remaining = None
+            self.reset = None
+            self.tokens = float(self.burst) - 1
+            self.last_refill = self.blocked_until
+            self.probe_reset = None
+            return wait, False
+
+        self.remaining -= 1
+
+        # the window is over, but no new headers yet
+        if time_until <= 0:
+            return 0.0, False
+
+        # refill the bucket at the rate that spreads the budget until the reset
+        rate = budget / time_until
+        self.tokens = min(float(self.burst), self.tokens + (now - self.last_refill) * rate)
+        self.last_refill = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0, False
+        return -self.tokens / rate, False
+
+    def acquire(self) -> float:
+        """
+        This method waits until a request can be sent, and returns the
+        number of seconds waited.
+        """
+        waited = 0.0
+        again = True
+        while again:
+            with self.lock:
+                wait, again = self._reserve()
+                self.waited_seconds += wait
+            if wait > 0:
+                sleep(wait)
+            waited += wait
+        with self.lock:
+            self.n_requests += 1
+        return waited
+
+    async def aacquire(self) -> float:
+        """
+        This method is the asynchronous counterpart of acquire().
+        """
+        waited = 0.0
+        again = True
+        while again:
+            with self.lock:
+                wait, again = self._reserve()
+                self.waited_seconds += wait
+            if wait > 0:
+                await asyncio.sleep(wait)
+            waited += wait
+        with self.lock:
+            self.n_requests += 1
+        return waited
+
+    def available(self):
+        """
+        This method returns how many requests can still be sent in the
+        current window before the reserve is reached, or None if this is
+        not known yet.
+        """
+        with self.lock:
+            if self.remaining is None:
+                return None
+            return max(self.remaining - self.reserve, 0)
+
+    def state(self) -> dict:
+        """
+        This method returns the current state of the rate limiter as a
+        dictionary: the limit, remaining requests and reset time from the
+        headers, the seconds until the reset, the current request rate
+        per second, and the number of requests and seconds waited so far.
+        """
+        with self.lock:
+            seconds_until_reset = None
+            rate = None
+            if self.reset is not None:
+                seconds_until_reset = (self.reset - datetime.now(timezone.utc)).total_seconds()
+                if (self.remaining is not None) and (seconds_until_reset > 0):
+                    rate = max(self.remaining - self.reserve, 0) / seconds_until_reset
+            return {
+                "limit": self.limit,
+                "remaining": self.remaining,
+                "reset": self.reset,
+                "seconds_until_reset": seconds_until_reset,
+                "reserve": self.reserve,
+                "rate_per_second": rate,
+                "n_requests": self.n_requests,
+                "waited_seconds": self.waited_seconds
+            }
+
+# one rate limiter per server, shared within the process
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(server: str) -> RateLimiter:
+    """
+    Returns the rate limiter of the given server, creating it if it does
+    not exist yet.
+    """
+    with _rate_limiters_lock:
+        if server not in _rate_limiters:
+            _rate_limiters[server] = RateLimiter()
+        return _rate_limiters[server]
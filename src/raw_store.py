@@ -0,0 +1,184 @@
+"""
+This module defines the storage of raw data: the statuses returned by
+the requests of TrendingStatuses and AdjacentStatuses objects, with the
+metadata of the requests (server, batch number, or reference status,
+mode and account focus), in zstd-compressed Parquet files. The statuses
+are stored in the columns of the status table (see status_table.py),
+and, if the full statuses were kept, also as json, so that no field is
+lost. The files can be read back with only the columns needed, and the
+objects rebuilt from them, without unpickling.
+"""
+
+# Dependencies
+import os
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.trending_statuses import TrendingStatuses
+from src.adjacent_statuses import AdjacentStatuses
+from src.status_records import StatusRecord, StatusSchema
+from src.status_table import table_schema, table_fields, column_array, SCHEMA_VERSION
+
+# version of the layout of the raw files
+RAW_VERSION = 1
+
+# columns with the metadata of the requests, before the status columns
+METADATA_FIELDS = [
+    pa.field("server", pa.string()),
+    pa.field("request_type", pa.string()),
+    pa.field("batch", pa.int32()),
+    pa.field("reference_id", pa.string()),
+    pa.field("mode", pa.string()),
+    pa.field("focus_accounts", pa.string()),
+    pa.field("position", pa.int32())
+]
+
+def raw_schema(with_json: bool = False) -> pa.Schema:
+    """
+    Returns the Arrow schema of the raw files: the metadata columns, the
+    columns of the status table, and a 'json' column with the full status
+    if 'with_json' is True.
+    """
+    fields = METADATA_FIELDS + list(table_schema())
+    if with_json:
+        fields.append(pa.field("json", pa.string()))
+    return pa.schema(fields).with_metadata({
+        "raw_version": str(RAW_VERSION),
+        "schema_version": str(SCHEMA_VERSION)
+    })
+
+def _requests(source, metadata: dict):
+    # The statuses of each request of a TrendingStatuses or AdjacentStatuses
+    # object, with the metadata of the request
+    if isinstance(source, AdjacentStatuses):
+        for s_id, statuses in source.data.items():
+            yield dict(metadata, request_type = "adjacent", reference_id = s_id), statuses
+    elif isinstance(source, TrendingStatuses):
+        for batch_no, statuses in source.data.items():
+            yield dict(metadata, request_type = "trending", batch = int(batch_no)), statuses
+    else:
+        raise TypeError("Only TrendingStatuses and AdjacentStatuses objects can be written")
+
+def write_raw(path: str, sources: list) -> None:
+    """
+    Writes the data of TrendingStatuses and AdjacentStatuses objects to the
+    Parquet file 'path', with zstd compression.
+    - The argument 'sources' is a list of (object, metadata) tuples, where
+    metadata is a dictionary with the 'mode' and 'focus_accounts' of the
+    adjacent statuses, if any. The server is taken from the object.
+    Requests that returned no statuses are kept as a row without status,
+    with 'position' null. The directory is created if it does not exist,
+    and the file is written under a temporary name and renamed.
+    """
+    # the full statuses are stored as json if they are not projected to records
+    with_json = any(
+        not isinstance(status, StatusRecord)
+        for source, _ in sources for statuses in source.data.values() for status in statuses
+    )
+    schema = raw_schema(with_json = with_json)
+    n_status_columns = len(table_schema())
+    status_schema = StatusSchema(table_fields())
+    rows = []
+    for source, metadata in sources:
+        base = {"server": source.server}
+        base.update(metadata or {})
+        for request, statuses in _requests(source, base):
+            meta = tuple([request.get(field.name) for field in METADATA_FIELDS[:-1]])
+            if len(statuses) == 0:
+                rows.append(meta + (None,) + (None,) * n_status_columns + ((None,) if with_json else ()))
+            for position, status in enumerate(statuses):
+                if isinstance(status, StatusRecord) and (status.schema.fields == status_schema.fields):
+                    values = status.values
+                else:
+                    values = status_schema.project(status.to_dict() if isinstance(status, StatusRecord) else status).values
+                extra = ()
+                if with_json:
+                    extra = (json.dumps(status.to_dict() if isinstance(status, StatusRecord) else status),)
+                rows.append(meta + (position,) + values + extra)
+    columns = list(zip(*rows)) if len(rows) > 0 else [[] for _ in schema]
+    table = pa.Table.from_arrays(
+        [column_array(list(values), field.type) for values, field in zip(columns, schema)],
+        schema = schema
+    )
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    pq.write_table(table, path + ".tmp", compression = "zstd")
+    os.replace(path + ".tmp", path)
+
+def read_raw(path: str, columns: list = None, filters = None, memory_map: bool = True) -> pa.Table:
+    """
+    Reads a raw file written by write_raw() as an Arrow table.
+    - The argument 'columns' is an optional list of the columns to read;
+    the other columns are not read from the file.
+    - The argument 'filters' optionally selects rows, as for
+    pyarrow.parquet.read_table(), e.g. [("mode", "=", "previous")].
+    - The argument 'memory_map' specifies if the file is memory-mapped
+    instead of read into memory. The default is True.
+    """
+    return pq.read_table(path, columns = columns, filters = filters, memory_map = memory_map)
+
+def _statuses(table: pa.Table) -> list:
+    # The statuses of the rows of a raw table, as dictionaries from the
+    # json column if there is one, or as StatusRecords otherwise
+    if "json" in table.column_names:
+        return [json.loads(value) if value is not None else None for value in table.column("json").to_pylist()]
+    status_schema = StatusSchema(table_fields())
+    names = [field.name for field in table_schema()]
+    columns = [table.column(name).to_pylist() for name in names]
+    return [StatusRecord(status_schema, values) for values in zip(*columns)]
+
+def read_trending(path: str, server: str = None, token: str = None,
+                  session = None) -> TrendingStatuses:
+    """
+    Rebuilds a TrendingStatuses object from a raw file, with the trending
+    statuses of 'server', or of the only server in the file. The arguments
+    'token' and 'session' are as for TrendingStatuses.
+    """
+    filters = [("request_type", "=", "trending")]
+    if server is not None:
+        filters.append(("server", "=", server))
+    table = read_raw(path, filters = filters)
+    servers = set(table.column("server").to_pylist())
+    if len(servers) > 1:
+        raise ValueError(f"The file has trending statuses of several servers: {sorted(servers)}")
+    if server is None:
+        server = servers.pop() if len(servers) > 0 else None
+    fields = None if "json" in table.column_names else table_fields()
+    trending_statuses = TrendingStatuses(server = server, token = token, session = session, fields = fields)
+    batches = table.column("batch").to_pylist()
+    positions = table.column("position").to_pylist()
+    for batch_no, position, status in zip(batches, positions, _statuses(table)):
+        trending_statuses.data.setdefault(batch_no, [])
+        if position is not None:
+            trending_statuses.data[batch_no].append(status)
+    return trending_statuses
+
+def read_adjacent(path: str, reference: TrendingStatuses, mode: str = None,
+                  focus_accounts: str = None, token: str = None,
+                  session = None) -> AdjacentStatuses:
+    """
+    Rebuilds an AdjacentStatuses object from a raw file, with the adjacent
+    statuses of the server of 'reference' for the given mode and account
+    focus, which can be left out if the file has only one of each. The
+    reference statuses without data in the file are left as remaining.
+    The arguments 'token' and 'session' are as for AdjacentStatuses.
+    """
+    filters = [("request_type", "=", "adjacent"), ("server", "=", reference.server)]
+    if mode is not None:
+        filters.append(("mode", "=", mode))
+    if focus_accounts is not None:
+        filters.append(("focus_accounts", "=", focus_accounts))
+    table = read_raw(path, filters = filters)
+    combinations = set(zip(table.column("mode").to_pylist(), table.column("focus_accounts").to_pylist()))
+    if len(combinations) > 1:
+        raise ValueError(f"The file has adjacent statuses of several modes or account focus: {sorted(combinations)}")
+    adjacent_statuses = AdjacentStatuses(reference = reference, token = token, session = session)
+    reference_ids = table.column("reference_id").to_pylist()
+    positions = table.column("position").to_pylist()
+    for s_id, position, status in zip(reference_ids, positions, _statuses(table)):
+        adjacent_statuses.data.setdefault(s_id, [])
+        if position is not None:
+            adjacent_statuses.data[s_id].append(status)
+    adjacent_statuses._keep_remaining(set(adjacent_statuses.ref_ids_rem) - set(adjacent_statuses.data))
+    return adjacent_statuses
@@ -0,0 +1,225 @@
+"""
+This module defines an on-disk cache of the responses of the Mastodon
+API, keyed by request URL. Fresh responses are served from the cache
+without a request; stale ones are revalidated with a conditional request
+(ETag / Last-Modified), so that an unchanged response costs a short 304
+response instead of the full body. The bodies are stored compressed in a
+local SQLite database, whose size is bounded by evicting the least
+recently used responses.
+"""
+
+# Dependencies
+import os
+import json
+import zlib
+import sqlite3
+import threading
+from time import time
+from urllib.parse import urlparse
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# time to live in seconds of the responses of each endpoint, by default.
+# Endpoints that are not listed are not cached.
+DEFAULT_TTLS = {
+    "trends": 300
+}
+
+# response headers that are kept with the body
+_KEPT_HEADERS = ["content-type", "etag", "last-modified", "link"]
+
+# Class definition
+class ResponseCache:
+    """
+    This class stores responses of GET requests on disk, with their ETag
+    and Last-Modified headers, and decides if they can be reused.
+    - The argument 'path' specifies the database file. It is created if it
+    does not exist, as is its directory. The default is
+    '../data/cache/responses.db'.
+    - The argument 'ttls' is a dictionary of the time to live in seconds
+    of the responses of each endpoint, keyed by the first part of the path
+    after 'api/v1/', e.g. 'trends', 'timelines' or 'accounts'. Within this
+    time, a response is served from the cache; afterwards, it is revalidated.
+    A TTL of 0 revalidates every time. Endpoints that are not listed are
+    not cached. The default caches trending statuses for 5 minutes.
+    - The argument 'max_bytes' specifies the maximum size of the stored
+    (compressed) bodies. The least recently used responses are removed
+    above it. The default is 100 MB.
+    The method lookup() returns a cached response and the headers for a
+    conditional request, and store() and revalidated() update the cache
+    with the response. The class can be used from several threads.
+    """
+    def __init__(self, path: str = "../data/cache/responses.db", ttls: dict = None,
+                 max_bytes: int = 100 * 1024 * 1024) -> None:
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS) if ttls is None else dict(ttls)
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.lock = threading.Lock()
+        # statistics
+        self.n_hits = 0
+        self.n_revalidated = 0
+        self.n_misses = 0
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    headers TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )
+                """
+            )
+
+    def ttl(self, url: str):
+        """
+        This method returns the time to live of the responses of the
+        endpoint of 'url', or None if these are not cached.
+        """
+        parts = urlparse(url).path.strip("/").split("/")
+        if len(parts) < 3 or parts[:2] != ["api", "v1"]:
+            return None
+        return self.ttls.get(parts[2])
+
+    def lookup(self, url: str) -> tuple:
+        """
+        This method returns a tuple of: the cached response of 'url' if it
+        is fresh, or None, and a dictionary of headers for a conditional
+        request if a stale response can be revalidated.
+        """
+        ttl = self.ttl(url)
+        if ttl is None:
+            return None, {}
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT body, headers, stored_at FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                self.n_misses += 1
+                return None, {}
+            body, headers, stored_at = row
+            headers = json.loads(headers)
+            if time() - stored_at < ttl:
+                self.n_hits += 1
+                self._touch(url)
+                return self._make_response(url, body, headers), {}
+        conditional = {}
+        if "etag" in headers:
+            conditional["If-None-Match"] = headers["etag"]
+        if "last-modified" in headers:
+            conditional["If-Modified-Since"] = headers["last-modified"]
+        return None, conditional
+
+    def store(self, url: str, body: bytes, headers) -> None:
+        """
+        This method stores the body and headers of a successful response to
+        'url', if its endpoint is cached, and evicts old responses if the
+        cache is full.
+        """
+        if self.ttl(url) is None:
+            return
+        compressed = zlib.compress(body)
+        kept = {name: headers[name] for name in _KEPT_HEADERS if name in headers}
+        now = time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (url, compressed, json.dumps(kept), now, now, len(compressed))
+            )
+            self._evict()
+
+    def revalidated(self, url: str, headers = None):
+        """
+        This method handles a 304 response to a conditional request for
+        'url': the cached response is fresh again, and is returned, or None
+        if it was evicted in the meantime.
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT body, headers FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            body, kept = row
+            kept = json.loads(kept)
+            for name in _KEPT_HEADERS:
+                if (headers is not None) and (name in headers):
+                    kept[name] = headers[name]
+            now = time()
+            self.connection.execute(
+                "UPDATE responses SET headers = ?, stored_at = ?, accessed_at = ? WHERE url = ?",
+                (json.dumps(kept), now, now, url)
+            )
+            self.n_revalidated += 1
+        return self._make_response(url, body, kept)
+
+    def _touch(self, url: str) -> None:
+        # Marks a response as used now. Must be called with the lock held.
+        with self.connection:
+            self.connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE url = ?", (time(), url)
+            )
+
+    def _evict(self) -> None:
+        # Removes the least recently used responses while the cache is
+        # above its size. Must be called with the lock held.
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.connection.execute("SELECT url, size FROM responses ORDER BY accessed_at").fetchall()
+        evicted = []
+        for url, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((url,))
+            total -= size
+        self.connection.executemany("DELETE FROM responses WHERE url = ?", evicted)
+
+    def _make_response(self, url: str, body: bytes, headers: dict) -> requests.Response:
+        # A requests response with the cached body, as if it had been sent
+        response = requests.Response()
+        response.status_code = 200
+        response._content = zlib.decompress(body)
+        response.headers = CaseInsensitiveDict(headers)
+        response.url = url
+        response.encoding = "utf-8"
+        response.reason = "OK"
+        response.from_cache = True
+        return response
+
+    def stats(self) -> dict:
+        """
+        This method returns the number of responses served from the cache,
+        revalidated with a conditional request, and not found, and the
+        number and size of the stored responses, as a dictionary.
+        """
+        with self.lock:
+            n_stored, size = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            return {
+                "hits": self.n_hits,
+                "revalidated": self.n_revalidated,
+                "misses": self.n_misses,
+                "stored": n_stored,
+                "bytes": size
+            }
+
+    def clear(self) -> None:
+        """
+        This method removes all stored responses.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        """
+        This method closes the database connection.
+        """
+        self.connection.close()
@@ -0,0 +1,210 @@
+"""
+This module defines the retry policy of the requests sent to a Mastodon
+server. Requests that fail with a transient error, i.e. a timeout, a
+connection error, or a response with status 429 or 5xx, are retried with
+exponential backoff and jitter, honouring the Retry-After header if the
+server sends it. A circuit breaker pauses all requests to a server for a
+while when it fails repeatedly, instead of sending more requests to a
+degraded server.
+There is one retry policy per server in a process, shared by all
+instances of MastodonStatuses and its children classes, which can be
+obtained with get_retry_policy().
+"""
+
+# Dependencies
+import random
+import asyncio
+import threading
+from time import monotonic, sleep
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Class definition
+class RetryPolicy:
+    """
+    This class decides if and when a failed request is retried, keeps
+    the state of the circuit breaker, and counts the failed and retried
+    requests.
+    - The argument 'max_retries' specifies how many times a request is
+    retried after a transient error. The default is 3.
+    - The arguments 'backoff_seconds' and 'max_backoff_seconds' specify
+    the waiting time before the first retry, which doubles for each of the
+    next ones, and its maximum. A random part of up to half of the time is
+    removed, so that concurrent requests are not retried all at once. The
+    defaults are 1 and 60.
+    - The argument 'retry_statuses' specifies the status codes that are
+    retried. The default is 429 and the 5xx codes of an overloaded server.
+    - The argument 'failure_threshold' specifies after how many consecutive
+    server errors or timeouts the circuit breaker opens, and all requests
+    to the server wait for 'cooldown_seconds'. A single request is then
+    sent to check if the server has recovered. The defaults are 5 and 30.
+    Before each request, wait_circuit() (or await_circuit() in asynchronous
+    code) waits while the circuit is open. After each attempt, record() 
+    updates the circuit breaker, and backoff() gives the waiting time 
+    before a retry.
+    The method stats() returns the counts of retries and failed requests.
+    The class is thread-safe.
+    """
+    def __init__(self, max_retries: int = 3, backoff_seconds: float = 1,
+                 max_backoff_seconds: float = 60,
+                 retry_statuses: tuple = (429, 500, 502, 503, 504),
+                 failure_threshold: int = 5, cooldown_seconds: float = 30) -> None:
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.retry_statuses = tuple(retry_statuses)
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.verbose = True
+        # circuit breaker
+        self.consecutive_failures = 0
+        self.open_until = None
+        self.probing = False
+        # statistics
+        self.n_retried = 0
+        self.n_failed = 0
+        self.n_circuit_opened = 0
+        self.lock = threading.Lock()
+
+    def is_retryable(self, status_code) -> bool:
+        """
+        This method returns True if a request with the given status code,
+        or None if no response was received, should be retried.
+        """
+        return (status_code is None) or (status_code in self.retry_statuses)
+
+    def backoff(self, attempt: int, headers = None) -> float:
+        """
+        This method returns the seconds to wait before retrying a request
+        that failed at the given attempt (0 for the first one). If the
+        response headers include Retry-After, this is used instead.
+        """
+        retry_after = self._retry_after(headers)
+        if retry_after is not None:
+            return retry_after
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)
+        return delay - random.uniform(0, delay / 2)
+
+    def _retry_after(self, headers):
+        # The Retry-After header, in seconds or as a date, converted to seconds
+        if (headers is None) or ("retry-after" not in headers):
+            return None
+        value = headers["retry-after"]
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo = timezone.utc)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+    def record(self, status_code) -> None:
+        """
+        This method updates the circuit breaker with the status code of a
+        response, or None if no response was received. Server errors and
+        missing responses count as failures; rate limited requests do not,
+        since the rate limiter handles them.
+        """
+        with self.lock:
+            if (status_code is not None) and (status_code < 500):
+                self.consecutive_failures = 0
+                self.open_until = None
+                self.probing = False
+                return
+            self.consecutive_failures += 1
+            # the check after the cooldown failed, or too many failures in a row
+            reopen = self.probing and (self.open_until is not None)
+            if reopen or ((self.open_until is None) and (self.consecutive_failures >= self.failure_threshold)):
+                self.open_until = monotonic() + self.cooldown_seconds
+                self.probing = False
+                self.n_circuit_opened += 1
+                if self.verbose:
+                    print(f"The server failed {self.consecutive_failures} times in a row.",
+                          f"\n Pausing requests for {self.cooldown_seconds} seconds...")
+
+    def record_retry(self) -> None:
+        """
+        This method counts a retried request.
+        """
+        with self.lock:
+            self.n_retried += 1
+
+    def record_failed(self) -> None:
+        """
+        This method counts a request that failed after all its attempts.
+        """
+        with self.lock:
+            self.n_failed += 1
+
+    def _circuit_wait(self) -> float:
+        # Returns the seconds to wait before sending a request. Must be
+        # called with the lock held.
+        if self.open_until is None:
+            return 0.0
+        now = monotonic()
+        if now < self.open_until:
+            return self.open_until - now
+        # after the cooldown, a single request checks if the server has
+        # recovered, and the others wait for its response
+        if not self.probing:
+            self.probing = True
+            return 0.0
+        return 0.5
+
+    def wait_circuit(self) -> float:
+        """
+        This method waits while the circuit is open, and returns the number
+        of seconds waited.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                wait = self._circuit_wait()
+            if wait <= 0:
+                return waited
+            sleep(wait)
+            waited += wait
+
+    async def await_circuit(self) -> float:
+        """
+        This method is the asynchronous counterpart of wait_circuit().
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                wait = self._circuit_wait()
+            if wait <= 0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def stats(self) -> dict:
+        """
+        This method returns the number of retried requests, of requests
+        that failed after all their attempts, and of times the circuit
+        breaker opened, as a dictionary.
+        """
+        with self.lock:
+            return {
+                "retried": self.n_retried,
+                "failed": self.n_failed,
+                "circuit_opened": self.n_circuit_opened
+            }
+
+# one retry policy per server, shared within the process
+_retry_policies = {}
+_retry_policies_lock = threading.Lock()
+
+def get_retry_policy(server: str) -> RetryPolicy:
+    """
+    Returns the retry policy of the given server, creating it if it does
+    not exist yet.
+    """
+    with _retry_policies_lock:
+        if server not in _retry_policies:
+            _retry_policies[server] = RetryPolicy()
+        return _retry_policies[server]
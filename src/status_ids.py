@@ -0,0 +1,54 @@
+"""
+This module defines functions to convert between Mastodon status ids and
+datetimes. Mastodon ids are 'snowflake' ids: the number of milliseconds
+since the Unix epoch, shifted left by 16 bits, plus a 16-bit sequence
+number. The creation time of a status can therefore be read from its id
+without parsing 'created_at', and ids can be built for any point in time,
+to be used as 'min_id' and 'max_id' cursors of the timeline requests.
+"""
+
+# Dependencies
+from datetime import datetime, timezone
+
+# number of bits of the sequence number below the timestamp
+SEQUENCE_BITS = 16
+
+def id_to_millis(status_id) -> int:
+    """
+    Returns the milliseconds since the Unix epoch encoded in a status id,
+    given as a string or an integer.
+    """
+    return int(status_id) >> SEQUENCE_BITS
+
+def id_to_datetime(status_id) -> datetime:
+    """
+    Returns the time encoded in a status id, given as a string or an
+    integer, as a timezone-aware datetime in UTC.
+    """
+    return datetime.fromtimestamp(id_to_millis(status_id) / 1000, tz = timezone.utc)
+
+def datetime_to_id(dt: datetime, last: bool = False) -> str:
+    """
+    Returns the status id of the datetime 'dt' as a string: the smallest
+    id of its millisecond, or the largest one if 'last' is True. A naive
+    datetime is taken to be in UTC.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo = timezone.utc)
+    millis = int(dt.timestamp() * 1000)
+    status_id = millis << SEQUENCE_BITS
+    if last:
+        status_id += (1 << SEQUENCE_BITS) - 1
+    return str(status_id)
+
+def window_cursors(start: datetime, end: datetime) -> tuple:
+    """
+    Returns the ('min_id', 'max_id') cursors of the statuses created from
+    'start' (included) until 'end' (excluded), as strings. Both cursors are
+    exclusive in the Mastodon API, so these are just outside the window.
+    """
+    if end <= start:
+        raise ValueError("end must be after start")
+    min_id = str(int(datetime_to_id(start)) - 1)
+    max_id = datetime_to_id(end)
+    return min_id, max_id
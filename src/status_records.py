@@ -0,0 +1,185 @@
+"""
+This module defines a compact representation of the statuses returned
+by the Mastodon API. The responses are decoded with orjson, if it is
+installed, and only a whitelist of fields is kept from each status, in a
+StatusRecord: a tuple of values with the column names shared by all the
+records of a StatusSchema, instead of a dictionary per status, account,
+media attachment, card, etc. This takes much less memory in long runs,
+and the records are flattened into a table without walking the json
+again (see status_table.py).
+"""
+
+# Dependencies
+import json
+
+# orjson is optional, and decodes json several times faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# fields kept by default: all those used by the data cleaning functions,
+# and a few to identify statuses. 'a.b' is the field 'b' of the object
+# 'a', and 'a[].b' the field 'b' of each item of the list 'a'.
+DEFAULT_FIELDS = [
+    "id", "created_at", "edited_at", "in_reply_to_id", "in_reply_to_account_id",
+    "sensitive", "spoiler_text", "visibility", "language", "uri", "url",
+    "replies_count", "reblogs_count", "favourites_count", "content",
+    "account.id", "account.username", "account.acct", "account.bot",
+    "account.created_at", "account.followers_count", "account.following_count",
+    "account.statuses_count", "account.last_status_at",
+    "tags[].name", "mentions[].id", "mentions[].acct",
+    "media_attachments[].id", "media_attachments[].type", "emojis[].shortcode",
+    "card.type", "card.url", "card.published_at",
+    "reblog.id", "reblog.account.id", "poll.expires_at", "application.name"
+]
+
+def loads(content):
+    """
+    Decodes json from bytes or a string, with orjson if it is installed,
+    or with the json module otherwise.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+class StatusSchema:
+    """
+    This class defines which fields of the statuses are kept.
+    - The argument 'fields' is a list of fields, as in DEFAULT_FIELDS,
+    which is used if none are given. Fields of nested objects are kept as
+    columns named as in pandas.json_normalize() with sep = "_", e.g.
+    'account_id'; for lists, the column holds the list with the given
+    fields of each item, e.g. 'tags' holds [{"name": ...}, ...].
+    The method project() turns a status dictionary into a StatusRecord,
+    and project_all() a list of them. All records of a schema share its
+    column names, so that these are stored only once.
+    """
+    def __init__(self, fields: list = None) -> None:
+        self.fields = list(fields) if fields is not None else list(DEFAULT_FIELDS)
+        # columns in order: (column name, path to the value, item fields of a list)
+        self.columns = []
+        list_columns = {}
+        for field in self.fields:
+            if "[]." in field:
+                name, item_field = field.split("[].", 1)
+                if name not in list_columns:
+                    list_columns[name] = []
+                    self.columns.append((name, (name,), list_columns[name]))
+                list_columns[name].append(item_field)
+            else:
+                path = tuple(field.split("."))
+                self.columns.append(("_".join(path), path, None))
+        self.names = tuple([name for name, _, _ in self.columns])
+        self.index = {name: i for i, name in enumerate(self.names)}
+        # nested objects, e.g. 'account', with the path and index of each of their fields
+        self.groups = {}
+        for i, (_, path, _) in enumerate(self.columns):
+            if len(path) > 1:
+                self.groups.setdefault(path[0], []).append((path[1:], i))
+
+    def __getstate__(self) -> dict:
+        # only the fields are pickled, the rest is rebuilt from them
+        return {"fields": self.fields}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["fields"])
+
+    def project(self, status: dict):
+        """
+        This method returns a StatusRecord with the fields of the schema
+        of 'status', and None for those it does not have.
+        """
+        values = []
+        for _, path, item_fields in self.columns:
+            value = status
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if (item_fields is not None) and isinstance(value, list):
+                value = [{field: item.get(field) for field in item_fields} for item in value]
+            values.append(value)
+        return StatusRecord(self, tuple(values))
+
+    def project_all(self, statuses: list) -> list:
+        """
+        This method returns the StatusRecords of a list of statuses.
+        """
+        return [self.project(status) for status in statuses]
+
+class StatusRecord:
+    """
+    This class holds the kept fields of a status as a tuple, in the order
+    of the columns of its schema. Fields can be read as from a status
+    dictionary: record["id"], record["account"]["id"], or with the
+    column name, record["account_id"]. The method to_dict() returns the
+    nested status dictionary with the kept fields.
+    """
+    __slots__ = ("schema", "values")
+
+    def __init__(self, schema: StatusSchema, values: tuple) -> None:
+        self.schema = schema
+        self.values = values
+
+    def __getstate__(self) -> tuple:
+        return (self.schema, self.values)
+
+    def __setstate__(self, state: tuple) -> None:
+        self.schema, self.values = state
+
+    def __getitem__(self, key: str):
+        if key in self.schema.index:
+            return self.values[self.schema.index[key]]
+        if key in self.schema.groups:
+            return self._group(key)
+        raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return (key in self.schema.index) or (key in self.schema.groups)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, StatusRecord):
+            return NotImplemented
+        return (self.schema.names == other.schema.names) and (self.values == other.values)
+
+    def __repr__(self) -> str:
+        return f"StatusRecord(id={self['id'] if 'id' in self.schema.index else None})"
+
+    def get(self, key: str, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _group(self, name: str):
+        # A nested object as a dictionary, or None if it has no values,
+        # like a status without a card
+        group = {}
+        for path, i in self.schema.groups[name]:
+            target = group
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = self.values[i]
+        return _none_if_empty(group)
+
+    def to_dict(self) -> dict:
+        """
+        This method returns the status as a nested dictionary, as in the
+        responses of the API, with the fields of the schema only.
+        """
+        status = {}
+        for (name, path, _), value in zip(self.schema.columns, self.values):
+            if len(path) == 1:
+                status[name] = value
+            elif path[0] not in status:
+                status[path[0]] = self._group(path[0])
+        return status
+
+def _none_if_empty(obj: dict):
+    # Replaces the nested objects without any value by None, and returns
+    # None if 'obj' has no value at all
+    for key, value in obj.items():
+        if isinstance(value, dict):
+            obj[key] = _none_if_empty(value)
+    if all([value is None for value in obj.values()]):
+        return None
+    return obj
@@ -0,0 +1,221 @@
+"""
+This module defines the flattening of statuses into a table with a fixed
+layout. The columns and their types are pinned by a versioned schema,
+instead of depending on the fields found in the data as with
+pandas.json_normalize(), where e.g. the 'card' and 'reblog' columns only
+exist if some status has a card or is a reblog. Statuses are appended in
+Arrow record batches as they come, and duplicates are dropped by id, the
+last one being kept, so that turning them into a dataframe is a cheap
+conversion.
+"""
+
+# Dependencies
+import json
+import pyarrow as pa
+import pandas as pd
+from src.status_records import StatusSchema, StatusRecord
+
+# version of the columns below: any change to them needs a new version
+SCHEMA_VERSION = 1
+
+# fields of the statuses and their types, in the order of the columns;
+# fields are named as in status_records.DEFAULT_FIELDS, and the id is first
+TABLE_FIELDS = [
+    ("id", pa.string()),
+    ("created_at", pa.string()),
+    ("edited_at", pa.string()),
+    ("in_reply_to_id", pa.string()),
+    ("in_reply_to_account_id", pa.string()),
+    ("sensitive", pa.bool_()),
+    ("spoiler_text", pa.string()),
+    ("visibility", pa.string()),
+    ("language", pa.string()),
+    ("uri", pa.string()),
+    ("url", pa.string()),
+    ("replies_count", pa.int64()),
+    ("reblogs_count", pa.int64()),
+    ("favourites_count", pa.int64()),
+    ("content", pa.string()),
+    ("account.id", pa.string()),
+    ("account.username", pa.string()),
+    ("account.acct", pa.string()),
+    ("account.bot", pa.bool_()),
+    ("account.created_at", pa.string()),
+    ("account.followers_count", pa.int64()),
+    ("account.following_count", pa.int64()),
+    ("account.statuses_count", pa.int64()),
+    ("account.last_status_at", pa.string()),
+    ("tags[].name", pa.string()),
+    ("mentions[].id", pa.string()),
+    ("mentions[].acct", pa.string()),
+    ("media_attachments[].id", pa.string()),
+    ("media_attachments[].type", pa.string()),
+    ("emojis[].shortcode", pa.string()),
+    ("card.type", pa.string()),
+    ("card.url", pa.string()),
+    ("card.published_at", pa.string()),
+    ("reblog.id", pa.string()),
+    ("reblog.account.id", pa.string()),
+    ("poll.expires_at", pa.string()),
+    ("application.name", pa.string())
+]
+
+def table_schema() -> pa.Schema:
+    """
+    Returns the Arrow schema of the status table, with the version and
+    the fields in its metadata. Columns are named as by
+    pandas.json_normalize() with sep = "_"; the fields of the items of
+    a list, e.g. 'tags[].name', make one column of lists of structs.
+    """
+    columns = []
+    list_columns = {}
+    for field, field_type in TABLE_FIELDS:
+        if "[]." in field:
+            name, item_field = field.split("[].", 1)
+            if name not in list_columns:
+                list_columns[name] = []
+                columns.append((name, list_columns[name]))
+            list_columns[name].append(pa.field(item_field, field_type))
+        else:
+            columns.append(("_".join(field.split(".")), field_type))
+    schema = pa.schema([
+        pa.field(name, pa.list_(pa.struct(column_type)) if isinstance(column_type, list) else column_type)
+        for name, column_type in columns
+    ])
+    return schema.with_metadata({
+        "schema_version": str(SCHEMA_VERSION),
+        "fields": json.dumps([field for field, _ in TABLE_FIELDS])
+    })
+
+def table_fields() -> list:
+    """
+    Returns the fields of the status table, as in DEFAULT_FIELDS.
+    """
+    return [field for field, _ in TABLE_FIELDS]
+
+def column_array(values: list, column_type: pa.DataType) -> pa.Array:
+    """
+    Returns an Arrow array of the values of a column. Values of another
+    type than expected, e.g. an integer id, are converted, or null if
+    they cannot be.
+    """
+    try:
+        return pa.array(values, type = column_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        def convert(value):
+            if value is None:
+                return None
+            try:
+                if pa.types.is_string(column_type):
+                    return str(value)
+                if pa.types.is_integer(column_type):
+                    return int(value)
+                if pa.types.is_boolean(column_type):
+                    return bool(value)
+            except (TypeError, ValueError):
+                return None
+            return value if isinstance(value, list) else None
+        return pa.array([convert(value) for value in values], type = column_type)
+
+# Class definition
+class StatusTable:
+    """
+    This class flattens statuses into Arrow record batches with the columns
+    of table_schema().
+    - The argument 'batch_size' specifies how many statuses are buffered
+    before they are turned into a record batch. The default is 1000.
+    The method append() adds a list of statuses, as dictionaries or
+    StatusRecords. A status with the same id as one appended before
+    replaces it, and takes its place at the end, as with
+    DataFrame.drop_duplicates(subset = "id", keep = "last"). The method
+    to_arrow() returns the table without the replaced statuses, and
+    to_pandas() returns it as a pandas dataframe, with the list columns
+    as lists of dictionaries.
+    """
+    def __init__(self, batch_size: int = 1000) -> None:
+        self.schema = table_schema()
+        self.fields = table_fields()
+        self.status_schema = StatusSchema(self.fields)
+        self.batch_size = batch_size
+        self.batches = []
+        self.pending = []
+        # row of each id, and rows replaced by a later status with the same id
+        self.rows = {}
+        self.replaced = set()
+        self.n_rows = 0
+
+    def __len__(self) -> int:
+        return self.n_rows - len(self.replaced)
+
+    def _values(self, status) -> tuple:
+        # The values of a status in the order of the columns
+        if isinstance(status, StatusRecord):
+            if status.schema.fields == self.fields:
+                return status.values
+            status = status.to_dict()
+        return self.status_schema.project(status).values
+
+    def append(self, statuses: list) -> None:
+        """
+        This method adds statuses to the table.
+        """
+        for status in statuses:
+            values = self._values(status)
+            s_id = values[0]  # the id is the first column
+            if s_id in self.rows:
+                self.replaced.add(self.rows[s_id])
+            self.rows[s_id] = self.n_rows
+            self.n_rows += 1
+            self.pending.append(values)
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self) -> None:
+        # Turns the buffered statuses into a record batch
+        if len(self.pending) == 0:
+            return
+        columns = list(zip(*self.pending))
+        arrays = [column_array(list(values), field.type) for values, field in zip(columns, self.schema)]
+        self.batches.append(pa.RecordBatch.from_arrays(arrays, schema = self.schema))
+        self.pending = []
+
+    def to_arrow(self) -> pa.Table:
+        """
+        This method returns the statuses as an Arrow table.
+        """
+        self._flush()
+        table = pa.Table.from_batches(self.batches, schema = self.schema)
+        if len(self.replaced) > 0:
+            keep = [row not in self.replaced for row in range(self.n_rows)]
+            table = table.filter(pa.array(keep))
+        return table
+
+    def to_pandas(self) -> pd.DataFrame:
+        """
+        This method returns the statuses as a pandas dataframe. The list
+        columns hold lists of dictionaries, as in the responses of the API,
+        and None for statuses without the list.
+        """
+        return arrow_to_pandas(self.to_arrow())
+
+def arrow_to_pandas(table: pa.Table) -> pd.DataFrame:
+    """
+    Returns an Arrow table of statuses as a pandas dataframe, with the
+    list columns as python lists of dictionaries rather than arrays.
+    """
+    df = table.to_pandas()
+    for field in table.schema:
+        if pa.types.is_list(field.type) and (field.name in df.columns):
+            df[field.name] = pd.Series(table.column(field.name).to_pylist(), index = df.index, dtype = object)
+    return df
+
+def statuses_to_table(batches) -> StatusTable:
+    """
+    Returns a StatusTable with the statuses of an iterable of lists of
+    statuses, e.g. the values of the 'data' attribute of TrendingStatuses
+    or AdjacentStatuses, appended one list after the other.
+    """
+    table = StatusTable()
+    for statuses in batches:
+        table.append(statuses)
+    return table
@@ -0,0 +1,267 @@
+"""
+This module defines a class to capture statuses from the public stream
+of a Mastodon instance, and to look up the adjacent statuses of any
+status in the captured data, instead of requesting them from the public
+timeline afterwards, which costs one request per reference status.
+"""
+
+# Dependencies
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+import requests
+import pandas as pd
+from src.mastodon_statuses import MastodonStatuses
+from src.status_ids import datetime_to_id
+from src.status_records import loads
+from src.status_table import statuses_to_table
+
+# Class definition
+class StreamingStatuses(MastodonStatuses):
+    """
+    This class subscribes to the public stream of a Mastodon instance
+    (server-sent events of '/api/v1/streaming/public') in a background
+    thread, and keeps the statuses it receives in a buffer ordered by id.
+    - The arguments 'server', 'token' and 'session' are as in
+    MastodonStatuses. Most servers require a token for the stream.
+    - The argument 'max_statuses' specifies the size of the buffer. When
+    it is full, the oldest statuses are dropped. The default is 100000.
+    - The argument 'stream_url' specifies the URL of the stream, if it is
+    not on the same host as the API, e.g. 'https://streaming.example.org/
+    api/v1/streaming/public'.
+    - The argument 'read_timeout' specifies after how many seconds without
+    data (the server sends a heartbeat regularly) the connection is
+    considered lost. The default is 90.
+    - The argument 'fields' is an optional list of the fields of the statuses
+    to keep, as in MastodonStatuses. It should be the same as for the
+    AdjacentStatuses objects filled from the buffer.
+    The method start() starts the capture, and stop() ends it. The stream
+    is reconnected after errors, with the backoff of the retry policy; the
+    statuses posted while disconnected are missed, so the buffer is only
+    considered complete from the last connection.
+    The method adjacent() returns the adjacent statuses of a status from
+    the buffer, and fill() adds these to an AdjacentStatuses object, so
+    that only the reference statuses not covered by the buffer are
+    requested, without account focus. The buffered statuses are in the attribute 'data', keyed by
+    id, and generate_df() exports them as a pandas dataframe.
+    """
+    def __init__(self, server: str = None, token: str = None,
+                 session: requests.Session = None, max_statuses: int = 100000,
+                 stream_url: str = None, read_timeout: float = 90, 
+                 fields: list = None) -> None:
+        super().__init__(server = server, token = token, session = session, fields = fields)
+        if stream_url is not None:
+            self.stream_url = stream_url
+        else:
+            self.stream_url = f"{self.server_url}api/v1/streaming/public"
+        self.max_statuses = max_statuses
+        self.read_timeout = read_timeout
+        # buffer: statuses keyed by id, and their ids as integers, in order
+        self.data = {}
+        self.ids = []
+        # statuses with ids from here on are all in the buffer
+        self.covered_from = None
+        self.n_received = 0
+        self.n_deleted = 0
+        self.n_connections = 0
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def __getstate__(self) -> dict:
+        # the capture thread and its synchronisation are not pickled
+        state = super().__getstate__()
+        state["lock"] = None
+        state["stopping"] = None
+        state["thread"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        super().__setstate__(state)
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def start(self) -> None:
+        """
+        This method starts capturing the stream in a background thread.
+        """
+        if (self.thread is not None) and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target = self._capture, daemon = True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """
+        This method ends the capture. The thread ends at the next event or
+        heartbeat of the stream; this waits for it up to 'timeout' seconds.
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def _capture(self) -> None:
+        # Reads the stream until stopped, reconnecting after errors
+        headers = dict(self.headers) if self.token else {}
+        headers["Accept"] = "text/event-stream"
+        connect_timeout = self.timeout[0] if isinstance(self.timeout, tuple) else self.timeout
+        attempt = 0
+        while not self.stopping.is_set():
+            try:
+                with self.session.get(self.stream_url, headers = headers, stream = True,
+                                      timeout = (connect_timeout, self.read_timeout)) as response:
+                    if response.status_code != 200:
+                        print(f"Response code {response.status_code}: could not connect to the stream.")
+                    else:
+                        attempt = 0
+                        with self.lock:
+                            self.n_connections += 1
+                            self.covered_from = int(datetime_to_id(datetime.now(timezone.utc)))
+                        self._read_events(response)
+            except requests.RequestException as error:
+                if not self.stopping.is_set():
+                    print(f"The stream was interrupted: {error}")
+            if self.stopping.is_set():
+                break
+            self.stopping.wait(self.retry_policy.backoff(attempt))
+            attempt += 1
+
+    def _read_events(self, response: requests.Response) -> None:
+        # Parses the server-sent events of the stream
+        # the stream is sent in chunks as events happen: read each chunk as
+        # it arrives, instead of waiting for a fixed size
+        response.encoding = "utf-8"
+        event, data = None, []
+        for line in response.iter_lines(chunk_size = None, decode_unicode = True):
+            if self.stopping.is_set():
+                return
+            if line is None or line.startswith(":"):
+                # heartbeat or comment
+                continue
+            if line == "":
+                if event is not None:
+                    self._handle_event(event, "\n".join(data))
+                event, data = None, []
+            elif line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data.append(line[5:].lstrip())
+
+    def _handle_event(self, event: str, payload: str) -> None:
+        # Adds, replaces or removes a status of the buffer
+        if event in ["update", "status.update"]:
+            status = loads(payload)
+            if self.schema is not None:
+                status = self.schema.project(status)
+            self.add(status)
+        elif event == "delete":
+            self.remove(payload.strip())
+
+    def add(self, status: dict) -> None:
+        """
+        This method adds a status (a dictionary or a StatusRecord) to the
+        buffer, or replaces it if it is already there, and drops the oldest
+        statuses if the buffer is full.
+        """
+        s_id = int(status["id"])
+        with self.lock:
+            if status["id"] not in self.data:
+                if (len(self.ids) == 0) or (s_id > self.ids[-1]):
+                    self.ids.append(s_id)
+                else:
+                    self.ids.insert(bisect_left(self.ids, s_id), s_id)
+            self.data[status["id"]] = status
+            self.n_received += 1
+            if len(self.ids) > self.max_statuses:
+                n_dropped = len(self.ids) - self.max_statuses
+                for dropped in self.ids[:n_dropped]:
+                    del self.data[str(dropped)]
+                del self.ids[:n_dropped]
+                # statuses older than those kept may be missing now
+                self.covered_from = max(self.covered_from or 0, self.ids[0])
+
+    def remove(self, s_id: str) -> None:
+        """
+        This method removes a deleted status from the buffer.
+        """
+        with self.lock:
+            if s_id in self.data:
+                del self.data[s_id]
+                self.ids.pop(bisect_left(self.ids, int(s_id)))
+                self.n_deleted += 1
+
+    def adjacent(self, s_id: str, mode: str, status_limit: int = 2,
+                 account_id: str = None):
+        """
+        This method returns the 'status_limit' statuses that come right
+        after ('subsequent') or before ('previous') the status with id
+        's_id' in the buffer, newest first, as the timeline requests of
+        AdjacentStatuses would return them, or None if the buffer does
+        not cover them. With 'account_id', only statuses of this account
+        are considered. In 'subsequent' mode, fewer statuses are returned
+        if no more have been posted yet.
+        With 'account_id', the statuses may differ from those of the account
+        timeline ('accounts/:id/statuses'), which has the unlisted statuses
+        and reblogs of the account, while the public stream does not.
+        """
+        if mode not in ["subsequent", "previous"]:
+            raise ValueError("mode must be either 'subsequent' or 'previous'")
+        ref = int(s_id)
+        neighbours = []
+        with self.lock:
+            if self.covered_from is None:
+                return None
+            if mode == "subsequent":
+                # the statuses right after the reference must all have been received
+                if ref < self.covered_from - 1:
+                    return None
+                i = bisect_right(self.ids, ref)
+                while (i < len(self.ids)) and (len(neighbours) < status_limit):
+                    status = self.data[str(self.ids[i])]
+                    if (account_id is None) or (status["account"]["id"] == account_id):
+                        neighbours.append(status)
+                    i += 1
+                return neighbours[::-1]
+            i = bisect_left(self.ids, ref) - 1
+            while (i >= 0) and (self.ids[i] >= self.covered_from) and (len(neighbours) < status_limit):
+                status = self.data[str(self.ids[i])]
+                if (account_id is None) or (status["account"]["id"] == account_id):
+                    neighbours.append(status)
+                i -= 1
+        if len(neighbours) < status_limit:
+            # the earlier statuses were posted before the buffer starts
+            return None
+        return neighbours
+
+    def fill(self, adjacent_statuses, mode: str, focus_accounts: str = "no",
+             status_limit: int = 2) -> int:
+        """
+        This method adds the adjacent statuses of the remaining reference
+        statuses of the AdjacentStatuses object 'adjacent_statuses' from
+        the buffer, for the given mode and account focus, and removes them
+        from its remaining statuses, so that get_data() only requests those
+        not covered. It returns the number of reference statuses filled.
+        Only 'focus_accounts' = 'no' is possible: the account timelines
+        requested with 'yes' have unlisted statuses and reblogs, which the
+        public stream does not have, so they cannot be filled from it.
+        """
+        if focus_accounts != "no":
+            raise ValueError("Only focus_accounts = 'no' can be filled from the public stream, "
+                             "which does not have the unlisted statuses and reblogs of account timelines")
+        filled = {}
+        for s_id in adjacent_statuses.ref_ids_rem:
+            neighbours = self.adjacent(s_id, mode, status_limit = status_limit)
+            if neighbours is not None:
+                filled[s_id] = neighbours
+        adjacent_statuses.data.update(filled)
+        adjacent_statuses._keep_remaining(set(adjacent_statuses.ref_ids_rem) - set(filled))
+        return len(filled)
+
+    def generate_df(self) -> pd.DataFrame:
+        """
+        This method exports the buffered statuses as a pandas dataframe,
+        oldest first.
+        """
+        with self.lock:
+            statuses = [self.data[str(s_id)] for s_id in self.ids]
+        return statuses_to_table([statuses]).to_pandas()
@@ -4,9 +4,16 @@ This module defines a class to collect data on trending statuses.
 
 # Dependencies
 import requests
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import pandas as pd
-from src.mastodon_statuses import MastodonStatuses
+from src.mastodon_statuses import MastodonStatuses, DEFAULT_TIMEOUT
+from src.rate_limiter import RateLimiter
+from src.retry_policy import RetryPolicy
+from src.response_cache import ResponseCache
+from src.instrumentation import RequestMetrics
+from src.status_table import statuses_to_table
+from src.status_ids import id_to_datetime
 
 # A class with methods to get data
 class TrendingStatuses(MastodonStatuses):
@@ -17,6 +24,12 @@ class TrendingStatuses(MastodonStatuses):
     If this is not specified, it defaults to 'mastodon.social'.
     - With the argument 'token', one can optionally pass an authorisation
     token. This is normally not required to fetch trending statuses.
+    - The arguments 'session', 'pool_size' and 'timeout' configure the
+    pool of keep-alive connections, 'rate_limiter' the pacing of the
+    requests, 'retry_policy' the retries of failed requests, 'cache' an
+    optional cache of the responses, 'metrics' the instrumentation of
+    the requests, and 'fields' the fields of the statuses to keep, as
+    described in MastodonStatuses.
     The class is initialised with the main attribute 'data', which stores
     the trending status data as provided by mastodon API when the method
     get_data() is called. This is a dictionary where the keys are batch 
@@ -29,14 +42,24 @@ class TrendingStatuses(MastodonStatuses):
     The class also inherits some basic properties and methods from the 
     MastodonStatuses class.
     """
-    def __init__(self, server: str = None, token : str = None) -> None:
-        super().__init__(server = server, token = token)
+    def __init__(self, server: str = None, token : str = None, 
+                 session : requests.Session = None, pool_size : int = 10, 
+                 timeout : tuple = DEFAULT_TIMEOUT, 
+                 rate_limiter : RateLimiter = None, 
+                 retry_policy : RetryPolicy = None, 
+                 cache : ResponseCache = None, 
+                 metrics : RequestMetrics = None, 
+                 fields : list = None) -> None:
+        super().__init__(server = server, token = token, session = session, 
+                         pool_size = pool_size, timeout = timeout, 
+                         rate_limiter = rate_limiter, retry_policy = retry_policy, 
+                         cache = cache, metrics = metrics, fields = fields)
         
         self.data = {}
         self.data_single_lang = None
         
     def get_data(self, verbose: bool = True, max_batches: int = 25, n_per_batch: int = 40,
-                 last_n_hours: float = 48, offset: int = 0) -> None:
+                 last_n_hours: float = 48, offset: int = 0, prefetch: int = 1) -> None:
         """
         This method sends requests to mastodon.social API to fetch trending statuses.
         Since there is a limit on the maximum number of statuses per request, data are
@@ -56,64 +79,107 @@ class TrendingStatuses(MastodonStatuses):
         leading to failure to fetch all statuses.
         - offset (int): the starting value of the offset, which can be used to skip a certain 
         number of statuses. The default value is 0.
+        - prefetch (int): the number of batches that are requested at the same time. Since the
+        offsets are known in advance, several batches can be requested in parallel rounds. 
+        The batches of a round are processed in order, and the remaining ones are discarded
+        once a stopping condition is met, so the data are the same as when batches are 
+        requested one by one, which is the default (1). At most 'pool_size' requests
+        of the instance are sent at the same time, so that each has a connection of
+        the pool: with a higher value, the batches of a round wait for a free one.
+        Requests that fail with a transient error are retried as set by the retry policy
+        of the instance. If a batch still fails, the loop ends, since the next batches 
+        depend on it.
         Returns: the statuses are appended to the data attribute of the class. These may include
         duplicates, especially if the method is called in short time intervals.
         """
-        time_reached = datetime.now()
+        time_reached = datetime.now(timezone.utc)
         statuses_after = time_reached - timedelta(hours = last_n_hours)
         batch_n = len(self.data) + 1 # if the class instance already has data, this is not overwritten
         req_counter = 0 # to control for max batches
+        stop = False # to end the loop from within a round of batches
+
+        # batches of a round are requested in parallel if prefetching, with no more
+        # workers than connections in the pool, which would open and discard extra ones
+        n_workers = min(prefetch, self.pool_size)
+        executor = ThreadPoolExecutor(max_workers = n_workers) if n_workers > 1 else None
+        retry_stats = self.retry_policy.stats()
+
+        def fetch(batch_offset):
+            # the response of a batch, or None if there was none after all retries
+            try:
+                return self._send_request(self._trending_url(n_statuses = n_per_batch, offset = batch_offset))
+            except requests.RequestException as error:
+                print(f"Request failed: {error}")
+                return None
 
         # check if the max number of batches has been reached and
         # if any status earlier than the specified timeframe has been fetched
         # time reached is updated within the loop
-        while (req_counter < max_batches) and (time_reached > statuses_after):
-            # parameter for offset to pass to the URL. The offset is updated in the loop.
+        while (req_counter < max_batches) and (time_reached > statuses_after) and not stop:
+            # offsets of the batches of this round. The offset is updated in the loop.
+            n_round = min(prefetch, max_batches - req_counter)
+            round_offsets = [offset + i * n_per_batch for i in range(n_round)]
 
-            self.req_trending(n_statuses = n_per_batch, offset = offset)
+            if executor is None:
+                responses = [fetch(offset)]
+            else:
+                responses = list(executor.map(fetch, round_offsets))
+            self.last_req_type = "trending"
 
-            if self.response.status_code == 200:
-                batch_data = self.response.json()
-                
-                # check if the requested number of statuses is in the batch
-                if len(batch_data) == n_per_batch:
-                    # append the statuses to the data attribute of the class
-                    self.data[batch_n] = batch_data
-                    if verbose:
-                        print(f"Batch {batch_n} fetched with {len(batch_data)} statuses.")
+            for response in responses:
+                self.response = response
 
-                    # increment values for the next iteration
-                    batch_n += 1
-                    offset += n_per_batch
-                    req_counter += 1
+                if (self.response is not None) and (self.response.status_code == 200):
+                    batch_data = self.parse_json(self.response)
+                    
+                    # check if the requested number of statuses is in the batch
+                    if len(batch_data) == n_per_batch:
+                        # append the statuses to the data attribute of the class
+                        self.data[batch_n] = batch_data
+                        if verbose:
+                            print(f"Batch {batch_n} fetched with {len(batch_data)} statuses.")
 
-                    # find the earliest datetime of statuses and update time_reached
-                    dts = []
-                    for i in range(n_per_batch):
-                        dts.append(datetime.strptime(batch_data[i]["created_at"], "%Y-%m-%dT%H:%M:%S.%fZ"))
-                    time_reached = min(dts)
+                        # increment values for the next iteration
+                        batch_n += 1
+                        offset += n_per_batch
+                        req_counter += 1
+
+                        # find the earliest datetime of statuses and update time_reached;
+                        # the ids encode the creation time, so the smallest id is the earliest
+                        time_reached = id_to_datetime(min([int(status["id"]) for status in batch_data]))
+                    
+                    # if the number of statuses is lower than requested, no more statuses will be provided after this one: end loop
+                    else:
+                        self.data[batch_n] = batch_data
+                        if verbose:
+                            print(f"Batch {batch_n} fetched with {len(batch_data)} statuses.\n", 
+                                  f"Last batch has fewer than requested {n_per_batch} statuses. Ending loop.")
+                        stop = True
+                        break 
                 
-                # if the number of statuses is lower than requested, no more statuses will be provided after this one: end loop
                 else:
-                    self.data[batch_n] = batch_data
-                    if verbose:
-                        print(f"Batch {batch_n} fetched with {len(batch_data)} statuses.\n", 
-                              f"Last batch has fewer than requested {n_per_batch} statuses. Ending loop.")
-                    break 
-            
-            else:
-                print("Response status not 200. Request failed.")
-                break
-            
-            # if explanation needs to be printed, check loop conditions here, and break if necessary
-            if verbose and (req_counter >= max_batches):
-                print(f"Maximum number of batches ({max_batches}) reached. Stopping requests")
-                break
-            if verbose and (time_reached <= statuses_after):
-                print(f"Statuses fetched are older than {last_n_hours} hours. Stopping requests.")
-                break
+                    print("Response status not 200. Request failed.")
+                    stop = True
+                    break
+                
+                # if explanation needs to be printed, check loop conditions here, and break if necessary
+                if verbose and (req_counter >= max_batches):
+                    print(f"Maximum number of batches ({max_batches}) reached. Stopping requests")
+                    stop = True
+                    break
+                if verbose and (time_reached <= statuses_after):
+                    print(f"Statuses fetched are older than {last_n_hours} hours. Stopping requests.")
+                    stop = True
+                    break
+                # without explanation, the remaining batches of the round are discarded here
+                if time_reached <= statuses_after:
+                    break
         
+        if executor is not None:
+            executor.shutdown()
         self.response = None
+        if verbose:
+            self._report_retries(retry_stats)
         self.last_req_type = None
     
     def reduce_single_lang(self, language: str = "en", overwrite: bool = False) -> None:
@@ -140,18 +206,15 @@ class TrendingStatuses(MastodonStatuses):
         """
         This method takes the statuses data collected by
         the get_data method and returns a pandas dataframe. 
-        The json structure is flattened and duplicates are removed.
+        The json structure is flattened into the fixed columns of the
+        status table, and duplicates are removed.
         It can be specified if the single language data is used; 
         if this doesn't exist, the main data will be used.
         """
-        list_of_dicts = []
-
         if single_language and self.data_single_lang:
-            for batch_no in self.data_single_lang:
-                list_of_dicts += self.data_single_lang[batch_no]
+            batches = self.data_single_lang.values()
         else:
-            for batch_no in self.data:
-                list_of_dicts += self.data[batch_no]
+            batches = self.data.values()
         
-        df = pd.json_normalize(list_of_dicts, sep = "_")
-        return df.drop_duplicates(subset = "id", keep = "last")
+        # duplicates are dropped as the batches are appended
+        return statuses_to_table(batches).to_pandas()
@@ -0,0 +1,161 @@
+"""
+This script benchmarks the collection of trending and adjacent statuses
+against the local mock server, so that the collection speed can be
+measured offline and compared between changes. For each case, it reports
+the number of requests, requests per second, the time spent waiting for
+the rate limit, the time spent on the requests and on decoding the
+responses, as recorded by the request metrics, and the end-to-end time.
+With concurrent requests, these times are summed over the requests, so
+they can exceed the end-to-end time.
+The mock server replays synthetic statuses by default, or a recording of
+real data with --recording. A recording can be made from a small
+collection run on a live server with --record (this sends requests to
+the live server).
+Example: python benchmark_collection.py --latency 0.05 --output ../benchmark.json
+"""
+
+# Dependencies
+import json
+import argparse
+from time import perf_counter
+
+# Define path to original modules
+import sys
+sys.path.append("../../")
+
+from src.trending_statuses import TrendingStatuses
+from src.adjacent_statuses import AdjacentStatuses
+from src.adjacent_planner import AdjacentPlanner
+from src.rate_limiter import get_rate_limiter
+from src.instrumentation import get_request_metrics
+from mock_server import (
+    MockMastodon,
+    start_server,
+    save_recording,
+    load_recording,
+    recording_from_collection
+)
+
+# Parameters for the benchmark
+MAX_BATCHES = 5
+N_PER_BATCH = 40
+
+def record(server, path, max_batches = 2):
+    # Collect a small sample from a live server and save it as a recording
+    trending_statuses = TrendingStatuses(server = server)
+    trending_statuses.get_data(max_batches = max_batches)
+    planner = AdjacentPlanner(reference = trending_statuses)
+    planner.run(coalesce = True)
+    statuses, trending = recording_from_collection(
+        trending_statuses.data, [adjacent.data for adjacent in planner.results.values()]
+    )
+    save_recording(statuses, trending, path)
+    print(f"Recorded {len(statuses)} statuses, {len(trending)} trending, to {path}")
+
+def get_trending(url, prefetch = 1):
+    trending_statuses = TrendingStatuses(server = url)
+    trending_statuses.get_data(verbose = False, max_batches = MAX_BATCHES,
+                               n_per_batch = N_PER_BATCH, prefetch = prefetch)
+    return trending_statuses
+
+def run_case(name, mock_kwargs, collect, needs_reference = True):
+    # Run one case against a new mock server, which also has its own rate limiter,
+    # and measure the requests of the collection, after the reference is fetched
+    mock = MockMastodon(**mock_kwargs)
+    server, url = start_server(mock)
+    limiter = get_rate_limiter(url)
+    limiter.verbose = False
+    reference = get_trending(url, prefetch = 5) if needs_reference else None
+
+    n_requests_before = mock.n_requests
+    waited_before = limiter.waited_seconds
+    totals_before = get_request_metrics(url).to_dict()["totals"]
+    start = perf_counter()
+    n_statuses = collect(url, reference)
+    seconds = perf_counter() - start
+    server.shutdown()
+    totals = get_request_metrics(url).to_dict()["totals"]
+
+    n_requests = mock.n_requests - n_requests_before
+    return {
+        "case": name,
+        "requests": n_requests,
+        "statuses": n_statuses,
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(n_requests / seconds, 1) if seconds > 0 else None,
+        "rate_limit_wait_seconds": round(limiter.waited_seconds - waited_before, 3),
+        "request_seconds": round(totals["latency_seconds"] - totals_before["latency_seconds"], 3),
+        "parse_seconds": round(totals["parse_seconds"] - totals_before["parse_seconds"], 3)
+    }
+
+def collect_trending(prefetch):
+    def collect(url, reference):
+        trending_statuses = get_trending(url, prefetch = prefetch)
+        return sum([len(batch) for batch in trending_statuses.data.values()])
+    return collect
+
+def collect_adjacent(**kwargs):
+    def collect(url, reference):
+        adjacent_statuses = AdjacentStatuses(reference = reference)
+        adjacent_statuses.get_data(mode = "previous", focus_accounts = "no", buffer_seconds = 1, **kwargs)
+        return len(adjacent_statuses.data)
+    return collect
+
+def collect_planner(url, reference):
+    planner = AdjacentPlanner(reference = reference)
+    planner.run(coalesce = True, buffer_seconds = 1, verbose = False)
+    return sum([len(adjacent.data) for adjacent in planner.results.values()])
+
+# Run the benchmark
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Benchmark the collection against a local mock server.")
+    parser.add_argument("--latency", type = float, default = 0.02,
+                        help = "average seconds taken by the mock server to answer a request")
+    parser.add_argument("--rate-limit", type = int, default = 300)
+    parser.add_argument("--window-seconds", type = float, default = 10)
+    parser.add_argument("--recording", default = None, help = "replay this recording")
+    parser.add_argument("--record", default = None,
+                        help = "record a sample from the live server to this file, and exit")
+    parser.add_argument("--server", default = "mastodon.social", help = "live server to record from")
+    parser.add_argument("--output", default = None, help = "save the results as json to this file")
+    args = parser.parse_args()
+
+    if args.record is not None:
+        record(args.server, args.record)
+        sys.exit()
+
+    mock_kwargs = {
+        "rate_limit": args.rate_limit,
+        "window_seconds": args.window_seconds,
+        "latency_seconds": args.latency
+    }
+    if args.recording is not None:
+        mock_kwargs["statuses"], mock_kwargs["trending"] = load_recording(args.recording)
+
+    cases = [
+        ("trending", collect_trending(prefetch = 1), False),
+        ("trending, prefetch 5", collect_trending(prefetch = 5), False),
+        ("adjacent, sync", collect_adjacent(), True),
+        ("adjacent, async", collect_adjacent(engine = "async", max_concurrency = 10), True),
+        ("adjacent, coalesced", collect_adjacent(coalesce = True), True),
+        ("planner, all combinations, coalesced", collect_planner, True)
+    ]
+    results = []
+    for name, collect, needs_reference in cases:
+        results.append(run_case(name, mock_kwargs, collect, needs_reference))
+
+    header = (f"{'case':<40}{'requests':>10}{'statuses':>10}{'seconds':>10}{'req/s':>10}"
+              f"{'rate wait s':>13}{'request s':>11}{'parse s':>9}")
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(f"{result['case']:<40}{result['requests']:>10}{result['statuses']:>10}",
+              f"{result['seconds']:>10}{str(result['requests_per_second']):>10}{result['rate_limit_wait_seconds']:>13}",
+              f"{result['request_seconds']:>11}{result['parse_seconds']:>9}",
+              sep = "")
+
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent = 2)
+        print(f"Results saved to {args.output}")
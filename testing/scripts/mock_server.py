@@ -0,0 +1,390 @@
+"""
+This script runs a local stand-in for the parts of the Mastodon API
+that are used by the modules in 'src': trending statuses, the public
+timeline, the statuses of an account, and the public stream. The statuses are synthetic,
+with Mastodon-style ids, and the responses carry x-ratelimit-* headers
+and an ETag for conditional requests,
+so that the collection classes can be tested without the live server.
+The statuses can also be replayed from a recording of real data (see
+save_recording() and recording_from_collection()), and the responses can
+be delayed to simulate latency.
+The server can be run on its own, e.g. 'python mock_server.py --port 8000',
+or started in a background thread with start_server().
+"""
+
+# Dependencies
+import json
+import gzip
+import time
+import queue
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+def make_status(i: int, created: datetime, accounts: list, rng: random.Random) -> dict:
+    """
+    Creates a synthetic status posted at 'created' by one of 'accounts'.
+    """
+    millis = int(created.timestamp() * 1000)
+    # Mastodon ids: milliseconds since the epoch, shifted by 16 bits, plus a sequence
+    status_id = str((millis << 16) + rng.randint(0, 0xFFFF))
+    tags = [{"name": f"tag{rng.randint(0, 20)}"} for _ in range(rng.randint(0, 3))]
+    tag_links = " ".join(
+        f'<a href="https://mock.social/tags/{t["name"]}" class="mention hashtag" rel="tag">#<span>{t["name"]}</span></a>'
+        for t in tags
+    )
+    return {
+        "id": status_id,
+        "created_at": created.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+        "edited_at": None,
+        "language": rng.choice(["en", "en", "en", "de", "fr"]),
+        "visibility": "public",
+        "content": f"<p>Status number {i} with some words in it {tag_links}</p>",
+        "replies_count": rng.randint(0, 50),
+        "reblogs_count": rng.randint(0, 500),
+        "favourites_count": rng.randint(0, 1000),
+        "account": rng.choice(accounts),
+        "tags": tags,
+        "mentions": [],
+        "media_attachments": [],
+        "emojis": [],
+        "card": None,
+        "poll": None,
+        "reblog": None
+    }
+
+def make_statuses(n_statuses: int = 2000, n_accounts: int = 100,
+                  seconds_apart: float = 2, seed: int = 0) -> list:
+    """
+    Creates a list of synthetic statuses, newest first, posted
+    'seconds_apart' seconds after each other until the current time,
+    by 'n_accounts' different accounts.
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    accounts = []
+    for i in range(n_accounts):
+        created = now - timedelta(days = rng.randint(10, 2000))
+        accounts.append({
+            "id": str(100000 + i),
+            "username": f"user{i}",
+            "acct": f"user{i}",
+            "bot": rng.random() < 0.05,
+            "created_at": created.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+            "followers_count": rng.randint(0, 50000),
+            "following_count": rng.randint(0, 2000),
+            "statuses_count": rng.randint(1, 20000),
+            "last_status_at": now.strftime("%Y-%m-%d")
+        })
+    statuses = []
+    for i in range(n_statuses):
+        created = now - timedelta(seconds = i * seconds_apart)
+        statuses.append(make_status(i, created, accounts, rng))
+    # keep the timeline ordered by id, as the real one
+    statuses.sort(key = lambda status: int(status["id"]), reverse = True)
+    return statuses
+
+def paginate(statuses: list, limit: int, max_id: str = None, min_id: str = None, 
+             since_id: str = None) -> list:
+    """
+    Selects statuses from a list ordered newest first, as the Mastodon API
+    does for 'limit', 'max_id', 'since_id' and 'min_id': with 'min_id', the 
+    statuses immediately newer than 'min_id' are returned, otherwise the 
+    newest ones.
+    """
+    selected = statuses
+    if max_id is not None:
+        selected = [s for s in selected if int(s["id"]) < int(max_id)]
+    if since_id is not None:
+        selected = [s for s in selected if int(s["id"]) > int(since_id)]
+    if min_id is not None:
+        selected = [s for s in selected if int(s["id"]) > int(min_id)]
+        return selected[-limit:] if limit > 0 else []
+    return selected[:limit]
+
+class MockMastodon:
+    """
+    This class holds the data and the rate limit state of the mock server.
+    - 'statuses' is the public timeline, newest first; if None, it is
+    created with make_statuses().
+    - 'n_trending' is the number of statuses that are returned as trending.
+    - 'rate_limit' and 'window_seconds' define how many requests are
+    allowed per window; requests above the limit get a 429 response.
+    - 'error_rate' is the share of requests that get a 503 response, at
+    random, to test the retries of failed requests.
+    - 'latency_seconds' is the average time taken to answer a request, to
+    simulate the network and the server; each request takes between half
+    and one and a half times this.
+    - 'trending' is the list of trending statuses, e.g. from a recording
+    (see load_recording()); if None, 'n_trending' statuses are sampled.
+    New statuses can be posted with post_status(), or every few seconds
+    with start_posting(); they are added to the timeline and sent to the
+    clients of the public stream.
+    """
+    def __init__(self, statuses: list = None, n_trending: int = 200,
+                 rate_limit: int = 300, window_seconds: float = 300, seed: int = 0, 
+                 error_rate: float = 0, latency_seconds: float = 0, 
+                 trending: list = None) -> None:
+        self.statuses = statuses if statuses is not None else make_statuses(seed = seed)
+        rng = random.Random(seed)
+        if trending is not None:
+            self.trending = trending
+        else:
+            self.trending = rng.sample(self.statuses, min(n_trending, len(self.statuses)))
+        self.latency_seconds = latency_seconds
+        self.latency_rng = random.Random(seed)
+        self.rate_limit = rate_limit
+        self.window_seconds = window_seconds
+        self.remaining = rate_limit
+        self.reset_at = datetime.now(timezone.utc) + timedelta(seconds = window_seconds)
+        self.error_rate = error_rate
+        self.error_rng = random.Random(seed)
+        self.n_requests = 0
+        self.lock = threading.Lock()
+        # streaming: accounts of new statuses, and a queue per client of the stream
+        self.accounts = list({s["account"]["id"]: s["account"] for s in self.statuses}.values())
+        self.post_rng = random.Random(seed + 1)
+        self.subscribers = []
+        self.posting = threading.Event()
+
+    def post_status(self) -> dict:
+        # adds a new status to the timeline, and sends it to the stream
+        with self.lock:
+            status = make_status(len(self.statuses), datetime.now(timezone.utc), self.accounts, self.post_rng)
+            # a new list, so that requests being answered are not affected
+            self.statuses = [status] + self.statuses
+            for subscriber in self.subscribers:
+                subscriber.put(status)
+        return status
+
+    def start_posting(self, interval: float = 0.05) -> None:
+        # posts a new status every 'interval' seconds in a background thread
+        self.posting.set()
+        def post():
+            while self.posting.is_set():
+                self.post_status()
+                time.sleep(interval)
+        threading.Thread(target = post, daemon = True).start()
+
+    def stop_posting(self) -> None:
+        self.posting.clear()
+
+    def subscribe(self) -> queue.Queue:
+        # a queue of the new statuses, for a client of the stream
+        subscriber = queue.Queue()
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue) -> None:
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def take_latency(self) -> float:
+        # returns the time to wait before answering a request
+        if self.latency_seconds <= 0:
+            return 0.0
+        with self.lock:
+            return self.latency_seconds * self.latency_rng.uniform(0.5, 1.5)
+
+    def take_error(self) -> bool:
+        # returns True if the request should fail with a server error
+        with self.lock:
+            return self.error_rng.random() < self.error_rate
+
+    def take_rate_limit(self) -> tuple:
+        # counts a request, returns if it is allowed and the rate limit headers
+        with self.lock:
+            now = datetime.now(timezone.utc)
+            if now >= self.reset_at:
+                self.remaining = self.rate_limit
+                self.reset_at = now + timedelta(seconds = self.window_seconds)
+            self.n_requests += 1
+            allowed = self.remaining > 0
+            if allowed:
+                self.remaining -= 1
+            headers = {
+                "x-ratelimit-limit": str(self.rate_limit),
+                "x-ratelimit-remaining": str(self.remaining),
+                "x-ratelimit-reset": self.reset_at.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+            }
+        return allowed, headers
+
+    def respond(self, path: str, query: dict):
+        # returns the status code and body for a GET request, or None if not found
+        def arg(name, default = None):
+            return query[name][0] if name in query else default
+        limit = min(int(arg("limit", 20)), 40)
+        parts = path.strip("/").split("/")
+        if parts == ["api", "v1", "trends", "statuses"]:
+            offset = int(arg("offset", 0))
+            return 200, self.trending[offset:offset + limit]
+        if parts == ["api", "v1", "timelines", "public"]:
+            return 200, paginate(self.statuses, limit, arg("max_id"), arg("min_id"), arg("since_id"))
+        if len(parts) == 5 and parts[:3] == ["api", "v1", "accounts"] and parts[4] == "statuses":
+            account_statuses = [s for s in self.statuses if s["account"]["id"] == parts[3]]
+            return 200, paginate(account_statuses, limit, arg("max_id"), arg("min_id"), arg("since_id"))
+        return None
+
+def save_recording(statuses: list, trending: list, path: str) -> None:
+    """
+    Saves a timeline, newest first, and a list of trending statuses to a
+    compressed json file, which can be replayed with load_recording().
+    """
+    with gzip.open(path, "wt", encoding = "utf-8") as output:
+        json.dump({"statuses": statuses, "trending": trending}, output)
+
+def load_recording(path: str) -> tuple:
+    """
+    Loads a recording saved with save_recording(), and returns the timeline
+    and the trending statuses, to be passed as 'statuses' and 'trending'
+    to MockMastodon.
+    """
+    with gzip.open(path, "rt", encoding = "utf-8") as recording:
+        recorded = json.load(recording)
+    return recorded["statuses"], recorded["trending"]
+
+def recording_from_collection(trending_data: dict, adjacent_data: list) -> tuple:
+    """
+    Builds a recording from collected data: the 'data' attribute of a
+    TrendingStatuses object, and a list of the 'data' attributes of
+    AdjacentStatuses objects. The timeline is made of all the statuses
+    seen, newest first, so that the requests of a collection run get the
+    same statuses when replayed.
+    """
+    def as_dict(status):
+        # statuses kept as StatusRecords are saved as dictionaries
+        return status.to_dict() if hasattr(status, "to_dict") else status
+
+    trending = []
+    for batch_no in sorted(trending_data, key = int):
+        trending += [as_dict(status) for status in trending_data[batch_no]]
+    statuses = {status["id"]: status for status in trending}
+    for data in adjacent_data:
+        for ref_id in data:
+            for status in data[ref_id]:
+                statuses[status["id"]] = as_dict(status)
+    timeline = sorted(statuses.values(), key = lambda status: int(status["id"]), reverse = True)
+    return timeline, trending
+
+def make_handler(mock: MockMastodon):
+    # request handler class bound to the given mock data
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body are written separately: without this, each response
+        # on a kept-alive connection is delayed by the client's delayed ACK
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path.rstrip("/") == "/api/v1/streaming/public":
+                return self.stream()
+            result = mock.respond(url.path, parse_qs(url.query))
+            allowed, headers = mock.take_rate_limit()
+            time.sleep(mock.take_latency())
+            if result is None:
+                code, body = 404, {"error": "Record not found"}
+            elif not allowed:
+                code, body = 429, {"error": "Too many requests"}
+            elif mock.take_error():
+                code, body = 503, {"error": "Service unavailable"}
+            else:
+                code, body = result
+            payload = json.dumps(body).encode("utf-8")
+            # conditional requests get an empty 304 response if unchanged
+            etag = '"' + hashlib.md5(payload).hexdigest() + '"'
+            if (code == 200) and (self.headers.get("If-None-Match") == etag):
+                code, payload = 304, b""
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            if code in [200, 304]:
+                self.send_header("ETag", etag)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def stream(self):
+            # server-sent events of the new statuses, until the client disconnects
+            subscriber = mock.subscribe()
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write_chunk(text):
+                data = text.encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            try:
+                write_chunk(":)\n")
+                while True:
+                    try:
+                        status = subscriber.get(timeout = 1)
+                    except queue.Empty:
+                        # heartbeat, as the real server sends
+                        write_chunk(":thump\n")
+                    else:
+                        write_chunk("event: update\ndata: " + json.dumps(status) + "\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                mock.unsubscribe(subscriber)
+
+        def log_message(self, format, *args):
+            # keep the output of the test scripts readable
+            pass
+
+    return MockHandler
+
+def start_server(mock: MockMastodon = None, port: int = 0) -> tuple:
+    """
+    Starts the mock server in a background thread and returns the server
+    and its URL, which can be passed as 'server' to the collection classes.
+    With port 0, a free port is chosen. Call server.shutdown() to stop it.
+    """
+    if mock is None:
+        mock = MockMastodon()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(mock))
+    server.daemon_threads = True
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Run a local mock Mastodon API server.")
+    parser.add_argument("--port", type = int, default = 8000)
+    parser.add_argument("--rate-limit", type = int, default = 300)
+    parser.add_argument("--window-seconds", type = float, default = 300)
+    parser.add_argument("--error-rate", type = float, default = 0)
+    parser.add_argument("--latency", type = float, default = 0, 
+                        help = "average seconds taken to answer a request")
+    parser.add_argument("--recording", default = None, 
+                        help = "replay a recording saved with save_recording() instead of synthetic statuses")
+    parser.add_argument("--post-interval", type = float, default = 0, 
+                        help = "post a new status to the timeline and the stream every so many seconds")
+    args = parser.parse_args()
+
+    statuses, trending = None, None
+    if args.recording is not None:
+        statuses, trending = load_recording(args.recording)
+    mock = MockMastodon(statuses = statuses, trending = trending, 
+                        rate_limit = args.rate_limit, window_seconds = args.window_seconds, 
+                        error_rate = args.error_rate, latency_seconds = args.latency)
+    if args.post_interval > 0:
+        mock.start_posting(args.post_interval)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(mock))
+    print(f"Mock Mastodon server running on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,45 @@
+"""
+This script is designed to test the asynchronous engine of
+AdjacentStatuses against a local mock server, by comparing
+its data with the data of the default, synchronous engine.
+"""
+
+# Dependencies
+from time import perf_counter
+
+# Define path to original modules
+import sys
+sys.path.append("../../")
+
+from src.trending_statuses import TrendingStatuses
+from src.adjacent_statuses import AdjacentStatuses
+from mock_server import MockMastodon, start_server
+
+# Run the test
+if __name__ == "__main__":
+
+    # a rate limit low enough to be reached during the test
+    server, url = start_server(MockMastodon(rate_limit = 150, window_seconds = 5))
+
+    trending_statuses = TrendingStatuses(server = url)
+    trending_statuses.get_data(max_batches = 5, n_per_batch = 40)
+
+    for mode in ["previous", "subsequent"]:
+        for focus in ["no", "yes"]:
+            start = perf_counter()
+            sync_statuses = AdjacentStatuses(reference = trending_statuses)
+            sync_statuses.get_data(mode = mode, focus_accounts = focus, buffer_seconds = 1)
+            sync_time = perf_counter() - start
+
+            start = perf_counter()
+            async_statuses = AdjacentStatuses(reference = trending_statuses)
+            async_statuses.get_data(mode = mode, focus_accounts = focus, buffer_seconds = 1,
+                                    engine = "async", max_concurrency = 20)
+            async_time = perf_counter() - start
+
+            assert list(sync_statuses.data) == list(async_statuses.data)
+            assert sync_statuses.data == async_statuses.data
+            print(f"mode: {mode}, account focus: {focus}: same data for {len(sync_statuses.data)} statuses",
+                  f"(sync: {sync_time:.2f}s, async: {async_time:.2f}s)")
+
+    server.shutdown()
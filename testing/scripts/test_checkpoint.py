@@ -0,0 +1,81 @@
+"""
+This script is designed to test the checkpoints of AdjacentPlanner
+against a local mock server: a job is interrupted partway, as by a crash,
+resumed from its last periodic checkpoint with from_checkpoint(), and its
+data are compared with the data of the same job run without interruption.
+"""
+
+# Dependencies
+import tempfile
+import threading
+
+# Define path to original modules
+import sys
+sys.path.append("../../")
+
+from src.trending_statuses import TrendingStatuses
+from src.adjacent_statuses import AdjacentStatuses
+from src.adjacent_planner import AdjacentPlanner
+from mock_server import MockMastodon, start_server
+
+class Interruption(Exception):
+    # Raised in place of a request, to interrupt a job
+    pass
+
+def interrupt_after(n_tasks):
+    # Makes the tasks of AdjacentPlanner.run() raise an Interruption after
+    # the first 'n_tasks'; returns the original method, to restore it
+    collect_windows = AdjacentStatuses._collect_windows
+    counter = {"tasks": 0}
+    lock = threading.Lock()
+    def interrupted(self, *args, **kwargs):
+        with lock:
+            counter["tasks"] += 1
+            if counter["tasks"] > n_tasks:
+                raise Interruption()
+        return collect_windows(self, *args, **kwargs)
+    AdjacentStatuses._collect_windows = interrupted
+    return collect_windows
+
+# Run the test
+if __name__ == "__main__":
+
+    mock = MockMastodon(rate_limit = 10000)
+    server, url = start_server(mock)
+
+    trending_statuses = TrendingStatuses(server = url)
+    trending_statuses.get_data(max_batches = 5, n_per_batch = 40)
+
+    # the job without interruption
+    planner = AdjacentPlanner(reference = trending_statuses)
+    planner.run(coalesce = True, buffer_seconds = 1)
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        # the job interrupted partway, after some periodic checkpoints
+        collect_windows = interrupt_after(100)
+        interrupted_planner = AdjacentPlanner(reference = trending_statuses)
+        try:
+            interrupted_planner.run(coalesce = True, buffer_seconds = 1,
+                                    checkpoint_dir = checkpoint_dir, checkpoint_every = 20)
+            raise AssertionError("The job was not interrupted.")
+        except Interruption:
+            print("Job interrupted.")
+        finally:
+            AdjacentStatuses._collect_windows = collect_windows
+
+        # the job resumed from its checkpoint: only what was not saved is requested
+        resumed_planner = AdjacentPlanner.from_checkpoint(checkpoint_dir)
+        n_saved = {combination: len(adjacent_statuses.data)
+                   for combination, adjacent_statuses in resumed_planner.results.items()}
+        assert 0 < sum(n_saved.values()) < sum([len(a.data) for a in planner.results.values()])
+        resumed_planner.run(coalesce = True, buffer_seconds = 1)
+
+    for combination, adjacent_statuses in planner.results.items():
+        resumed_statuses = resumed_planner.results[combination]
+        assert list(adjacent_statuses.data) == list(resumed_statuses.data)
+        assert adjacent_statuses.data == resumed_statuses.data
+        print(f"mode: {combination[0]}, account focus: {combination[1]}: same data for",
+              f"{len(adjacent_statuses.data)} reference statuses,",
+              f"{n_saved[combination]} of them restored from the checkpoint")
+
+    server.shutdown()
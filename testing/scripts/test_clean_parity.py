@@ -0,0 +1,130 @@
+"""
+This script is designed to test that the faster steps of the data
+cleaning give the same results as the steps they replaced:
+- the text extraction with a single html parse, compared with the three
+get_..._text() functions
+- clean_data() in a process pool, compared with clean_data() in this
+process, on data read from csv and from Feather
+- the decoding of the list columns with a cached literal parser, compared
+with the counts and tag strings of eval()
+"""
+
+# Dependencies
+import io
+import random
+import numpy as np
+import pandas as pd
+
+# Define path to original modules
+import sys
+sys.path.append("../../")
+
+from src.data_cleaning import (extract_texts, get_stripped_text, get_annotated_text,
+                               get_text_no_links, clean_data, decode_list,
+                               decode_list_column, list_lengths, get_tag_info)
+from src.status_table import statuses_to_table, arrow_to_pandas
+from src.processed_store import processed_table
+from mock_server import make_statuses
+
+import warnings
+from bs4 import MarkupResemblesLocatorWarning
+warnings.filterwarnings("ignore", category = MarkupResemblesLocatorWarning)
+
+# pieces of status contents, as found in the html of the API, with
+# hashtags, mentions, links, nested tags, comments and unclosed tags
+HTML_PIECES = [
+    '<p>', '</p>', 'hello ', ' world', '<br>', '&amp; &lt;', 'é', '<b>', '</b>', '<a>', '</a>',
+    '<a href="x" class="mention u-url">@<span>bob</span></a>',
+    '<a class="hashtag" href="t">#<span>tag</span></a>',
+    '<a href="http://e.com"><span class="invisible">https://</span>e.com</a>',
+    '<a class="hashtag">word</a>', '<span class="h-card"><a class="u-url mention">@x</a></span>',
+    '<!-- c -->', '<![CDATA[cd]]>', '<script>s</script>', '<ruby>r<rt>t</rt></ruby>'
+]
+
+# values of the list columns: lists as in Feather files, their strings as
+# in csv files, and other literals, malformed strings and missing values
+LIST_VALUES = [
+    [], [{"name": "a"}], [{"name": " a "}, {"name": "b"}], [{"name": None}], [{"x": 1}], ["s"],
+    None, np.nan, 3, "[]", "[{'name': 'x', 'url': 'u'}]", "[{'name': 'x'}, {'name': 'y '}]",
+    "({'name': 'tup'},)", "{'name': 'd'}", "'str'", "None", "bad", "[{'nam': 1}]", "",
+    "[{'name': 1}]", "()", "{}"
+]
+
+def eval_count_items(content):
+    # The number of list items, as counted with eval() before the cached parser
+    if type(content) == list:
+        return len(content)
+    elif type(content) == str:
+        try:
+            eval_list = eval(content)
+            if type(eval_list) == list:
+                return len(eval_list)
+            else:
+                return pd.NA
+        except:
+            return pd.NA
+    else:
+        return pd.NA
+
+def eval_tags_str(content):
+    # The tag names separated by whitespace, as found with eval() before the cached parser
+    if type(content) == list:
+        list_of_dicts = content
+    elif type(content) == str:
+        try:
+            list_of_dicts = eval(content)
+        except:
+            list_of_dicts = []
+    else:
+        list_of_dicts = []
+    try:
+        tag_name = " "
+        for dt in list_of_dicts:
+            tag_name += dt["name"] + " "
+        return tag_name.strip()
+    except:
+        return ""
+
+def separate_texts(content):
+    # The stripped, annotated and plain texts of a content, with the three functions
+    df = pd.DataFrame({"content": [content]})
+    df = get_text_no_links(get_annotated_text(get_stripped_text(df)))
+    return tuple(df.loc[0, ["content_stripped", "content_annotated", "content_plain_text"]])
+
+# Run the test
+if __name__ == "__main__":
+
+    # extract_texts() against the three get_..._text() functions
+    rng = random.Random(1)
+    contents = ["".join([rng.choice(HTML_PIECES) for _ in range(rng.randint(0, 12))]) for _ in range(3000)]
+    contents += [None, float("nan"), 5, ""]
+    for content in contents:
+        assert extract_texts(content) == separate_texts(content), content
+    print(f"extract_texts: same texts for {len(contents)} html fragments")
+
+    # clean_data() in a process pool against clean_data() in this process,
+    # with chunks of several sizes, the smaller ones lacking values found
+    # in others, e.g. missing counts, so that their data types differ
+    df = statuses_to_table([make_statuses(n_statuses = 6000)]).to_pandas()
+    readers = {
+        "csv": lambda: pd.read_csv(io.StringIO(df.to_csv()), index_col = 0),
+        "Feather": lambda: arrow_to_pandas(processed_table(df))
+    }
+    for source, read in readers.items():
+        serial = clean_data(read())
+        for chunk_size in [37, 500, 2000]:
+            parallel = clean_data(read(), n_jobs = 4, chunk_size = chunk_size)
+            pd.testing.assert_frame_equal(serial, parallel)
+            print(f"clean_data ({source}): same data with n_jobs = 4, chunks of {chunk_size} rows")
+
+    # decode_list(), list_lengths() and the tag strings against eval()
+    for value in LIST_VALUES:
+        if isinstance(value, str) and (eval_count_items(value) is not pd.NA):
+            assert decode_list(value) == eval(value), value
+    rng = random.Random(2)
+    for _ in range(2000):
+        values = pd.Series([rng.choice(LIST_VALUES) for _ in range(rng.randint(0, 6))], dtype = object)
+        pd.testing.assert_series_equal(list_lengths(decode_list_column(values)), values.map(eval_count_items))
+        tags_str = get_tag_info(pd.DataFrame({"tags": values}))["tags_str"]
+        pd.testing.assert_series_equal(tags_str, values.map(eval_tags_str), check_names = False)
+    print("decode_list: same counts and tag strings as eval() for 2000 columns of random values")
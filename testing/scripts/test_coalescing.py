@@ -0,0 +1,64 @@
+"""
+This script is designed to test the coalescing of requests into shared
+windows against a local mock server, by comparing the data of
+AdjacentStatuses and AdjacentPlanner with coalesced requests with the
+data of one request per reference status, and counting the requests
+sent to the server.
+"""
+
+# Dependencies
+from time import perf_counter
+
+# Define path to original modules
+import sys
+sys.path.append("../../")
+
+from src.trending_statuses import TrendingStatuses
+from src.adjacent_statuses import AdjacentStatuses
+from src.adjacent_planner import AdjacentPlanner, ALL_COMBINATIONS
+from mock_server import MockMastodon, start_server
+
+# Run the test
+if __name__ == "__main__":
+
+    # a rate limit high enough not to be reached, so that only the requests are timed
+    mock = MockMastodon(rate_limit = 10000)
+    server, url = start_server(mock)
+
+    trending_statuses = TrendingStatuses(server = url)
+    trending_statuses.get_data(max_batches = 5, n_per_batch = 40)
+
+    single_data = {}
+    for mode, focus in ALL_COMBINATIONS:
+        n_before = mock.n_requests
+        start = perf_counter()
+        single_statuses = AdjacentStatuses(reference = trending_statuses)
+        single_statuses.get_data(mode = mode, focus_accounts = focus, buffer_seconds = 1)
+        single_time = perf_counter() - start
+        single_requests = mock.n_requests - n_before
+
+        n_before = mock.n_requests
+        start = perf_counter()
+        coalesced_statuses = AdjacentStatuses(reference = trending_statuses)
+        coalesced_statuses.get_data(mode = mode, focus_accounts = focus, buffer_seconds = 1, coalesce = True)
+        coalesced_time = perf_counter() - start
+        coalesced_requests = mock.n_requests - n_before
+
+        assert list(single_statuses.data) == list(coalesced_statuses.data)
+        assert single_statuses.data == coalesced_statuses.data
+        assert coalesced_requests < single_requests
+        single_data[(mode, focus)] = single_statuses.data
+        print(f"mode: {mode}, account focus: {focus}: same data for {len(single_statuses.data)}",
+              f"reference statuses with {coalesced_requests} requests instead of {single_requests}",
+              f"(single: {single_time:.2f}s, coalesced: {coalesced_time:.2f}s)")
+
+    # all combinations in one planned job, with coalesced requests
+    n_before = mock.n_requests
+    planner = AdjacentPlanner(reference = trending_statuses)
+    planner.run(coalesce = True, buffer_seconds = 1)
+    for combination, adjacent_statuses in planner.results.items():
+        assert list(adjacent_statuses.data) == list(single_data[combination])
+        assert adjacent_statuses.data == single_data[combination]
+    print(f"planner: same data for all combinations with {mock.n_requests - n_before} requests")
+
+    server.shutdown()
@@ -15,9 +15,10 @@ from scripts.collect_data import (
     prep_dirs, 
     check_app_token, 
     get_trending, 
-    get_adjacent, 
+    get_all_adjacent, 
     save_raw_and_processed
 )
+from src.response_cache import ResponseCache
 
 # Parameters for testing
 # Small data size for quick operation
@@ -30,15 +31,18 @@ if __name__ == "__main__":
     # prep
     prep_dirs()
     app_token = check_app_token()
+    # repeated test runs reuse the trending statuses of the last few minutes
+    cache = ResponseCache("../data/cache/responses.db")
 
     # trending
     time_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    trending_statuses = get_trending(app_token = app_token, max_batches = MAX_BATCHES, n_per_batch = N_PER_BATCH)
+    trending_statuses = get_trending(app_token = app_token, max_batches = MAX_BATCHES, n_per_batch = N_PER_BATCH, 
+                                     cache = cache)
     save_raw_and_processed(trending_statuses, "trending_statuses", time_stamp)
 
-    # adjacent, run for each mode and focus, name accordingly
-    for mode in ["previous", "subsequent"]:
-        for focus in ["no", "yes"]:
-            type_name = f"adjacent_statuses_{mode}_acc_focus_{focus}"
-            adjacent_statuses = get_adjacent(reference = trending_statuses, mode = mode, focus_accounts = focus)
-            save_raw_and_processed(adjacent_statuses, type_name, time_stamp)
\ No newline at end of file
+    # adjacent, run for all modes and focus in one job, name accordingly
+    all_adjacent = get_all_adjacent(reference = trending_statuses)
+    for (mode, focus), adjacent_statuses in all_adjacent.items():
+        type_name = f"adjacent_statuses_{mode}_acc_focus_{focus}"
+        save_raw_and_processed(adjacent_statuses, type_name, time_stamp, 
+                               metadata = {"mode": mode, "focus_accounts": focus})
\ No newline at end of file
@@ -0,0 +1,75 @@
+"""
+This script is designed to test the skipping of reference statuses
+collected in previous runs against a local mock server: CollectionState
+is checked on its own, then AdjacentPlanner jobs with a state only
+request the reference statuses that are not recorded as collected, as
+collect_data.py does from one run to the next.
+"""
+
+# Dependencies
+import os
+import random
+import tempfile
+
+# Define path to original modules
+import sys
+sys.path.append("../../")
+
+from src.trending_statuses import TrendingStatuses
+from src.adjacent_planner import AdjacentPlanner
+from src.collection_state import CollectionState
+from mock_server import MockMastodon, start_server
+
+# Run the test
+if __name__ == "__main__":
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        state = CollectionState(os.path.join(state_dir, "collection_state.db"))
+
+        # filter_new() keeps the order of the ids, and each combination apart
+        state.mark_collected(["2", "4"], "previous", "no")
+        assert state.filter_new(["5", "4", "3", "2", "1"], "previous", "no") == ["5", "3", "1"]
+        assert state.filter_new(["5", "4", "3", "2", "1"], "previous", "yes") == ["5", "4", "3", "2", "1"]
+        assert state.is_collected("4", "previous", "no") and not state.is_collected("4", "subsequent", "no")
+        state.clear()
+        print("CollectionState: collected ids filtered out for their combination only")
+
+        mock = MockMastodon(rate_limit = 10000)
+        server, url = start_server(mock)
+
+        # a first run, whose complete reference statuses are recorded once collected
+        first_trending = TrendingStatuses(server = url)
+        first_trending.get_data(max_batches = 5, n_per_batch = 40)
+        first_planner = AdjacentPlanner(reference = first_trending, state = state)
+        first_planner.run(coalesce = True, buffer_seconds = 1)
+        collected = {}
+        for (mode, focus), adjacent_statuses in first_planner.results.items():
+            collected[(mode, focus)] = set(adjacent_statuses.complete_ids())
+            state.mark_collected(adjacent_statuses.complete_ids(), mode, focus)
+
+        # a second run, with half of the trending statuses new
+        rng = random.Random(1)
+        old_trending = rng.sample(mock.trending, len(mock.trending) // 2)
+        new_trending = [status for status in mock.statuses if status not in mock.trending]
+        mock.trending = old_trending + rng.sample(new_trending, len(mock.trending) - len(old_trending))
+        second_trending = TrendingStatuses(server = url)
+        second_trending.get_data(max_batches = 5, n_per_batch = 40)
+        second_planner = AdjacentPlanner(reference = second_trending, state = state)
+        for combination, adjacent_statuses in second_planner.results.items():
+            expected = [s_id for s_id in adjacent_statuses.ref_ids if s_id not in collected[combination]]
+            assert list(adjacent_statuses.ref_ids_rem) == expected
+        second_planner.run(coalesce = True, buffer_seconds = 1)
+        for combination, adjacent_statuses in second_planner.results.items():
+            assert len(set(adjacent_statuses.data) & collected[combination]) == 0
+            print(f"mode: {combination[0]}, account focus: {combination[1]}:",
+                  f"{len(adjacent_statuses.data)} of {len(adjacent_statuses.ref_ids)} reference statuses",
+                  "collected, the others were collected by the first run")
+
+        # with 'recollect', the state is ignored
+        recollect_planner = AdjacentPlanner(reference = second_trending, state = state, recollect = True)
+        for adjacent_statuses in recollect_planner.results.values():
+            assert list(adjacent_statuses.ref_ids_rem) == list(adjacent_statuses.ref_ids)
+        print("recollect: all reference statuses planned")
+
+        state.close()
+        server.shutdown()
@@ -0,0 +1,56 @@
+"""
+This script is designed to test MultiInstanceCollector against several
+local mock servers, by comparing its data with the data collected from
+each server on its own.
+"""
+
+# Dependencies
+from time import perf_counter
+
+# Define path to original modules
+import sys
+sys.path.append("../../")
+
+from src.trending_statuses import TrendingStatuses
+from src.adjacent_planner import AdjacentPlanner
+from src.multi_instance import MultiInstanceCollector
+from mock_server import MockMastodon, start_server
+
+# Parameters for testing
+N_SERVERS = 3
+MAX_BATCHES = 3
+
+# Run the test
+if __name__ == "__main__":
+
+    # servers with different data
+    servers, urls = [], []
+    for seed in range(N_SERVERS):
+        server, url = start_server(MockMastodon(seed = seed, rate_limit = 10000))
+        servers.append(server)
+        urls.append(url)
+
+    start = perf_counter()
+    collector = MultiInstanceCollector(servers = urls, max_workers = 12)
+    collector.run(max_batches = MAX_BATCHES, verbose = False)
+    print(f"Collected {N_SERVERS} servers in {perf_counter() - start:.2f}s")
+    assert len(collector.errors) == 0
+
+    for url in urls:
+        trending_statuses = TrendingStatuses(server = url)
+        trending_statuses.get_data(max_batches = MAX_BATCHES, verbose = False)
+        assert collector.trending[url].data == trending_statuses.data
+        planner = AdjacentPlanner(reference = trending_statuses)
+        planner.run(coalesce = True, verbose = False)
+        for combination, adjacent_statuses in planner.results.items():
+            assert collector.adjacent[url][combination].data == adjacent_statuses.data
+
+    df = collector.generate_df()
+    assert sorted(df["server"].unique()) == sorted(urls)
+    for combination in collector.combinations:
+        df_adjacent = collector.generate_df(combination)
+        print(f"{combination}: {len(df_adjacent)} statuses from {df_adjacent['server'].nunique()} servers")
+    print(f"Same data as single-server runs for {N_SERVERS} servers, {len(df)} trending statuses")
+
+    for server in servers:
+        server.shutdown()
@@ -0,0 +1,66 @@
+"""
+This script is designed to test StreamingStatuses against a local mock
+server that posts new statuses to its public stream, by comparing the
+adjacent statuses read from the captured stream with those requested
+from the timeline by AdjacentStatuses.
+"""
+
+# Dependencies
+from time import sleep
+
+# Define path to original modules
+import sys
+sys.path.append("../../")
+
+from src.trending_statuses import TrendingStatuses
+from src.adjacent_statuses import AdjacentStatuses
+from src.streaming_statuses import StreamingStatuses
+from mock_server import MockMastodon, start_server
+
+# Run the test
+if __name__ == "__main__":
+
+    mock = MockMastodon(rate_limit = 10000)
+    server, url = start_server(mock)
+
+    # capture the stream while new statuses are posted
+    streaming_statuses = StreamingStatuses(server = url)
+    streaming_statuses.start()
+    sleep(0.5)
+    mock.start_posting(interval = 0.02)
+    sleep(5)
+    mock.stop_posting()
+    sleep(1.5)
+    streaming_statuses.stop()
+    print(f"Captured {len(streaming_statuses.data)} statuses from the stream.")
+
+    # reference statuses: every fifth of the statuses posted during the capture,
+    # and some older ones, which the stream does not cover
+    captured = [status for status in mock.statuses if status["id"] in streaming_statuses.data]
+    older = mock.statuses[len(captured) + 10:len(captured) + 20]
+    trending_statuses = TrendingStatuses(server = url)
+    trending_statuses.data = {1: captured[::5] + older}
+
+    for mode in ["previous", "subsequent"]:
+        requested = AdjacentStatuses(reference = trending_statuses)
+        requested.get_data(mode = mode, focus_accounts = "no")
+
+        local = AdjacentStatuses(reference = trending_statuses)
+        n_filled = streaming_statuses.fill(local, mode = mode, focus_accounts = "no")
+        # the statuses not covered by the stream are requested
+        n_requested = len(local.ref_ids_rem)
+        if n_requested > 0:
+            local.get_data(mode = mode, focus_accounts = "no")
+
+        assert local.data == requested.data
+        print(f"mode: {mode}: same data for {len(local.data)} statuses,",
+              f"{n_filled} from the stream, {n_requested} requested")
+
+        # account timelines have unlisted statuses and reblogs, which the stream does not have
+        try:
+            streaming_statuses.fill(AdjacentStatuses(reference = trending_statuses), mode = mode, focus_accounts = "yes")
+            raise AssertionError("filling with account focus should fail")
+        except ValueError:
+            print(f"mode: {mode}: account focus is not filled from the stream")
+
+    server.shutdown()